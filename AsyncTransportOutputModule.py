@@ -0,0 +1,462 @@
+import asyncio
+import struct
+
+from TransportOutputModule import TransportOutputModule, StaleOutputImageError
+from ModbusConnection import DEFAULT_RETRY_POLICY, ModbusTimeoutError
+
+
+class AsyncModbusClient:
+    """
+    Minimaler Modbus TCP Client auf Basis von asyncio Streams. Unterstützt die Funktionen, die das TransportOutputModul benötigt
+    (Read Holding Registers, Write Single Register, Write Multiple Registers).
+    Wie beim ModbusClient von pyModbusTCP liefern die Anfragen None zurück, wenn sie fehlschlagen.
+    Die Verbindung bleibt offen und wird nach einem Fehler bei der nächsten Anfrage neu aufgebaut.
+    """
+
+    READ_HOLDING_REGISTERS = 0x03
+    WRITE_SINGLE_REGISTER = 0x06
+    WRITE_MULTIPLE_REGISTERS = 0x10
+
+    def __init__(self, host, port = 502, unit_id = 1, timeout = 1.0):
+        """
+        Konstruktor des AsyncModbusClients.
+
+        :param host Ip-Adresse des Modbus Knoten (String)
+        :param port TCP Port des Modbus Knoten
+        :param unit_id Modbus Unit Id
+        :param timeout Timeout einer Anfrage in Sekunden
+        """
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+
+        self.reader = None
+        self.writer = None
+        self.transaction_id = 0
+        #Zählt wie oft die Verbindung (neu) aufgebaut wurde, siehe ModbusConnectionPool.get_generation()
+        self.generation = 0
+        #Pro Verbindung ist immer nur eine Anfrage unterwegs
+        self.lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self.writer is not None
+
+    async def open(self):
+        """
+        Baut die TCP Verbindung auf.
+        :returns True wenn die Verbindung offen ist
+        :rtype bool
+        """
+        if self.writer is None:
+            try:
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                self.reader = self.writer = None
+                return False
+            self.generation += 1
+        return True
+
+    async def connect(self):
+        """
+        Baut die Verbindung auf, falls sie geschlossen ist, ohne eine laufende Anfrage zu stören.
+        :returns Generation der Verbindung danach
+        :rtype int
+        """
+        async with self.lock:
+            await self.open()
+        return self.generation
+
+    async def close(self):
+        """
+        Schließt die TCP Verbindung.
+        """
+        writer = self.writer
+        self.reader = self.writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def request(self, pdu, generation = None):
+        """
+        Schickt eine Modbus PDU und wartet auf die Antwort.
+        :param pdu Modbus PDU (Function Code + Daten)
+        :param generation Generation der Verbindung, mit der die Daten der Anfrage gelesen wurden. Wurde die Verbindung seitdem neu aufgebaut,
+                          wird die Anfrage nicht gesendet
+        :returns Antwort PDU oder None, wenn die Anfrage fehlschlägt oder der Knoten mit einer Exception antwortet
+        :rtype bytes or None
+        :raises StaleOutputImageError wenn sich die Generation der Verbindung geändert hat
+        """
+        async with self.lock:
+            if not await self.open():
+                return None
+            if generation is not None and generation != self.generation:
+                raise StaleOutputImageError("connection to {} was reestablished".format(self.host))
+            self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+            #MBAP Header: Transaction Id, Protocol Id (0), Länge (Unit Id + PDU), Unit Id
+            frame = struct.pack('>HHHB', self.transaction_id, 0, len(pdu) + 1, self.unit_id) + pdu
+            try:
+                self.writer.write(frame)
+                await self.writer.drain()
+                header = await asyncio.wait_for(self.reader.readexactly(7), self.timeout)
+                transaction_id, protocol_id, length, unit_id = struct.unpack('>HHHB', header)
+                response = await asyncio.wait_for(self.reader.readexactly(length - 1), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                #Verbindung ist in einem unbekannten Zustand und wird bei der nächsten Anfrage neu aufgebaut
+                await self.close()
+                return None
+            if transaction_id != self.transaction_id or protocol_id != 0:
+                await self.close()
+                return None
+            #Gesetztes höchstes Bit im Function Code bedeutet Modbus Exception
+            if not response or response[0] != pdu[0]:
+                return None
+            return response
+
+    async def read_holding_registers(self, reg_addr, reg_nb = 1):
+        """
+        Liest reg_nb Holding Register ab reg_addr.
+        :rtype list of int or None
+        """
+        response = await self.request(struct.pack('>BHH', self.READ_HOLDING_REGISTERS, reg_addr, reg_nb))
+        if response is None or len(response) != 2 + 2 * reg_nb:
+            return None
+        return list(struct.unpack('>%dH' % reg_nb, response[2:]))
+
+    async def write_single_register(self, reg_addr, reg_value):
+        """
+        Schreibt ein einzelnes Holding Register.
+        :rtype True or None
+        """
+        response = await self.request(struct.pack('>BHH', self.WRITE_SINGLE_REGISTER, reg_addr, reg_value))
+        return True if response is not None else None
+
+    async def write_multiple_registers(self, regs_addr, regs_value, generation = None):
+        """
+        Schreibt mehrere aufeinanderfolgende Holding Register ab regs_addr.
+        :param generation siehe request()
+        :rtype True or None
+        """
+        pdu = struct.pack('>BHHB', self.WRITE_MULTIPLE_REGISTERS, regs_addr, len(regs_value), 2 * len(regs_value))
+        pdu += struct.pack('>%dH' % len(regs_value), *regs_value)
+        response = await self.request(pdu, generation)
+        return True if response is not None else None
+
+
+class AsyncTransportOutputModule:
+    """
+    asyncio Variante des TransportOutputModuls. Alle Befehle sind Coroutinen und blockieren keinen Thread,
+    so dass viele Routen und Stationsüberwachungen gleichzeitig in einem Prozess laufen können.
+    Die Eingänge werden von einer Scan-Task zyklisch gelesen, auf Signale wird mit wait_for() gewartet.
+
+    Beispiel:
+        async with AsyncTransportOutputModule("192.168.200.236") as tom:
+            await tom.conveyor_forward('A')
+            await tom.wait_for('A', 'end', True, timeout=30)
+    """
+
+    #Adressen, Tabellen und Konstanten werden vom TransportOutputModule übernommen
+    DIGITAL_INPUT_STARTING_ADDRESS = TransportOutputModule.DIGITAL_INPUT_STARTING_ADDRESS
+    DIGITAL_OUTPUT_STARTING_ADDRESS = TransportOutputModule.DIGITAL_OUTPUT_STARTING_ADDRESS
+    DIGITAL_INPUT_WORDS = TransportOutputModule.DIGITAL_INPUT_WORDS
+    DIGITAL_OUTPUT_WORDS = TransportOutputModule.DIGITAL_OUTPUT_WORDS
+    INDEX_CONVEYORS = TransportOutputModule.INDEX_CONVEYORS
+    INDEX_SWITCHES = TransportOutputModule.INDEX_SWITCHES
+    SPEED_GROUPS = TransportOutputModule.SPEED_GROUPS
+    ADDRESS = TransportOutputModule.ADDRESS
+    SENSORS = TransportOutputModule.SENSORS
+
+    def __init__(self, ip_addr, port = 502, cycle_time = 0.05, retry_policy = DEFAULT_RETRY_POLICY):
+        """
+        Konstruktor des AsyncTransportOutputModuls.
+
+        :param ip_addr Ip-Adresse des Modbus Knoten, welche für die Bearbeiten Station zuständig ist (String)
+        :param port TCP Port des Modbus Knoten
+        :param cycle_time Zykluszeit der Scan-Task in Sekunden
+        :param retry_policy RetryPolicy, nach der fehlgeschlagene Anfragen wiederholt werden (siehe TransportOutputModule)
+        """
+        self.host = ip_addr
+        self.client = AsyncModbusClient(ip_addr, port)
+        self.cycle_time = cycle_time
+        self.retry_policy = retry_policy
+
+        #(Gerät, Signalname) -> (Offset, Bitmaske)
+        self.sensors = dict(((device, signal), (offset, mask)) for device, signal, offset, mask in self.SENSORS)
+
+        #Prozessabbild der Eingänge aus dem letzten Scan, Änderungen werden über self.condition gemeldet
+        self.input_image = None
+        self.condition = asyncio.Condition()
+        self.scan_task = None
+        #Wird von close() gesetzt und beendet die Scan-Task auch dann, wenn ihr Abbrechen verloren geht
+        #(asyncio.wait_for() verschluckt vor Python 3.12 ein cancel(), das gleichzeitig mit der Antwort eintrifft)
+        self.stopping = False
+
+        #Lokales Ausgangsabbild wie beim TransportOutputModule, self.lock schützt es zwischen Ändern und Schreiben
+        self.output_image = None
+        self.lock = asyncio.Lock()
+        #Generation der Verbindung, mit der das Ausgangsabbild gelesen wurde, None wenn es neu gelesen werden muss
+        self.output_generation = None
+
+        self.conveyor_speed = dict((i, 0) for i in self.INDEX_CONVEYORS)
+        self.written_speed = {}
+        #Generation der Verbindung, mit der self.written_speed geschrieben wurde
+        self.speed_generation = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self):
+        """
+        Startet die Scan-Task, falls sie noch nicht läuft.
+        """
+        if self.scan_task is None or self.scan_task.done():
+            self.stopping = False
+            self.scan_task = asyncio.get_running_loop().create_task(self.scan_loop())
+
+    async def close(self):
+        """
+        Beendet die Scan-Task und schließt die Verbindung.
+        """
+        if self.scan_task is not None:
+            self.stopping = True
+            self.scan_task.cancel()
+            try:
+                await self.scan_task
+            except asyncio.CancelledError:
+                pass
+            self.scan_task = None
+        await self.client.close()
+
+    async def scan_loop(self):
+        """
+        Liest das Prozessabbild im Abstand von cycle_time und weckt alle wartenden Coroutinen.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            start = loop.time()
+            try:
+                await self.read_process_image()
+            except ModbusTimeoutError as e:
+                #Ein nicht erreichbarer Knoten beendet die Scan-Task nicht, es wird im nächsten Zyklus erneut versucht
+                print("Error scanning process image:", e)
+            await asyncio.sleep(max(0.0, self.cycle_time - (loop.time() - start)))
+
+    async def request_with_retry(self, request, *args):
+        """
+        Führt eine Anfrage des AsyncModbusClients aus und wiederholt sie nach self.retry_policy.
+        :raises ModbusTimeoutError wenn die RetryPolicy keine weiteren Versuche erlaubt
+        :raises StaleOutputImageError siehe AsyncModbusClient.request()
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        attempt = 0
+        while True:
+            result = await request(*args)
+            if result is not None:
+                return result
+            attempt += 1
+            delay = self.retry_policy.get_delay(attempt, loop.time() - start)
+            if delay is None:
+                raise ModbusTimeoutError("{} of register {} on {} failed after {} attempts".format(request.__name__, args[0], self.host, attempt))
+            await asyncio.sleep(delay)
+
+    async def read_registers(self, address, amount):
+        return await self.request_with_retry(self.client.read_holding_registers, address, amount)
+
+    async def write_registers(self, address, values, generation = None):
+        await self.request_with_retry(self.client.write_multiple_registers, address, values, generation)
+
+    async def read_process_image(self):
+        """
+        Liest alle Words der Digitalen Eingänge mit einer Anfrage und benachrichtigt die wartenden Coroutinen.
+        :rtype list of int
+        """
+        image = await self.read_registers(self.DIGITAL_INPUT_STARTING_ADDRESS, self.DIGITAL_INPUT_WORDS)
+        async with self.condition:
+            self.input_image = image
+            self.condition.notify_all()
+        return image
+
+    def get_address(self, index, nr):
+        """
+        Siehe TransportOutputModule.get_address()
+        """
+        try:
+            return self.ADDRESS[index][nr]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError("Unknown device index {!r} or function {!r}".format(index, nr)) from None
+
+    def get_sensor(self, device, signal):
+        try:
+            return self.sensors[(device, signal)]
+        except KeyError:
+            raise ValueError("Unknown signal {!r} of device {!r}".format(signal, device)) from None
+
+    def get_signal(self, device, signal):
+        """
+        Gibt den Wert eines Eingangssignals aus dem letzten Scan zurück.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :returns Wert des Signals oder None, wenn noch nicht gescannt wurde
+        :rtype bool or None
+        """
+        offset, mask = self.get_sensor(device, signal)
+        if self.input_image is None:
+            return None
+        return bool(self.input_image[offset] & mask)
+
+    async def wait_for(self, device, signal, value = True, timeout = None):
+        """
+        Wartet bis das Eingangssignal den Wert value hat. Startet die Scan-Task, falls sie noch nicht läuft.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :param value Wert auf den gewartet wird
+        :param timeout maximale Wartezeit in Sekunden, None für unbegrenzt
+        :raises asyncio.TimeoutError wenn der Wert nicht innerhalb von timeout erreicht wurde
+        """
+        offset, mask = self.get_sensor(device, signal)
+        self.start()
+
+        async def condition():
+            async with self.condition:
+                await self.condition.wait_for(lambda: self.input_image is not None and bool(self.input_image[offset] & mask) == value)
+
+        await asyncio.wait_for(condition(), timeout)
+
+    async def get_output_image(self):
+        """
+        Gibt das lokale Ausgangsabbild zurück. Ist es noch nicht vorhanden, nach einem Schreibfehler veraltet oder wurde die Verbindung
+        seit dem letzten Lesen neu aufgebaut, wird es vorher gelesen, siehe TransportOutputModule.get_output_image()
+        :rtype list of int
+        """
+        #Die Verbindung wird vorher geöffnet, damit ein Reconnect hier bemerkt wird und nicht erst beim Schreiben
+        if self.output_generation != await self.client.connect():
+            await self.resync_output_image()
+        return self.output_image
+
+    async def resync_output_image(self):
+        """
+        Liest alle Words der Digitalen Ausgänge und überschreibt damit das lokale Ausgangsabbild.
+        :rtype list of int
+        """
+        self.output_image = await self.read_registers(self.DIGITAL_OUTPUT_STARTING_ADDRESS, self.DIGITAL_OUTPUT_WORDS)
+        #Generation erst nach dem Lesen merken, da das Lesen selbst die Verbindung aufbauen kann
+        self.output_generation = self.client.generation
+        return self.output_image
+
+    async def change_outputs(self, changes):
+        """
+        Setzt bzw. löscht Bits im Ausgangsabbild und schreibt alle betroffenen Words mit einer Anfrage.
+        Wurde die Verbindung beim Schreiben neu aufgebaut, wird das Ausgangsabbild neu gelesen und die Änderungen darauf angewendet.
+        Schlägt das Schreiben fehl, werden die Änderungen im Ausgangsabbild zurückgenommen und es wird beim nächsten Befehl neu gelesen.
+        :param changes Liste von (Offset, Bitmaske, Wert)
+        :raises ModbusTimeoutError wenn das Schreiben auch nach allen Wiederholungen der RetryPolicy fehlschlägt
+        """
+        first = min(offset for offset, mask, value in changes)
+        last = max(offset for offset, mask, value in changes)
+        async with self.lock:
+            reg = await self.get_output_image()
+            base = list(reg)
+            while True:
+                for offset, mask, value in changes:
+                    if value:
+                        reg[offset] |= mask
+                    else:
+                        reg[offset] &= ~mask
+                try:
+                    await self.write_registers(self.DIGITAL_OUTPUT_STARTING_ADDRESS + first, reg[first:last + 1], self.output_generation)
+                    return
+                except StaleOutputImageError:
+                    #Alle Befehle laufen unter self.lock, das ganze Abbild kann also sofort neu gelesen werden
+                    reg = await self.resync_output_image()
+                    base = list(reg)
+                except ModbusTimeoutError:
+                    #Der Zustand auf dem Modbus ist unbekannt
+                    reg[first:last + 1] = base[first:last + 1]
+                    self.output_generation = None
+                    raise
+
+    async def conveyor_stop(self, conveyor_id):
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
+        await self.change_outputs([(offset, mask_forward, False), (offset, mask_backward, False)])
+
+    async def conveyor_forward(self, conveyor_id):
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
+        await self.change_outputs([(offset, mask_forward, True), (offset, mask_backward, False)])
+
+    async def conveyor_backward(self, conveyor_id):
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
+        await self.change_outputs([(offset, mask_forward, False), (offset, mask_backward, True)])
+
+    async def set_switch(self, switch_id, pos = 0):
+        """
+        Stellt die Weiche auf die Position pos (pos = 0 löst Referenzfahrt aus), siehe TransportOutputModule.set_switch()
+        """
+        if switch_id not in self.INDEX_SWITCHES or pos not in (0, 1, 2, 3):
+            raise ValueError("Unknown switch {!r} or position {!r}".format(switch_id, pos))
+        await self.change_outputs([(offset, mask, i == pos) for i, (offset, mask) in enumerate(self.ADDRESS[switch_id])])
+
+    async def set_seperator(self, seperator_id):
+        offset, mask = self.get_address(seperator_id, 0)
+        await self.change_outputs([(offset, mask, True)])
+
+    async def reset_seperator(self, seperator_id):
+        offset, mask = self.get_address(seperator_id, 0)
+        await self.change_outputs([(offset, mask, False)])
+
+    async def update_conveyor_speed(self, force = False):
+        """
+        Schreibt die geänderten Gruppen der Laufbandspeeds, siehe TransportOutputModule.update_conveyor_speed()
+        :raises ModbusTimeoutError wenn das Schreiben auch nach allen Wiederholungen der RetryPolicy fehlschlägt
+        """
+        async with self.lock:
+            while True:
+                #Nach einem Reconnect werden beide Gruppen geschrieben, da der Knoten neu gestartet sein kann
+                generation = await self.client.connect()
+                if self.speed_generation != generation:
+                    self.written_speed.clear()
+                    self.speed_generation = generation
+
+                for control, first, second in self.SPEED_GROUPS:
+                    speeds = tuple(self.conveyor_speed.get(i) for i in first + second)
+                    if not force and self.written_speed.get(control) == speeds:
+                        continue
+                    requests = [
+                        (self.client.write_single_register, control, int("0x6000",16)),
+                        (self.client.write_single_register, control, int("0x3000",16)),
+                        (self.client.write_multiple_registers, control + 1, list(speeds[:4])),
+                        (self.client.write_single_register, control, int("0x0100",16)),
+                        (self.client.write_single_register, control, int("0x0b00",16)),
+                        (self.client.write_multiple_registers, control + 1, list(speeds[4:])),
+                        (self.client.write_single_register, control, int("0x0900",16))
+                    ]
+                    try:
+                        for request, register, value in requests:
+                            await self.request_with_retry(request, register, value)
+                    except ModbusTimeoutError:
+                        self.written_speed.pop(control, None)
+                        raise
+                    self.written_speed[control] = speeds
+
+                if self.client.generation == generation:
+                    return
+
+    async def set_conveyor_speed(self, conveyor_id, speed):
+        self.conveyor_speed[conveyor_id] = speed
+        await self.update_conveyor_speed()
+
+    async def set_conveyor_speed_all(self, speed):
+        for i in self.INDEX_CONVEYORS:
+            self.conveyor_speed[i] = speed
+        await self.update_conveyor_speed()
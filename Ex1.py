@@ -1,53 +1,59 @@
 from TransportOutputModule import *
-import paho.mqtt.publish as publish
-from time import sleep
+from ProcessImageScanner import ProcessImageScanner
+from MqttTelemetry import TelemetryPublisher
+
+# Upper bounds for the event-driven waits; they only matter if a sensor or switch is broken
+SWITCH_TIMEOUT = 30
+HOMING_TIMEOUT = 30
+WORKPIECE_TIMEOUT = 120
 
 Conveyor = {'A': 0, 'B': 0, 'D': 0, 'E': 0, 'G': 0, 'H': 0, 'I': 0, 'K': 0, 'L': 0, 'N': 0, 'O': 0, 'P': 0, 'T': 0,
             'U': 0, 'V': 0, 'W': 0}
 Switch = {'C': 0, 'F': 0, 'J': 0, 'M': 0, 'Q': 0, 'R': 0, 'S': 0, 'X': 0}
 
+# One persistent MQTT connection for all status messages; publishing never blocks the routing
+status = TelemetryPublisher("192.168.200.161")
+
 tom = TransportOutputModule("192.168.200.236")
 tom.set_conveyor_speed_all(0)
 print(tom.check_conveyor_workpiece_end("B"))
+
+# Scan the sensors in the background so the routing steps react within one scan cycle instead of polling
+scanner = ProcessImageScanner(tom, cycle_time=0.05)
+scanner.start()
+
 def check_workpiece_end_of_conveyor(conveyor_name, next_conveyor_name, switch_name, switch_pre_pos, switch_post_pos):
     # Wait until a workpiece is detected at the end of the conveyor
-    while tom.check_conveyor_workpiece_end(conveyor_name):
-        sleep(0.5)
+    tom.wait_until((conveyor_name, 'end', False), timeout=WORKPIECE_TIMEOUT)
     # Move the switch to the desired position
     tom.set_switch(switch_name, pos=switch_pre_pos)
 
-    sleep(1)
-
     # Update the status of the conveyor and switch
     Conveyor[conveyor_name] = "0"
-    publish.single("Transport_Ingoing/Conveyor_" + conveyor_name + "/Status", Conveyor[conveyor_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Conveyor_" + conveyor_name + "/Status", Conveyor[conveyor_name])
 
-    while not tom.check_switch_position_reached(switch_name):
-        sleep(0.5)
+    # Wait until the switch has reached its position and the workpiece is inside it. position_reached alone may still
+    # report the old position right after the command, but the workpiece can only enter once the new one is reached.
+    tom.wait_all([(switch_name, 'position_reached'), (switch_name, 'workpiece')], timeout=SWITCH_TIMEOUT)
 
     print("Found workpiece at the switch " + switch_name)
     Switch[switch_name] = "Found workpiece at the switch " + switch_name
-    publish.single("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name])
 
-    # Wait until the workpiece reaches inside the switch
-    while not tom.check_switch_workpiece(switch_name):
-        sleep(0.5)
     tom.set_switch(switch_name, pos=switch_post_pos)
 
     # Update the status of the switch
     Switch[switch_name] = "0"
-    publish.single("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name])
 
     # Update the status of the next conveyor
 
     print("Found workpiece at the conveyor " + next_conveyor_name)
     Conveyor[next_conveyor_name] = "Found workpiece at the conveyor " + next_conveyor_name
-    publish.single("Transport_Ingoing/Conveyor_" + next_conveyor_name + "/Status", Conveyor[next_conveyor_name],
-                   hostname="192.168.200.161")
-    sleep(1)
+    status.publish("Transport_Ingoing/Conveyor_" + next_conveyor_name + "/Status", Conveyor[next_conveyor_name])
+
+    # The handoff is done as soon as the workpiece has left the switch
+    tom.wait_until((switch_name, 'workpiece', False), timeout=SWITCH_TIMEOUT)
 
     def main():
         tom = TransportOutputModule("192.168.200.236")
@@ -57,9 +63,13 @@ def check_workpiece_end_of_conveyor(conveyor_name, next_conveyor_name, switch_na
             tom.conveyor_forward(conveyor_id)
             tom.conveyor_stop(conveyor_id) # Move conveyor forward
 
-        for switch_id in ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']:
-            tom.set_switch(switch_id, pos=0)
-        sleep(10)
+        # Home all switches with a single write
+        with tom.batch():
+            for switch_id in ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']:
+                tom.set_switch(switch_id, pos=0)
+        # Continue as soon as every switch reports its reference position
+        tom.wait_all([(switch_id, 'reference_position') for switch_id in ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']],
+                     timeout=HOMING_TIMEOUT)
 
         """check_workpiece_end_of_conveyor("A", "B", "X", 3, 1)
         check_workpiece_end_of_conveyor("U", "V", "Q", 3, 1)
@@ -72,18 +82,19 @@ def check_workpiece_end_of_conveyor(conveyor_name, next_conveyor_name, switch_na
         check_workpiece_end_of_conveyor("P", "VL", "O", 1, 3)"""
 
 
-tom = TransportOutputModule("192.168.200.236")
-tom.set_conveyor_speed_all(0)
-
-for conveyor_id in ['A', 'B', 'D', 'E', 'G', 'H', 'I', 'K', 'L', 'N', 'O', 'P', 'T', 'U', 'V', 'W']:
-    tom.conveyor_forward(conveyor_id)  # Move conveyor forward
-
-for switch_id in ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']:
-    tom.set_switch(switch_id, pos=0)
-    sleep(1)
-    print("checking")
-    check_workpiece_end_of_conveyor("A", "B", "X", 3, 1)
-    check_workpiece_end_of_conveyor("U", "V", "Q", 3, 1)
-
-
+try:
+    # Set the speeds and start all conveyors with a couple of writes instead of one transaction per conveyor
+    with tom.batch():
+        tom.set_conveyor_speed_all(0)
+        for conveyor_id in ['A', 'B', 'D', 'E', 'G', 'H', 'I', 'K', 'L', 'N', 'O', 'P', 'T', 'U', 'V', 'W']:
+            tom.conveyor_forward(conveyor_id)  # Move conveyor forward
 
+    for switch_id in ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']:
+        tom.set_switch(switch_id, pos=0)
+        tom.wait_until((switch_id, 'reference_position'), timeout=HOMING_TIMEOUT)
+        print("checking")
+        check_workpiece_end_of_conveyor("A", "B", "X", 3, 1)
+        check_workpiece_end_of_conveyor("U", "V", "Q", 3, 1)
+finally:
+    # The publisher thread is a daemon, so send the queued status messages before the script exits
+    status.close()
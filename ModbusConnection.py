@@ -0,0 +1,169 @@
+from pyModbusTCP.client import ModbusClient
+from contextlib import contextmanager
+from queue import Queue
+from threading import Lock
+import random
+
+
+class ModbusTimeoutError(TimeoutError):
+    """
+    Wird geworfen, wenn eine Modbus Anfrage auch nach allen Wiederholungen der RetryPolicy nicht erfolgreich war.
+    """
+
+
+class RetryPolicy:
+    """
+    Legt fest, wie oft und in welchem Abstand eine fehlgeschlagene Modbus Anfrage wiederholt wird.
+    Die Wartezeit wächst exponentiell von initial_delay bis max_delay. Es wird aufgegeben, sobald max_attempts Versuche gemacht wurden
+    oder die deadline seit dem ersten Versuch abgelaufen ist.
+    """
+
+    def __init__(self, initial_delay = 0.05, max_delay = 2.0, multiplier = 2.0, deadline = 10.0, max_attempts = None, jitter = 0.1):
+        """
+        Konstruktor der RetryPolicy.
+
+        :param initial_delay Wartezeit vor der ersten Wiederholung in Sekunden
+        :param max_delay maximale Wartezeit zwischen zwei Versuchen in Sekunden
+        :param multiplier Faktor, um den die Wartezeit nach jedem Versuch wächst
+        :param deadline maximale Zeit seit dem ersten Versuch in Sekunden, None für unbegrenzt
+        :param max_attempts maximale Anzahl an Versuchen, None für unbegrenzt
+        :param jitter Anteil, um den die Wartezeit zufällig verkürzt wird, damit nicht alle Threads gleichzeitig wiederholen
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+
+    def get_delay(self, attempt, elapsed):
+        """
+        Gibt die Wartezeit vor dem nächsten Versuch zurück.
+        :param attempt Anzahl der bisher fehlgeschlagenen Versuche
+        :param elapsed Zeit seit dem ersten Versuch in Sekunden
+        :returns Wartezeit in Sekunden oder None, wenn nicht mehr wiederholt werden soll
+        :rtype float or None
+        """
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        delay -= delay * self.jitter * random.random()
+        if self.deadline is not None:
+            remaining = self.deadline - elapsed
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        return delay
+
+
+class ModbusConnectionPool:
+    """
+    Hält langlebige Modbus TCP Verbindungen zu den Modbus Knoten offen, anstatt für jede Anfrage eine Verbindung auf- und wieder abzubauen.
+    Ein Pool kann von mehreren Modulen und Threads gleichzeitig benutzt werden. Jede Verbindung wird immer nur von einem Thread zur Zeit benutzt.
+    """
+
+    def __init__(self, connections_per_host = 1, port = 502, timeout = 1.0):
+        """
+        Konstruktor des ModbusConnectionPools.
+
+        :param connections_per_host Anzahl der Verbindungen, die pro Modbus Knoten offen gehalten werden
+        :param port TCP Port der Modbus Knoten
+        :param timeout Timeout einer Modbus Anfrage in Sekunden
+        """
+        self.connections_per_host = connections_per_host
+        self.port = port
+        self.timeout = timeout
+
+        #Schützt die Maps self.clients, self.generation und self.shared
+        self.lock = Lock()
+        #Freie Verbindungen pro Knoten (Ip-Adresse -> Queue von ModbusClients)
+        self.clients = {}
+        #Zählt pro Knoten wie oft eine Verbindung (neu) aufgebaut wurde, damit Module nach einem Reconnect reagieren können
+        self.generation = {}
+        #Zustand pro Knoten, den sich alle Module teilen, die über diesen Pool mit dem Knoten sprechen (Ip-Adresse -> Name -> Objekt)
+        self.shared = {}
+
+    def get_clients(self, host):
+        """
+        Gibt die Queue mit den Verbindungen zum Knoten host zurück und legt sie beim ersten Zugriff an.
+        :param host Ip-Adresse des Modbus Knoten (String)
+        :returns Queue der freien Verbindungen
+        :rtype Queue of ModbusClient
+        """
+        with self.lock:
+            if host not in self.clients:
+                #Verbindungen werden nicht automatisch geöffnet/geschlossen, das übernimmt connection()
+                clients = Queue()
+                for i in range(self.connections_per_host):
+                    clients.put(ModbusClient(host=host, port=self.port, timeout=self.timeout, auto_open=False, auto_close=False))
+                self.clients[host] = clients
+                self.generation[host] = 0
+            return self.clients[host]
+
+    def get_generation(self, host):
+        """
+        Gibt zurück, wie oft eine Verbindung zum Knoten host aufgebaut wurde.
+        :param host Ip-Adresse des Modbus Knoten (String)
+        :rtype int
+        """
+        with self.lock:
+            return self.generation.get(host, 0)
+
+    def open_connection(self, host):
+        """
+        Leiht eine Verbindung zum Knoten host kurz aus, damit sie geöffnet wird, falls sie geschlossen war,
+        und gibt die Generation danach zurück. So bemerken Module einen Reconnect, bevor sie die nächste Anfrage vorbereiten.
+        :param host Ip-Adresse des Modbus Knoten (String)
+        :rtype int
+        """
+        with self.connection(host):
+            return self.get_generation(host)
+
+    def get_shared(self, host, name, factory):
+        """
+        Gibt ein Objekt zurück, das sich alle Module teilen, die über diesen Pool mit dem Knoten host sprechen,
+        z.B. das Ausgangsabbild des Knotens. Beim ersten Zugriff wird es mit factory() angelegt.
+        :param host Ip-Adresse des Modbus Knoten (String)
+        :param name Name des Objekts
+        :param factory Funktion ohne Parameter, die das Objekt erzeugt
+        """
+        with self.lock:
+            shared = self.shared.setdefault(host, {})
+            if name not in shared:
+                shared[name] = factory()
+            return shared[name]
+
+    @contextmanager
+    def connection(self, host):
+        """
+        Leiht eine Verbindung zum Knoten host aus und gibt sie nach dem with-Block an den Pool zurück.
+        Ist die Verbindung geschlossen (z.B. weil der Knoten nicht erreichbar war), wird sie transparent neu aufgebaut.
+        Schlägt das Öffnen fehl, liefern die Anfragen None zurück und beim nächsten Ausleihen wird es erneut versucht.
+        :param host Ip-Adresse des Modbus Knoten (String)
+        """
+        clients = self.get_clients(host)
+        client = clients.get()
+        try:
+            if not client.is_open:
+                if client.open():
+                    with self.lock:
+                        self.generation[host] += 1
+            yield client
+        finally:
+            clients.put(client)
+
+    def close(self):
+        """
+        Schließt alle offenen Verbindungen des Pools.
+        """
+        with self.lock:
+            for clients in self.clients.values():
+                for client in list(clients.queue):
+                    client.close()
+
+
+#Standard Pool, der von allen TransportOutputModulen im Prozess geteilt wird
+DEFAULT_CONNECTION_POOL = ModbusConnectionPool()
+
+#Standard RetryPolicy der TransportOutputModule
+DEFAULT_RETRY_POLICY = RetryPolicy()
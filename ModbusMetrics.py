@@ -0,0 +1,169 @@
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left
+
+
+#Namen der Modbus Funktionscodes, die von den Modulen benutzt werden
+FUNCTION_CODES = {
+    3: 'read_holding_registers',
+    6: 'write_single_register',
+    16: 'write_multiple_registers'
+}
+
+
+class ModbusMetrics:
+    """
+    Zählt alle Modbus Anfragen der TransportOutputModule mit Latenz-Histogramm, Fehlern und Wiederholungen,
+    aufgeschlüsselt nach Knoten, Funktionscode, Register und aufrufender Methode.
+    Die Werte können mit snapshot() abgefragt oder mit start_http_server() im Prometheus Textformat bereitgestellt werden.
+    """
+
+    #Obergrenzen der Histogramm-Buckets in Sekunden
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, buckets = BUCKETS):
+        """
+        Konstruktor der ModbusMetrics.
+
+        :param buckets aufsteigende Obergrenzen der Histogramm-Buckets in Sekunden
+        """
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        #(Knoten, Funktionscode, Register, Methode) -> [Anzahl, Fehler, Summe der Latenzen, Anzahl pro Bucket..., Anzahl über dem letzten Bucket]
+        self.requests = {}
+        #(Knoten, Funktionscode, Register, Methode) -> Anzahl der Wiederholungen
+        self.retries = {}
+
+    def observe(self, host, function_code, register, method, duration, ok = True):
+        """
+        Zählt eine Modbus Anfrage.
+        :param host Ip-Adresse des Modbus Knoten
+        :param function_code Modbus Funktionscode der Anfrage
+        :param register erstes Register der Anfrage
+        :param method Name der Methode des Moduls, welche die Anfrage ausgelöst hat
+        :param duration Dauer der Anfrage in Sekunden
+        :param ok False wenn die Anfrage fehlgeschlagen ist
+        """
+        key = (host, function_code, register, method)
+        with self.lock:
+            entry = self.requests.get(key)
+            if entry is None:
+                entry = self.requests[key] = [0, 0, 0.0] + [0] * (len(self.buckets) + 1)
+            entry[0] += 1
+            if not ok:
+                entry[1] += 1
+            entry[2] += duration
+            entry[3 + bisect_left(self.buckets, duration)] += 1
+
+    def retry(self, host, function_code, register, method):
+        """
+        Zählt eine Wiederholung einer fehlgeschlagenen Anfrage.
+        """
+        key = (host, function_code, register, method)
+        with self.lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def snapshot(self):
+        """
+        Gibt alle Zähler als Liste zurück, ein Eintrag pro Knoten, Funktionscode, Register und Methode.
+        :returns Liste von dicts mit host, function_code, register, method, requests, errors, retries, duration_sum
+                 und buckets (Liste von (Obergrenze, kumulierte Anzahl), die letzte Obergrenze ist inf)
+        :rtype list of dict
+        """
+        with self.lock:
+            requests = dict((key, list(entry)) for key, entry in self.requests.items())
+            retries = dict(self.retries)
+
+        result = []
+        for key in sorted(set(requests) | set(retries), key=str):
+            host, function_code, register, method = key
+            entry = requests.get(key, [0, 0, 0.0] + [0] * (len(self.buckets) + 1))
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets + (float('inf'),), entry[3:]):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            result.append({
+                'host': host,
+                'function_code': function_code,
+                'register': register,
+                'method': method,
+                'requests': entry[0],
+                'errors': entry[1],
+                'retries': retries.get(key, 0),
+                'duration_sum': entry[2],
+                'buckets': buckets
+            })
+        return result
+
+    def reset(self):
+        """
+        Setzt alle Zähler zurück.
+        """
+        with self.lock:
+            self.requests.clear()
+            self.retries.clear()
+
+    def to_prometheus(self):
+        """
+        Gibt alle Zähler im Prometheus Textformat zurück.
+        :rtype str
+        """
+        entries = []
+        for entry in self.snapshot():
+            labels = 'host="{}",function="{}",register="{}",method="{}"'.format(
+                entry['host'], FUNCTION_CODES.get(entry['function_code'], entry['function_code']), entry['register'], entry['method'])
+            entries.append((labels, entry))
+
+        #Alle Werte einer Metrik müssen im Textformat direkt hintereinander stehen
+        lines = []
+        for name, field, description in (('modbus_requests_total', 'requests', 'Modbus requests sent to the transport nodes.'),
+                                         ('modbus_request_errors_total', 'errors', 'Modbus requests that failed.'),
+                                         ('modbus_retries_total', 'retries', 'Retries of failed Modbus requests.')):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for labels, entry in entries:
+                lines.append('%s{%s} %d' % (name, labels, entry[field]))
+
+        lines.append('# HELP modbus_request_duration_seconds Round trip time of Modbus requests.')
+        lines.append('# TYPE modbus_request_duration_seconds histogram')
+        for labels, entry in entries:
+            for bound, count in entry['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('modbus_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, le, count))
+            lines.append('modbus_request_duration_seconds_sum{%s} %r' % (labels, entry['duration_sum']))
+            lines.append('modbus_request_duration_seconds_count{%s} %d' % (labels, entry['requests']))
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port = 9105, host = '127.0.0.1'):
+        """
+        Startet einen HTTP Server in einem Hintergrund-Thread, der die Zähler unter /metrics im Prometheus Textformat ausliefert.
+        :param port TCP Port des HTTP Servers
+        :param host Adresse, auf welcher der HTTP Server lauscht (Standardmäßig nur lokal)
+        :returns der laufende Server, server.shutdown() beendet ihn
+        :rtype ThreadingHTTPServer
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+#Standard Metriken, die von allen TransportOutputModulen im Prozess geteilt werden
+DEFAULT_METRICS = ModbusMetrics()
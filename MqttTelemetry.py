@@ -0,0 +1,169 @@
+import paho.mqtt.client as mqtt
+from queue import Queue, Full, Empty
+from threading import Thread
+from time import monotonic
+
+
+class TelemetryPublisher:
+    """
+    Publishes MQTT telemetry from a separate thread so that callers never wait for the broker.
+    Messages are put on a bounded queue; a publisher thread drains the queue in batches and hands them to one
+    persistent MQTT connection. When the queue is full, new messages are dropped and counted instead of blocking the caller.
+
+    publish_on_change() offers report by exception: a signal is only sent when its value changes, at most once per
+    min_interval (the latest value is sent when the interval has passed) and repeated every keyframe_interval as a keyframe.
+    """
+
+    def __init__(self, broker, port=1883, maxsize=10000, batch_size=100, min_interval=0.0, keyframe_interval=None):
+        """
+        Constructor of the TelemetryPublisher.
+
+        :param broker IP address or host name of the MQTT broker (string)
+        :param port Port of the MQTT broker
+        :param maxsize Maximum number of messages waiting in the queue
+        :param batch_size Maximum number of messages taken from the queue at once
+        :param min_interval Minimum time in seconds between two messages of the same signal in publish_on_change()
+        :param keyframe_interval Time in seconds after which an unchanged signal is published again, None for no keyframes
+        """
+        self.broker = broker
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.keyframe_interval = keyframe_interval
+        self.queue = Queue(maxsize)
+        # Number of messages that were dropped because the queue was full or publishing failed
+        self.dropped = 0
+
+        # Last value queued per signal key, checked by the caller so that unchanged values never reach the queue
+        self.values = {}
+        # Publisher thread only: signal key -> [topic, payload, qos, retain, time of last publish, pending]
+        self.signals = {}
+
+        # connect_async() and loop_start() never block; paho reconnects on its own if the broker goes away
+        self.client = mqtt.Client()
+        self.client.connect_async(broker, port)
+        self.client.loop_start()
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Queues a message for publishing and returns immediately.
+        :param topic MQTT topic
+        :param payload Payload of the message; a list or tuple is sent comma separated and serialized in the publisher thread
+        :param qos MQTT quality of service
+        :param retain MQTT retain flag
+        :returns False if the message was dropped because the queue is full
+        :rtype bool
+        """
+        return self.enqueue((None, topic, payload, qos, retain))
+
+    def publish_on_change(self, topic, value, payload=None, key=None, qos=0, retain=False):
+        """
+        Queues a message only if value differs from the last value of the same signal.
+        :param topic MQTT topic
+        :param value Decoded value of the signal that is compared with the last value
+        :param payload Payload of the message, defaults to value
+        :param key Key of the signal, defaults to topic (needed if several signals share one topic)
+        :param qos MQTT quality of service
+        :param retain MQTT retain flag
+        :returns True if the value changed and the message was queued
+        :rtype bool
+        """
+        if key is None:
+            key = topic
+        if key in self.values and self.values[key] == value:
+            return False
+        self.values[key] = value
+        if not self.enqueue((key, topic, value if payload is None else payload, qos, retain)):
+            # Forget the value so that the next call tries again
+            self.values.pop(key, None)
+            return False
+        return True
+
+    def enqueue(self, message):
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def run(self):
+        """
+        Publisher thread: waits for messages, takes up to batch_size of them and publishes them.
+        Between messages it sends signals whose min_interval has passed and keyframes. Ends when close() puts None on the queue.
+        """
+        # Wake up regularly only if there are time based messages to send
+        intervals = [i for i in (self.min_interval, self.keyframe_interval) if i]
+        tick = min(intervals) if intervals else None
+
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=tick)]
+            except Empty:
+                batch = []
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            now = monotonic()
+            for message in batch:
+                if message is None:
+                    running = False
+                    continue
+                key, topic, payload, qos, retain = message
+                if key is None:
+                    self.send(topic, payload, qos, retain)
+                    continue
+                signal = self.signals.get(key)
+                if signal is None:
+                    signal = self.signals[key] = [topic, payload, qos, retain, None, True]
+                else:
+                    signal[0:4] = [topic, payload, qos, retain]
+                    signal[5] = True
+                # Changes within min_interval stay pending and are sent below once the interval has passed
+                if signal[4] is None or now - signal[4] >= self.min_interval:
+                    self.send(topic, payload, qos, retain)
+                    signal[4] = now
+                    signal[5] = False
+
+            if tick is not None:
+                self.send_due(now)
+
+    def send_due(self, now):
+        """
+        Sends pending changes whose min_interval has passed and keyframes of signals that were not sent for keyframe_interval.
+        :param now current monotonic time
+        """
+        for signal in self.signals.values():
+            topic, payload, qos, retain, last, pending = signal
+            changed = pending and now - last >= self.min_interval
+            keyframe = self.keyframe_interval and now - last >= self.keyframe_interval
+            if changed or keyframe:
+                self.send(topic, payload, qos, retain)
+                signal[4] = now
+                signal[5] = False
+
+    def send(self, topic, payload, qos, retain):
+        if isinstance(payload, (list, tuple)):
+            payload = ",".join(str(x) for x in payload)
+        try:
+            self.client.publish(topic, payload, qos, retain)
+        except Exception as e:
+            # A broken message must not stop the publisher thread
+            self.dropped += 1
+            print("Error publishing telemetry:", e)
+
+    def close(self):
+        """
+        Publishes everything that is still queued, stops the publisher thread and disconnects from the broker.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        # disconnect() is queued behind the pending messages, loop_stop() waits until the network thread has sent them
+        self.client.disconnect()
+        self.client.loop_stop()
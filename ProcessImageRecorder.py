@@ -0,0 +1,208 @@
+from collections import namedtuple
+from time import monotonic, time
+import mmap
+import os
+import struct
+import sys
+
+from TransportOutputModule import TransportOutputModule
+
+
+#Ein aufgezeichneter Scan: monotone Zeit in Sekunden, Input Words ab 8001, Output Words ab 8018
+Record = namedtuple('Record', ['timestamp', 'inputs', 'outputs'])
+
+
+class ProcessImageRecorder:
+    """
+    Zeichnet Prozessabbilder (Eingänge und Ausgänge mit monotonem Zeitstempel) in einer Ringdatei mit festen Records auf.
+    Die Datei wird per mmap eingeblendet, ein Record wird mit einem struct.pack_into() direkt in den Speicher geschrieben,
+    ohne Systemaufruf im Scan-Thread. Ist die Datei voll, wird der älteste Record überschrieben.
+
+    Aufbau der Datei: Header (HEADER_SIZE Bytes) gefolgt von capacity Records.
+    Der Header enthält Kennung, Recordgröße, Kapazität, Anzahl der bisher geschriebenen Records
+    sowie Wanduhrzeit und monotone Zeit beim letzten Öffnen, um die Zeitstempel in Uhrzeiten umzurechnen.
+    Alle Records einer Datei stammen von derselben monotonen Uhr: eine Aufzeichnung von vor einem Neustart des Rechners
+    wird nicht weitergeschrieben (siehe check_clock()).
+    """
+
+    MAGIC = b'PIMGREC1'
+    HEADER = struct.Struct('<8sIIQdd')
+    HEADER_SIZE = 64
+    #Offset der Anzahl der geschriebenen Records im Header
+    COUNT = struct.Struct('<Q')
+    COUNT_OFFSET = 16
+
+    INPUT_WORDS = TransportOutputModule.DIGITAL_INPUT_WORDS
+    OUTPUT_WORDS = TransportOutputModule.DIGITAL_OUTPUT_WORDS
+    RECORD = struct.Struct('<d%dH%dH' % (INPUT_WORDS, OUTPUT_WORDS))
+    #Maximale Abweichung zwischen Wanduhr und monotoner Uhr seit dem letzten Öffnen in Sekunden (z.B. durch NTP),
+    #bei größeren Abweichungen gehört die monotone Uhr zu einem anderen Start des Rechners
+    CLOCK_TOLERANCE = 60.0
+
+    def __init__(self, path, capacity = 1000000, read_only = False):
+        """
+        Konstruktor des ProcessImageRecorders. Eine vorhandene Aufzeichnung wird mit ihrer eigenen Kapazität weitergeschrieben,
+        wenn sie seit dem letzten Neustart des Rechners angelegt wurde. Eine leere oder nicht vorhandene Datei wird neu angelegt.
+        Andere Dateien werden nie überschrieben.
+        Mit der Standardkapazität reicht die Datei (32 MB) bei einer Zykluszeit von 50 ms für etwa 14 Stunden.
+
+        :param path Pfad der Ringdatei
+        :param capacity Anzahl der Records, wenn die Datei neu angelegt wird
+        :param read_only Wenn True, wird eine vorhandene Aufzeichnung nur gelesen (z.B. zur Auswertung nach einem Fehler), siehe load()
+        :raises ValueError wenn die Datei existiert, aber keine Aufzeichnung ist oder mit einer anderen monotonen Uhr aufgezeichnet wurde
+        """
+        self.path = path
+        self.read_only = read_only
+
+        if read_only:
+            header = self.read_header(path)
+            self.file = open(path, 'rb')
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        elif os.path.exists(path) and os.path.getsize(path) > 0:
+            header = self.read_header(path)
+            self.file = open(path, 'r+b')
+            self.mm = mmap.mmap(self.file.fileno(), os.path.getsize(path))
+            try:
+                header = self.check_clock(header)
+            except ValueError:
+                self.mm.close()
+                self.file.close()
+                raise
+        else:
+            header = (self.MAGIC, self.RECORD.size, capacity, 0, time(), monotonic())
+            self.file = open(path, 'w+b')
+            self.file.truncate(self.HEADER_SIZE + capacity * self.RECORD.size)
+            self.mm = mmap.mmap(self.file.fileno(), self.HEADER_SIZE + capacity * self.RECORD.size)
+            self.HEADER.pack_into(self.mm, 0, *header)
+
+        self.capacity = header[2]
+        self.count = header[3]
+        self.created_wall = header[4]
+        self.created_monotonic = header[5]
+        self.zeros = (0,) * self.OUTPUT_WORDS
+
+    def check_clock(self, header):
+        """
+        Prüft, ob eine vorhandene Aufzeichnung mit der aktuellen monotonen Uhr weitergeschrieben werden kann, und merkt sich im Header
+        die aktuelle Wanduhrzeit und monotone Zeit. Nach einem Neustart des Rechners beginnt die monotone Uhr neu,
+        die Zeitstempel neuer Records wären dann nicht mehr mit denen der alten vergleichbar.
+        :param header Header der Aufzeichnung (siehe read_header())
+        :returns der neue Header
+        :rtype tuple
+        :raises ValueError wenn die monotone Uhr seit dem letzten Record zurückgegangen ist oder nicht mehr zur Wanduhr passt
+        """
+        wall, now = time(), monotonic()
+        count, created_wall, created_monotonic = header[3], header[4], header[5]
+        if count > 0:
+            capacity = header[2]
+            last = self.RECORD.unpack_from(self.mm, self.HEADER_SIZE + ((count - 1) % capacity) * self.RECORD.size)[0]
+            if now < last:
+                raise ValueError("{} was recorded before a restart of this computer, use a new file".format(self.path))
+        if abs(now - created_monotonic - (wall - created_wall)) > self.CLOCK_TOLERANCE:
+            raise ValueError("{} was recorded with a different monotonic clock, use a new file".format(self.path))
+        header = header[:4] + (wall, now)
+        self.HEADER.pack_into(self.mm, 0, *header)
+        return header
+
+    @classmethod
+    def read_header(cls, path):
+        """
+        Liest und prüft den Header einer vorhandenen Aufzeichnung.
+        :returns (Kennung, Recordgröße, Kapazität, Anzahl der Records, Wanduhrzeit, monotone Zeit)
+        :rtype tuple
+        :raises ValueError wenn die Datei keine Aufzeichnung dieses Formats ist
+        """
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            data = f.read(cls.HEADER.size)
+        if len(data) < cls.HEADER.size:
+            raise ValueError("{} is not a process image recording".format(path))
+        header = cls.HEADER.unpack(data)
+        if header[0] != cls.MAGIC or header[1] != cls.RECORD.size or size != cls.HEADER_SIZE + header[2] * cls.RECORD.size:
+            raise ValueError("{} is not a process image recording".format(path))
+        return header
+
+    @classmethod
+    def load(cls, path, start = None):
+        """
+        Liest alle Records einer Aufzeichnung, ohne die Datei zu verändern.
+        :param path Pfad der Ringdatei
+        :param start nur Records ab dieser monotonen Zeit
+        :rtype list of Record
+        :raises ValueError wenn die Datei keine Aufzeichnung ist
+        """
+        recorder = cls(path, read_only=True)
+        try:
+            return list(recorder.records(start))
+        finally:
+            recorder.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def record(self, inputs, outputs = None, timestamp = None):
+        """
+        Hängt einen Record an. Wird aus dem Scan-Thread aufgerufen und darf deshalb nur von einem Thread zur Zeit benutzt werden.
+        :param inputs Input Words ab DIGITAL_INPUT_STARTING_ADDRESS
+        :param outputs Output Words ab DIGITAL_OUTPUT_STARTING_ADDRESS (None wird als 0 aufgezeichnet)
+        :param timestamp monotone Zeit des Scans, Standardmäßig die aktuelle
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+        offset = self.HEADER_SIZE + (self.count % self.capacity) * self.RECORD.size
+        self.RECORD.pack_into(self.mm, offset, timestamp, *inputs, *(outputs or self.zeros))
+        #Die Anzahl wird erst nach dem Record geschrieben, damit ein Leser nie einen halb geschriebenen Record als gültig ansieht
+        self.count += 1
+        self.COUNT.pack_into(self.mm, self.COUNT_OFFSET, self.count)
+
+    def records(self, start = None):
+        """
+        Gibt die aufgezeichneten Records vom ältesten zum neuesten zurück.
+        :param start nur Records ab dieser monotonen Zeit
+        :rtype generator of Record
+        """
+        count = self.COUNT.unpack_from(self.mm, self.COUNT_OFFSET)[0]
+        first = max(0, count - self.capacity)
+        for i in range(first, count):
+            values = self.RECORD.unpack_from(self.mm, self.HEADER_SIZE + (i % self.capacity) * self.RECORD.size)
+            if start is not None and values[0] < start:
+                continue
+            yield Record(values[0], values[1:1 + self.INPUT_WORDS], values[1 + self.INPUT_WORDS:])
+
+    def to_wall_time(self, timestamp):
+        """
+        Rechnet einen monotonen Zeitstempel eines Records in eine Wanduhrzeit (Sekunden seit Epoch) um.
+        """
+        return self.created_wall + (timestamp - self.created_monotonic)
+
+    def flush(self):
+        """
+        Schreibt alle Records auf die Platte. Ist nur nötig, wenn der Rechner abstürzen könnte, das Betriebssystem schreibt sie auch von selbst.
+        """
+        self.mm.flush()
+
+    def close(self):
+        if not self.read_only:
+            self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    #Gibt eine Aufzeichnung als CSV aus: python ProcessImageRecorder.py <Datei>
+    if not os.path.exists(sys.argv[1]):
+        sys.exit("No recording at " + sys.argv[1])
+    try:
+        recorder = ProcessImageRecorder(sys.argv[1], read_only=True)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("timestamp," + ",".join("in%d" % i for i in range(recorder.INPUT_WORDS)) + "," + ",".join("out%d" % i for i in range(recorder.OUTPUT_WORDS)))
+    for record in recorder.records():
+        print(",".join(str(value) for value in (recorder.to_wall_time(record.timestamp),) + record.inputs + record.outputs))
+    recorder.close()
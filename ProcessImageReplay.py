@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+from threading import Lock, Event, BoundedSemaphore
+from time import monotonic
+
+from TransportOutputModule import TransportOutputModule
+from ProcessImageRecorder import ProcessImageRecorder
+
+
+class ReplayFinished(Exception):
+    """
+    Wird beim Lesen der Eingänge geworfen, wenn alle aufgezeichneten Prozessabbilder abgespielt wurden.
+    """
+
+
+class ReplayClient:
+    """
+    Ersatz für den ModbusClient, der die Eingänge aus einer Aufzeichnung beantwortet und Schreibzugriffe nur protokolliert.
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.is_open = True
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def read_holding_registers(self, reg_addr, reg_nb = 1):
+        return self.replay.read(reg_addr, reg_nb)
+
+    def write_single_register(self, reg_addr, reg_value):
+        return self.replay.write(6, reg_addr, [reg_value])
+
+    def write_multiple_registers(self, regs_addr, regs_value):
+        return self.replay.write(16, regs_addr, list(regs_value))
+
+
+class ReplayConnectionPool:
+    """
+    Ersatz für den ModbusConnectionPool, der jedem Modul den ReplayClient ausleiht.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = Lock()
+        self.shared = {}
+
+    def get_clients(self, host):
+        return [self.client]
+
+    def get_shared(self, host, name, factory):
+        with self.lock:
+            if (host, name) not in self.shared:
+                self.shared[(host, name)] = factory()
+            return self.shared[(host, name)]
+
+    def get_generation(self, host):
+        return 1
+
+    def open_connection(self, host):
+        return 1
+
+    @contextmanager
+    def connection(self, host):
+        yield self.client
+
+    def close(self):
+        pass
+
+
+class ProcessImageReplay:
+    """
+    Spielt aufgezeichnete Prozessabbilder (siehe ProcessImageRecorder) in ein TransportOutputModule ein, anstatt mit dem Modbus zu sprechen.
+    Die Steuerlogik (z.B. check_workpiece_end_of_conveyor) läuft unverändert gegen das Modul, alle Befehle werden mit der
+    Aufzeichnungszeit in self.writes protokolliert, um die Entscheidungen verschiedener Versionen der Logik zu vergleichen.
+
+    Ohne time_scale läuft die Wiedergabe so schnell wie möglich: jedes Lesen der Eingänge liefert den nächsten Scan der Aufzeichnung.
+    Damit die Logik dabei nicht real wartet, sollten Wartezeiten auf 0 gesetzt werden (z.B. wait_until(..., poll_interval=0)).
+    Mit time_scale läuft die Aufzeichnungszeit time_scale mal schneller als die echte Zeit und jedes Lesen liefert den dann aktuellen Scan.
+    Die Ausgänge werden beim ersten Scan aus der Aufzeichnung übernommen und danach nur noch durch die Befehle der Logik geändert.
+
+    Beispiel:
+        replay = ProcessImageReplay("line.rec")
+        tom = replay.module()
+        try:
+            while True:
+                tom.wait_until(('A', 'end'), poll_interval=0)
+                tom.set_switch('X', pos=3)
+                ...
+        except ReplayFinished:
+            print(replay.writes)
+    """
+
+    def __init__(self, records, time_scale = None, stop_at_end = True):
+        """
+        Konstruktor der ProcessImageReplay.
+
+        :param records Pfad einer Aufzeichnung des ProcessImageRecorders oder Liste von Records
+        :raises ValueError wenn die Datei keine Aufzeichnung ist oder keine Records enthält
+        :param time_scale Faktor, um den die Wiedergabe schneller als die Aufzeichnung läuft, None für so schnell wie möglich
+        :param stop_at_end Wenn True, wird nach dem letzten Scan ReplayFinished geworfen, ansonsten bleibt der letzte Scan stehen
+        """
+        if isinstance(records, str):
+            #Nur lesend öffnen, damit auch schreibgeschützte Aufzeichnungen (z.B. zur Auswertung nach einem Fehler) abgespielt werden können
+            records = ProcessImageRecorder.load(records)
+        self.records = list(records)
+        if not self.records:
+            raise ValueError("Replay has no records")
+        self.time_scale = time_scale
+        self.stop_at_end = stop_at_end
+
+        self.lock = Lock()
+        #Index des aktuellen Scans, -1 bis zum ersten Lesen
+        self.index = -1
+        self.start = None
+        self.finished = Event()
+
+        #Holding Register, die von der Logik geschrieben wurden (Adresse -> Wert)
+        self.registers = dict((TransportOutputModule.DIGITAL_OUTPUT_STARTING_ADDRESS + i, word) for i, word in enumerate(self.records[0].outputs))
+        #Alle Schreibzugriffe als (Zeitstempel des Scans, Funktionscode, Adresse, Werte)
+        self.writes = []
+
+        self.client = ReplayClient(self)
+        self.pool = ReplayConnectionPool(self.client)
+
+    def module(self, ip_addr = 'replay', **kwargs):
+        """
+        Erstellt ein TransportOutputModule, das seine Eingänge aus dieser Wiedergabe liest.
+        :param kwargs weitere Parameter für TransportOutputModule (Standardmäßig ohne Metriken und mit eigener Semaphore)
+        :rtype TransportOutputModule
+        """
+        kwargs.setdefault('connection_pool', self.pool)
+        kwargs.setdefault('metrics', None)
+        kwargs.setdefault('read_write_sem', BoundedSemaphore(value=1))
+        return TransportOutputModule(ip_addr, **kwargs)
+
+    def time(self):
+        """
+        Gibt den Zeitstempel des aktuellen Scans zurück (monotone Zeit der Aufzeichnung).
+        """
+        return self.records[max(0, self.index)].timestamp
+
+    def advance(self):
+        """
+        Schaltet auf den Scan, der beim aktuellen Lesen gilt.
+        :raises ReplayFinished wenn die Aufzeichnung zu Ende ist und stop_at_end gesetzt ist
+        """
+        last = len(self.records) - 1
+        if self.time_scale is None:
+            done = self.index >= last
+            if not done:
+                self.index += 1
+        else:
+            if self.start is None:
+                self.start = monotonic()
+            now = self.records[0].timestamp + (monotonic() - self.start) * self.time_scale
+            while self.index < last and self.records[self.index + 1].timestamp <= now:
+                self.index += 1
+            self.index = max(self.index, 0)
+            done = now > self.records[last].timestamp
+        if done:
+            self.finished.set()
+            if self.stop_at_end:
+                raise ReplayFinished("Replayed all {} records".format(len(self.records)))
+
+    def read(self, address, amount):
+        start = TransportOutputModule.DIGITAL_INPUT_STARTING_ADDRESS
+        end = start + TransportOutputModule.DIGITAL_INPUT_WORDS
+        with self.lock:
+            if address < end and address + amount > start:
+                self.advance()
+            inputs = self.records[max(0, self.index)].inputs
+            return [inputs[register - start] if start <= register < end else self.registers.get(register, 0)
+                    for register in range(address, address + amount)]
+
+    def write(self, function_code, address, values):
+        with self.lock:
+            self.writes.append((self.time(), function_code, address, values))
+            for i, value in enumerate(values):
+                self.registers[address + i] = value
+            return True
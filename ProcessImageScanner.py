@@ -0,0 +1,240 @@
+from threading import Thread, Condition, Event, Lock
+from time import monotonic
+from collections import namedtuple
+
+#Flanke eines Eingangssignals: value ist True bei steigender und False bei fallender Flanke
+Edge = namedtuple('Edge', ['device', 'signal', 'value', 'timestamp'])
+
+
+class ScannerStoppedError(RuntimeError):
+    """
+    Wird von wait_for() und wait_for_edge() geworfen, wenn der Scan-Thread beendet wurde, während auf ein Signal gewartet wird.
+    """
+
+
+class ProcessImageScanner(Thread):
+    """
+    Hintergrund-Thread, der das Prozessabbild eines TransportOutputModuls in einem festen Zyklus liest,
+    es mit dem vorherigen Scan vergleicht und für jedes geänderte Eingangssignal eine Flanke (Edge) an die Abonnenten schickt.
+    Threads können mit wait_for()/wait_for_edge() auf Signale warten, anstatt selbst zu pollen.
+    """
+
+    def __init__(self, module, cycle_time = 0.05, recorder = None):
+        """
+        Konstruktor des ProcessImageScanners.
+
+        :param module TransportOutputModule, dessen Eingänge gescannt werden
+        :param cycle_time Zykluszeit eines Scans in Sekunden
+        :param recorder ProcessImageRecorder, der jeden Scan mit dem lokalen Ausgangsabbild des Moduls aufzeichnet (optional)
+        """
+        super().__init__(daemon=True)
+        self.module = module
+        self.cycle_time = cycle_time
+        self.recorder = recorder
+
+        #Eingangssignale pro Offset (Offset -> Liste von (Bitmaske, Gerät, Signalname)), damit nur geänderte Words untersucht werden
+        self.sensors = {}
+        #(Gerät, Signalname) -> (Offset, Bitmaske)
+        self.address = {}
+        for device, signal, offset, mask in module.SENSORS:
+            self.sensors.setdefault(offset, []).append((mask, device, signal))
+            self.address[(device, signal)] = (offset, mask)
+
+        #Letzter Scan, wird zusammen mit scan_count unter self.condition geändert
+        self.image = None
+        self.scan_count = 0
+        self.condition = Condition()
+
+        #Abonnenten als Liste von (callback, device, signal, value), None heißt beliebig
+        self.subscribers = []
+        self.subscribers_lock = Lock()
+
+        self.stopped = Event()
+        #Wird am Ende von run() gesetzt, damit wartende Threads nicht auf Scans warten, die nicht mehr kommen
+        self.finished = False
+
+        #Das Modul wartet in wait_until() auf die Scans dieses Scanners, anstatt selbst zu pollen
+        module.scanner = self
+
+    def run(self):
+        """
+        Scannt bis stop() aufgerufen wird. Die Dauer eines Scans wird von der Wartezeit abgezogen.
+        Schlägt ein Scan fehl (auch nach allen Wiederholungen), wird im nächsten Zyklus weitergescannt.
+        """
+        try:
+            while not self.stopped.is_set():
+                start = monotonic()
+                try:
+                    self.scan()
+                except Exception as e:
+                    #Weder ein nicht erreichbarer Knoten noch ein Fehler beim Aufzeichnen beendet den Scan-Thread, es wird im nächsten Zyklus erneut versucht
+                    print("Error scanning process image:", repr(e))
+                self.stopped.wait(max(0.0, self.cycle_time - (monotonic() - start)))
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def is_scanning(self):
+        """
+        Gibt zurück, ob der Scan-Thread läuft und weiter Scans liefert.
+        :rtype bool
+        """
+        return self.is_alive() and not self.finished
+
+    def stop(self):
+        """
+        Beendet den Scan-Thread nach dem aktuellen Zyklus.
+        """
+        self.stopped.set()
+
+    def scan(self):
+        """
+        Liest das Prozessabbild einmal, ermittelt die Flanken gegenüber dem letzten Scan und benachrichtigt Abonnenten und wartende Threads.
+        :returns Liste der Flanken dieses Scans (beim ersten Scan leer)
+        :rtype list of Edge
+        """
+        words = list(self.module.read_process_image())
+        timestamp = monotonic()
+        if self.recorder is not None:
+            #Die Ausgänge kommen aus dem lokalen Ausgangsabbild, dafür ist keine zusätzliche Modbus Anfrage nötig
+            self.recorder.record(words, self.module.output_image, timestamp)
+
+        edges = []
+        previous = self.image
+        if previous is not None:
+            for offset, word in enumerate(words):
+                #XOR liefert alle Bits, die sich seit dem letzten Scan geändert haben
+                changed = word ^ previous[offset]
+                if changed:
+                    for mask, device, signal in self.sensors.get(offset, ()):
+                        if changed & mask:
+                            edges.append(Edge(device, signal, bool(word & mask), timestamp))
+
+        with self.condition:
+            self.image = words
+            self.scan_count += 1
+            self.condition.notify_all()
+
+        if edges:
+            self.dispatch(edges)
+        return edges
+
+    def dispatch(self, edges):
+        """
+        Schickt die Flanken an alle passenden Abonnenten.
+        :param edges Liste von Edge
+        """
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for edge in edges:
+            for callback, device, signal, value in subscribers:
+                if device is not None and device != edge.device:
+                    continue
+                if signal is not None and signal != edge.signal:
+                    continue
+                if value is not None and value != edge.value:
+                    continue
+                try:
+                    callback(edge)
+                except Exception as e:
+                    #Ein fehlerhafter Abonnent darf den Scan-Thread nicht beenden
+                    print("Error in edge subscriber:", e)
+
+    def subscribe(self, callback, device = None, signal = None, value = None):
+        """
+        Meldet callback für Flanken an. callback wird im Scan-Thread mit der Edge aufgerufen und sollte deshalb nicht blockieren.
+        :param callback Funktion, die eine Edge als Parameter bekommt
+        :param device Nur Flanken dieses Geräts (z.B. 'A'), None für alle
+        :param signal Nur Flanken dieses Signals (z.B. 'end'), None für alle
+        :param value True nur steigende, False nur fallende Flanken, None für beide
+        :returns Handle für unsubscribe()
+        """
+        if device is not None and signal is not None:
+            self.get_address(device, signal)
+        subscriber = (callback, device, signal, value)
+        with self.subscribers_lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Meldet einen Abonnenten wieder ab.
+        :param subscriber Handle, das von subscribe() zurückgegeben wurde
+        """
+        with self.subscribers_lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def get_address(self, device, signal):
+        """
+        Gibt Offset und Bitmaske eines Eingangssignals zurück.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :rtype tuple of (int, int)
+        :raises ValueError wenn es das Signal nicht gibt
+        """
+        try:
+            return self.address[(device, signal)]
+        except KeyError:
+            raise ValueError("Unknown signal {!r} of device {!r}".format(signal, device)) from None
+
+    def get_signal(self, device, signal):
+        """
+        Gibt den Wert eines Eingangssignals aus dem letzten Scan zurück.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :returns Wert des Signals oder None, wenn noch nicht gescannt wurde
+        :rtype bool or None
+        """
+        offset, mask = self.get_address(device, signal)
+        image = self.image
+        if image is None:
+            return None
+        return bool(image[offset] & mask)
+
+    def wait_for(self, device, signal, value = True, timeout = None):
+        """
+        Wartet bis das Eingangssignal den Wert value hat. Hat es den Wert schon, kehrt die Methode sofort zurück.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :param value Wert auf den gewartet wird
+        :param timeout maximale Wartezeit in Sekunden, None für unbegrenzt
+        :returns True wenn der Wert erreicht wurde, False bei Timeout
+        :rtype bool
+        :raises ScannerStoppedError wenn der Scan-Thread vorher beendet wurde
+        """
+        offset, mask = self.get_address(device, signal)
+        reached = lambda: self.image is not None and bool(self.image[offset] & mask) == value
+        with self.condition:
+            if self.condition.wait_for(lambda: reached() or self.finished, timeout) and not reached():
+                raise ScannerStoppedError("Process image scanner stopped while waiting for {} {}".format(device, signal))
+            return reached()
+
+    def wait_for_edge(self, device, signal, value = True, timeout = None):
+        """
+        Wartet auf die nächste Flanke des Eingangssignals, unabhängig vom aktuellen Wert.
+        :param device Index des Geräts (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param signal Name des Signals (Siehe TransportOutputModule.SIGNALS_*)
+        :param value True für steigende, False für fallende Flanke
+        :param timeout maximale Wartezeit in Sekunden, None für unbegrenzt
+        :returns die Edge oder None bei Timeout
+        :rtype Edge or None
+        :raises ScannerStoppedError wenn der Scan-Thread vorher beendet wurde
+        """
+        received = []
+
+        def callback(edge):
+            with self.condition:
+                received.append(edge)
+                self.condition.notify_all()
+
+        subscriber = self.subscribe(callback, device, signal, value)
+        try:
+            with self.condition:
+                self.condition.wait_for(lambda: received or self.finished, timeout)
+                if not received and self.finished:
+                    raise ScannerStoppedError("Process image scanner stopped while waiting for {} {}".format(device, signal))
+        finally:
+            self.unsubscribe(subscriber)
+        return received[0] if received else None
@@ -0,0 +1,265 @@
+from threading import Thread, Event, Lock
+from queue import Queue, Empty
+from collections import namedtuple, deque
+from itertools import count
+
+from TransportOutputModule import TransportOutputModule
+from ModbusConnection import ModbusTimeoutError
+
+
+#Ein Schritt einer Route wie bei check_workpiece_end_of_conveyor(): das Werkstück läuft vom Ende des Laufbands conveyor
+#in die Weiche switch (Position pre) und wird von dort an next_conveyor übergeben (Position post)
+Step = namedtuple('Step', ['conveyor', 'next_conveyor', 'switch', 'pre', 'post'])
+
+#Zustände eines Schritts: Weiche fährt auf pre und wartet auf das Werkstück, Weiche fährt auf post und gibt das Werkstück ab
+ENTERING = 'entering'
+LEAVING = 'leaving'
+
+
+def compile_route(steps):
+    """
+    Prüft eine Route und übersetzt sie in eine Liste von Steps.
+    :param steps Liste von (Laufband, nächstes Laufband, Weiche, Position vorher, Position nachher)
+    :returns Tuple von Step
+    :rtype tuple
+    :raises ValueError wenn ein Gerät oder eine Position nicht existiert oder die Schritte nicht aneinander anschließen
+    """
+    route = tuple(Step(*step) for step in steps)
+    if not route:
+        raise ValueError("Route has no steps")
+    for i, step in enumerate(route):
+        for conveyor_id in (step.conveyor, step.next_conveyor):
+            if conveyor_id not in TransportOutputModule.INDEX_CONVEYORS:
+                raise ValueError("Unknown conveyor {!r} in step {}".format(conveyor_id, i))
+        if step.switch not in TransportOutputModule.INDEX_SWITCHES:
+            raise ValueError("Unknown switch {!r} in step {}".format(step.switch, i))
+        if step.pre not in (0, 1, 2, 3) or step.post not in (0, 1, 2, 3):
+            raise ValueError("Invalid switch position in step {}".format(i))
+        if i > 0 and route[i - 1].next_conveyor != step.conveyor:
+            raise ValueError("Step {} starts at {!r} but step {} ends at {!r}".format(i, step.conveyor, i - 1, route[i - 1].next_conveyor))
+    return route
+
+
+class Workpiece:
+    """
+    Ein Werkstück, das von der RouteEngine über eine Route geleitet wird.
+    """
+
+    def __init__(self, id, route):
+        self.id = id
+        self.route = route
+        #Index des Schritts, den das Werkstück als nächstes bzw. gerade durchläuft
+        self.step = 0
+        self.finished = Event()
+
+    def __repr__(self):
+        return "Workpiece({}, step {}/{})".format(self.id, self.step, len(self.route))
+
+
+class RouteEngine(Thread):
+    """
+    Leitet beliebig viele Werkstücke gleichzeitig über deklarativ angegebene Routen.
+    Jeder Schritt einer Route ist ein kleiner Zustandsautomat, der von den Sensorflanken des ProcessImageScanners weitergeschaltet wird:
+    Werkstück am Ende des Laufbands -> Weiche auf pre (ENTERING) -> Werkstück in der Weiche -> Weiche auf post (LEAVING)
+    -> Werkstück hat die Weiche verlassen -> nächster Schritt.
+    Jede Weiche bearbeitet immer nur ein Werkstück, verschiedene Weichen arbeiten parallel.
+    Freie Weichen werden schon vorab auf die Position pre des nächsten Werkstücks gestellt, das sie benutzen wird (lookahead),
+    damit die Fahrzeit der Weiche nicht erst anfällt, wenn das Werkstück am Ende des Laufbands ankommt.
+    Die Laufbänder der Routen müssen laufen (z.B. mit conveyor_forward()).
+
+    Beispiel:
+        engine = RouteEngine(tom, scanner)
+        engine.add_route('ingoing', [("A", "B", "X", 3, 1), ("B", "D", "C", 3, 1)])
+        engine.start()
+        workpiece = engine.start_workpiece('ingoing')
+        engine.wait(workpiece)
+    """
+
+    def __init__(self, module, scanner, on_event = None, tick = 0.5, lookahead = 2):
+        """
+        Konstruktor der RouteEngine.
+
+        :param module TransportOutputModule, über das die Weichen gestellt werden
+        :param scanner gestarteter ProcessImageScanner desselben Moduls
+        :param on_event Funktion (workpiece, step, state), die bei jedem Zustandswechsel im Thread der Engine aufgerufen wird,
+                        state ist ENTERING, LEAVING oder None wenn der Schritt abgeschlossen ist
+        :param tick maximale Zeit in Sekunden, nach der die Zustände auch ohne Flanke neu geprüft werden
+        :param lookahead Anzahl der kommenden Schritte eines Werkstücks, deren Weichen vorab auf pre gestellt werden (0 schaltet das ab)
+        """
+        super().__init__(daemon=True)
+        self.module = module
+        self.scanner = scanner
+        self.on_event = on_event
+        self.tick = tick
+        self.lookahead = lookahead
+
+        self.routes = {}
+        self.ids = count()
+
+        #Flanken und neue Werkstücke, die vom Thread der Engine abgearbeitet werden
+        self.events = Queue()
+        #Nur im Thread der Engine: Werkstücke, die am Ende eines Laufbands erwartet werden (Laufband -> deque von Workpiece)
+        self.expected = dict((i, deque()) for i in TransportOutputModule.INDEX_CONVEYORS)
+        #Nur im Thread der Engine: belegte Weichen (Weiche -> [Workpiece, Zustand])
+        self.active = {}
+        #Nur im Thread der Engine: zuletzt befohlene Position pro Weiche, damit sie nicht erneut geschrieben wird
+        self.switch_position = {}
+
+        self.workpieces = []
+        self.workpieces_lock = Lock()
+        self.stopped = Event()
+        self.subscriber = None
+
+    def add_route(self, name, steps):
+        """
+        Prüft eine Route und legt sie unter name an.
+        :param name Name der Route
+        :param steps Liste von (Laufband, nächstes Laufband, Weiche, Position vorher, Position nachher), siehe compile_route()
+        :returns die übersetzte Route
+        :rtype tuple of Step
+        """
+        self.routes[name] = compile_route(steps)
+        return self.routes[name]
+
+    def start_workpiece(self, route_name):
+        """
+        Meldet ein neues Werkstück an, das am Ende des ersten Laufbands der Route erwartet wird.
+        Werkstücke auf demselben Laufband werden in der Reihenfolge der Anmeldung bearbeitet.
+        :param route_name Name einer mit add_route() angelegten Route
+        :rtype Workpiece
+        """
+        workpiece = Workpiece(next(self.ids), self.routes[route_name])
+        with self.workpieces_lock:
+            self.workpieces.append(workpiece)
+        self.events.put(workpiece)
+        return workpiece
+
+    def wait(self, workpiece, timeout = None):
+        """
+        Wartet bis das Werkstück seine Route abgeschlossen hat.
+        :returns True wenn die Route abgeschlossen wurde, False bei Timeout
+        :rtype bool
+        """
+        return workpiece.finished.wait(timeout)
+
+    def get_active(self):
+        """
+        Gibt alle Werkstücke zurück, die ihre Route noch nicht abgeschlossen haben.
+        :rtype list of Workpiece
+        """
+        with self.workpieces_lock:
+            return [workpiece for workpiece in self.workpieces if not workpiece.finished.is_set()]
+
+    def run(self):
+        self.subscriber = self.scanner.subscribe(self.events.put)
+        try:
+            while not self.stopped.is_set():
+                try:
+                    events = [self.events.get(timeout=self.tick)]
+                except Empty:
+                    events = []
+                while True:
+                    try:
+                        events.append(self.events.get_nowait())
+                    except Empty:
+                        break
+                for event in events:
+                    if isinstance(event, Workpiece):
+                        self.expected[event.route[0].conveyor].append(event)
+                #Die Zustände werden über die Pegel aus dem letzten Scan geprüft, Flanken wecken die Engine nur auf
+                try:
+                    self.advance()
+                except ModbusTimeoutError as e:
+                    #Ein nicht erreichbarer Knoten beendet die Engine nicht, die Weiche wird beim nächsten Tick erneut gestellt
+                    print("Error advancing routes:", e)
+        finally:
+            self.scanner.unsubscribe(self.subscriber)
+
+    def stop(self):
+        """
+        Beendet den Thread der Engine. Weichen und Laufbänder bleiben in ihrem aktuellen Zustand.
+        """
+        self.stopped.set()
+        self.events.put(None)
+
+    def get_signal(self, device, signal):
+        return bool(self.scanner.get_signal(device, signal))
+
+    def advance(self):
+        """
+        Schaltet alle Zustandsautomaten weiter, deren Bedingung erfüllt ist.
+        """
+        for switch_id, state in list(self.active.items()):
+            workpiece, phase = state
+            step = workpiece.route[workpiece.step]
+            if phase == ENTERING and self.get_signal(switch_id, 'workpiece'):
+                self.set_switch(switch_id, step.post)
+                state[1] = LEAVING
+                self.notify(workpiece, step, LEAVING)
+            elif phase == LEAVING and not self.get_signal(switch_id, 'workpiece'):
+                del self.active[switch_id]
+                self.complete_step(workpiece, step)
+
+        for conveyor_id, queue in self.expected.items():
+            if not queue:
+                continue
+            workpiece = queue[0]
+            step = workpiece.route[workpiece.step]
+            if step.switch not in self.active and self.get_signal(conveyor_id, 'end'):
+                #Erst die Weiche stellen, damit der Schritt bei einem Fehler beim nächsten Tick erneut begonnen wird
+                self.set_switch(step.switch, step.pre)
+                queue.popleft()
+                self.active[step.switch] = [workpiece, ENTERING]
+                self.notify(workpiece, step, ENTERING)
+
+        if self.lookahead:
+            self.preposition()
+
+    def preposition(self):
+        """
+        Stellt jede freie Weiche auf die Position pre des Werkstücks, das sie als nächstes erreicht.
+        Kandidaten sind die vordersten Werkstücke auf jedem Laufband und die Werkstücke in den Weichen,
+        jeweils für die nächsten lookahead Schritte. Bei mehreren Kandidaten gewinnt der mit den wenigsten Schritten bis zur Weiche.
+        """
+        candidates = []
+        for queue in self.expected.values():
+            if queue:
+                candidates.append((0, queue[0]))
+        for workpiece, phase in self.active.values():
+            candidates.append((1, workpiece))
+
+        claimed = {}
+        for distance, workpiece in candidates:
+            start = workpiece.step + distance
+            for i in range(start, min(start + self.lookahead, len(workpiece.route))):
+                step = workpiece.route[i]
+                if step.switch in self.active:
+                    continue
+                steps = i - workpiece.step
+                if step.switch not in claimed or steps < claimed[step.switch][0]:
+                    claimed[step.switch] = (steps, step.pre)
+
+        for switch_id, (steps, pos) in claimed.items():
+            self.set_switch(switch_id, pos)
+
+    def set_switch(self, switch_id, pos):
+        if self.switch_position.get(switch_id) != pos:
+            self.module.set_switch(switch_id, pos=pos)
+            self.switch_position[switch_id] = pos
+
+    def complete_step(self, workpiece, step):
+        workpiece.step += 1
+        self.notify(workpiece, step, None)
+        if workpiece.step == len(workpiece.route):
+            workpiece.finished.set()
+        else:
+            self.expected[step.next_conveyor].append(workpiece)
+
+    def notify(self, workpiece, step, state):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(workpiece, step, state)
+        except Exception as e:
+            #Ein fehlerhafter Callback darf die Engine nicht beenden
+            print("Error in route event callback:", e)
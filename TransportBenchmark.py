@@ -0,0 +1,253 @@
+from TransportOutputModule import TransportOutputModule
+from TransportSimulator import TransportSimulator
+from ModbusConnection import ModbusConnectionPool
+from threading import BoundedSemaphore
+from time import perf_counter, sleep, time
+import argparse
+import json
+import math
+import platform
+
+
+#Übergabesequenz der Routing-Skripte als (Laufband, nächstes Laufband, Weiche, Weichenposition vorher, Weichenposition nachher).
+#TransportEx1.main benutzt Laufbänder als Weichen und importiert ein Modul, das es nicht gibt, deshalb benutzt hier jeder Schritt
+#eine echte Weiche aus TransportOutputModule.INDEX_SWITCHES. Die Topologie des Simulators wird aus diesen Schritten gebaut.
+ROUTE = [
+    ("A", "B", "X", 3, 1),
+    ("B", "D", "C", 3, 1),
+    ("D", "E", "F", 3, 2),
+    ("E", "G", "J", 3, 2),
+    ("G", "H", "M", 3, 1),
+    ("H", "I", "Q", 1, 3),
+    ("I", "K", "R", 2, 1),
+    ("K", "L", "S", 1, 3),
+]
+
+#Alle Laufbänder abwechselnd vorwärts und anhalten, mit einer Anfrage für die Digitalen Ausgänge
+def batch_conveyors(tom, i):
+    with tom.batch():
+        for conveyor_id in tom.INDEX_CONVEYORS:
+            if i % 2:
+                tom.conveyor_forward(conveyor_id)
+            else:
+                tom.conveyor_stop(conveyor_id)
+
+
+#Laufbänder, Weiche und Speeds zusammen, wie beim Starten einer Route
+def batch_route_start(tom, i):
+    with tom.batch():
+        tom.set_conveyor_speeds({'A': 20000 + i % 2, 'B': 20000 + i % 2})
+        tom.conveyor_forward('A')
+        tom.conveyor_forward('B')
+        tom.set_switch('X', pos=1 + i % 2)
+
+
+#Bedingungen für wait_until(), wait_any() und wait_all(), die ohne Werkstücke auf der Strecke sofort erfüllt sind,
+#damit der Aufwand für Lesen und Prüfen gemessen wird und nicht die Wartezeit
+WAIT_CONDITIONS = [('A', 'begin', False), ('A', 'end', False), ('X', 'workpiece', False), ('V1', 'workpiece_in_front', False)]
+
+#Öffentliche Methoden des TransportOutputModule als Name -> Funktion(tom, Durchlauf), die Parameter wechseln ab, damit jeder Aufruf die Ausgänge ändert
+METHODS = {
+    "conveyor_forward": lambda tom, i: tom.conveyor_forward("A"),
+    "conveyor_backward": lambda tom, i: tom.conveyor_backward("A"),
+    "conveyor_stop": lambda tom, i: tom.conveyor_stop("A"),
+    "conveyor_forward_stop": lambda tom, i: tom.conveyor_forward("B") if i % 2 else tom.conveyor_stop("B"),
+    "all_conv_stop": lambda tom, i: tom.all_conv_stop(),
+    "set_switch": lambda tom, i: tom.set_switch("X", pos=i % 4),
+    "set_seperator": lambda tom, i: tom.set_seperator("V1"),
+    "reset_seperator": lambda tom, i: tom.reset_seperator("V1"),
+    "set_reset_seperator": lambda tom, i: tom.set_seperator("V2") if i % 2 else tom.reset_seperator("V2"),
+    "set_conveyor_speed": lambda tom, i: tom.set_conveyor_speed("A", 10000 + i % 2),
+    "set_conveyor_speed_all": lambda tom, i: tom.set_conveyor_speed_all(20000 + i % 2),
+    "update_conveyor_speed": lambda tom, i: tom.update_conveyor_speed(),
+    "update_conveyor_speed_force": lambda tom, i: tom.update_conveyor_speed(force=True),
+    "check_conveyor_workpiece_begin": lambda tom, i: tom.check_conveyor_workpiece_begin("A"),
+    "check_conveyor_workpiece_end": lambda tom, i: tom.check_conveyor_workpiece_end("A"),
+    "check_switch_position_reached": lambda tom, i: tom.check_switch_position_reached("X"),
+    "check_switch_in_movement": lambda tom, i: tom.check_switch_in_movement("X"),
+    "check_switch_workpiece": lambda tom, i: tom.check_switch_workpiece("X"),
+    "check_switch_in_reference_position": lambda tom, i: tom.check_switch_in_reference_position("X"),
+    "check_seperator_set": lambda tom, i: tom.check_seperator_set("V1"),
+    "check_seperator_workpiece_behind": lambda tom, i: tom.check_seperator_workpiece_behind("V1"),
+    "check_seperator_workpiece_in_front": lambda tom, i: tom.check_seperator_workpiece_in_front("V1"),
+    "get_output_register": lambda tom, i: tom.get_output_register(0, tom.DIGITAL_OUTPUT_WORDS),
+    "get_input_register": lambda tom, i: tom.get_input_register(0, tom.DIGITAL_INPUT_WORDS),
+    "read_process_image": lambda tom, i: tom.read_process_image(),
+    "resync_output_image": lambda tom, i: tom.resync_output_image(),
+    "batch_conveyors": batch_conveyors,
+    "batch_route_start": batch_route_start,
+    "wait_until": lambda tom, i: tom.wait_until(WAIT_CONDITIONS[0]),
+    "wait_any": lambda tom, i: tom.wait_any(WAIT_CONDITIONS),
+    "wait_all": lambda tom, i: tom.wait_all(WAIT_CONDITIONS),
+    "decode_sensor_image": lambda tom, i: tom.decode_sensor_image(),
+    "decode_sensor_image_words": lambda tom, i: tom.decode_sensor_image([i & 0xFFFF] * tom.DIGITAL_INPUT_WORDS),
+}
+
+
+class TransactionCounter:
+    """
+    Zählt die Modbus Anfragen und Frame-Bytes der ModbusClients, an die er angehängt ist.
+    Gezählt werden MBAP Header und PDU, ohne TCP/IP Overhead und Verbindungsaufbau.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+
+    def attach(self, pool, host):
+        #Der Pool verleiht immer dieselben Clients, einmal anhängen reicht also für alle Anfragen
+        for client in list(pool.get_clients(host).queue):
+            client.on_tx_rx = self.on_tx_rx
+
+    def on_tx_rx(self, frame, is_tx):
+        if is_tx:
+            self.transactions += 1
+            self.bytes_tx += len(frame)
+        else:
+            self.bytes_rx += len(frame)
+
+
+def percentile(samples, p):
+    """
+    Perzentil einer Liste von Messwerten nach der Nearest-Rank Methode.
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100.0 * len(ordered)) - 1)]
+
+
+def summarize(samples, counter, calls):
+    return {
+        "calls": calls,
+        "transactions": counter.transactions,
+        "transactions_per_call": counter.transactions / calls,
+        "bytes_tx_per_call": counter.bytes_tx / calls,
+        "bytes_rx_per_call": counter.bytes_rx / calls,
+        "latency_p50_ms": percentile(samples, 50) * 1000,
+        "latency_p99_ms": percentile(samples, 99) * 1000,
+        "latency_mean_ms": sum(samples) / len(samples) * 1000,
+        "latency_max_ms": max(samples) * 1000,
+    }
+
+
+def benchmark_method(tom, counter, function, iterations):
+    """
+    Ruft function nach einem Aufwärmaufruf iterations mal auf und gibt Anfragen, Bytes und Latenzen zurück.
+    """
+    function(tom, -1)
+    counter.reset()
+    samples = []
+    for i in range(iterations):
+        start = perf_counter()
+        function(tom, i)
+        samples.append(perf_counter() - start)
+    return summarize(samples, counter, iterations)
+
+
+def route_topology(route):
+    topology = {}
+    for conveyor, next_conveyor, switch, pre, post in route:
+        topology[conveyor] = switch
+        topology.setdefault(switch, {})[pre] = conveyor
+        topology[switch][post] = next_conveyor
+    return topology
+
+
+def wait_until(check, poll_interval):
+    while not check():
+        sleep(poll_interval)
+
+
+def run_route(tom, simulator, route, poll_interval):
+    """
+    Führt die Übergabesequenz von check_workpiece_end_of_conveyor für ein Werkstück über die ganze Route aus.
+    Die Sensoren werden wie in den Routing-Skripten gepollt, die festen sleeps der Skripte werden mit der time_scale des Simulators skaliert.
+    :returns Latenz jedes Übergabeschritts in Sekunden
+    """
+    pause = 1.0 / simulator.time_scale
+    simulator.add_workpiece(route[0][0])
+    steps = []
+    for conveyor, next_conveyor, switch, pre, post in route:
+        start = perf_counter()
+        wait_until(lambda: tom.check_conveyor_workpiece_end(conveyor), poll_interval)
+        tom.set_switch(switch, pos=pre)
+        sleep(pause)
+        wait_until(lambda: tom.check_switch_position_reached(switch), poll_interval)
+        wait_until(lambda: tom.check_switch_workpiece(switch), poll_interval)
+        tom.set_switch(switch, pos=post)
+        sleep(pause)
+        steps.append(perf_counter() - start)
+    wait_until(lambda: tom.check_conveyor_workpiece_end(route[-1][1]), poll_interval)
+    return steps
+
+
+def benchmark_route(tom, counter, simulator, route, poll_interval):
+    with tom.batch():
+        tom.set_conveyor_speed_all(30000)
+        for conveyor, next_conveyor, switch, pre, post in route:
+            tom.conveyor_forward(conveyor)
+            tom.conveyor_forward(next_conveyor)
+            tom.set_switch(switch, pos=0)
+    counter.reset()
+    start = perf_counter()
+    steps = run_route(tom, simulator, route, poll_interval)
+    duration = perf_counter() - start
+    result = summarize(steps, counter, len(steps))
+    result["duration_s"] = duration
+    result["poll_interval_s"] = poll_interval
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks TransportOutputModule against the local transport simulator")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--time-scale", type=float, default=50.0)
+    parser.add_argument("--poll-interval", type=float, default=0.01)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    host = "127.0.0.1"
+    simulator = TransportSimulator(host=host, port=args.port, time_scale=args.time_scale, topology=route_topology(ROUTE))
+    simulator.start()
+
+    pool = ModbusConnectionPool(port=args.port)
+    counter = TransactionCounter()
+    counter.attach(pool, host)
+    tom = TransportOutputModule(host, read_write_sem=BoundedSemaphore(value=1), connection_pool=pool)
+
+    results = {
+        "timestamp": time(),
+        "python": platform.python_version(),
+        "iterations": args.iterations,
+        "time_scale": args.time_scale,
+        "methods": {},
+    }
+    try:
+        for name, function in METHODS.items():
+            try:
+                results["methods"][name] = benchmark_method(tom, counter, function, args.iterations)
+            except ImportError as e:
+                #decode_sensor_image() benötigt numpy
+                print("{:40} skipped: {}".format(name, e))
+                continue
+            print("{:40} {:6.2f} tx/call  p50 {:7.3f} ms  p99 {:7.3f} ms".format(
+                name, results["methods"][name]["transactions_per_call"],
+                results["methods"][name]["latency_p50_ms"], results["methods"][name]["latency_p99_ms"]))
+
+        results["route"] = benchmark_route(tom, counter, simulator, ROUTE, args.poll_interval)
+        print("{:40} {:6d} tx total  {:.3f} s".format("route", results["route"]["transactions"], results["route"]["duration_s"]))
+    finally:
+        pool.close()
+        simulator.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
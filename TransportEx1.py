@@ -1,6 +1,6 @@
 # Import required modules
 from TransportInputModule import *
-import paho.mqtt.publish as publish
+from MqttTelemetry import TelemetryPublisher
 from time import sleep
 
 # Initialize variables
@@ -8,6 +8,9 @@ from time import sleep
 Conveyor = {'A': 0, 'B': 0, 'D': 0, 'H': 0, 'I': 0, 'P': 0, 'R': 0, 'VL': 0, 'Q': 0}
 Switch = {'N': 0, 'T': 0, 'F': 0, 'W': 0, 'E': 0, 'G': 0, 'K': 0, 'S': 0, 'O': 0}
 
+# One persistent MQTT connection for all status messages; publishing never blocks the routing
+status = TelemetryPublisher("192.168.200.161")
+
 # Initialize the Transport Input Module
 TIM = TransportInputModule("192.168.200.235")
 TIM.set_conveyor_speed_all(0)
@@ -25,16 +28,14 @@ def check_workpiece_end_of_conveyor(conveyor_name, next_conveyor_name, switch_na
 
     # Update the status of the conveyor and switch
     Conveyor[conveyor_name] = "0"
-    publish.single("Transport_Ingoing/Conveyor_" + conveyor_name + "/Status", Conveyor[conveyor_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Conveyor_" + conveyor_name + "/Status", Conveyor[conveyor_name])
 
     while not TIM.check_switch_position_reached(switch_name):
         sleep(0.5)
 
     print("Found workpiece at the switch " + switch_name)
     Switch[switch_name] = "Found workpiece at the switch " + switch_name
-    publish.single("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name])
 
     # Wait until the workpiece reaches inside the switch
     while not TIM.check_switch_workpiece(switch_name):
@@ -43,15 +44,13 @@ def check_workpiece_end_of_conveyor(conveyor_name, next_conveyor_name, switch_na
 
     # Update the status of the switch
     Switch[switch_name] = "0"
-    publish.single("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Switch_" + switch_name + "/Status", Switch[switch_name])
 
     # Update the status of the next conveyor
 
     print("Found workpiece at the conveyor " + next_conveyor_name)
     Conveyor[next_conveyor_name] = "Found workpiece at the conveyor " + next_conveyor_name
-    publish.single("Transport_Ingoing/Conveyor_" + next_conveyor_name + "/Status", Conveyor[next_conveyor_name],
-                   hostname="192.168.200.161")
+    status.publish("Transport_Ingoing/Conveyor_" + next_conveyor_name + "/Status", Conveyor[next_conveyor_name])
 
     sleep(1)
 
@@ -79,4 +78,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # The publisher thread is a daemon, so send the queued status messages before the script exits
+        status.close()
\ No newline at end of file
@@ -1,22 +1,182 @@
-from pyModbusTCP.client import ModbusClient
 from pyModbusTCP.utils import get_bits_from_int
-from pyModbusTCP.utils import set_bit
-from pyModbusTCP.utils import reset_bit
-from pyModbusTCP.utils import test_bit
-from time import sleep
-
-from multiprocessing import BoundedSemaphore
-
+from time import sleep, perf_counter, monotonic
+from contextlib import contextmanager, nullcontext
+from types import MappingProxyType
+import sys
+
+from threading import RLock, local
+
+from ModbusConnection import DEFAULT_CONNECTION_POOL, DEFAULT_RETRY_POLICY, ModbusTimeoutError
+from ModbusMetrics import DEFAULT_METRICS
+
+try:
+    import numpy as np
+except ImportError:
+    #numpy wird nur für decode_sensor_image() benötigt
+    np = None
+
+
+def word_offset(bit_nr):
+    """
+    Berechnet den Offset des Words, in dem das Bit bit_nr liegt, zur DIGITAL_INPUT_STARTING_ADDRESS/DIGITAL_OUTPUT_STARTING_ADDRESS.
+    :param bit_nr Nummer des Bits für den der Offset errechnet werden soll
+    :returns offset des bits
+    :rtype int
+    """
+    #Offset 0 -> 16 - 31
+    #Offset 1 ->  0 - 15
+    #Offset 2 -> 48 - 63
+    #Offset 3 -> 32 - 47
+    #Offset 5 -> 64 - 79 
+    #(Theoretisch 79, aber 67 ist das höchste benötigte bit, deswegen wird Offset 4 eigentlich nicht benötigt)
+    #Offset Reihenfolge liegt an der Little Endian Reihenfolge
+    if bit_nr >= 16 and bit_nr <= 31:
+        return 0
+    if bit_nr >= 0 and bit_nr <= 15:
+        return 1
+    if bit_nr >= 48 and bit_nr <= 63:
+        return 2
+    if bit_nr >= 32 and bit_nr <= 47:
+        return 3
+    if bit_nr >= 80 and bit_nr <= 95:
+        return 4
+    if bit_nr >= 64 and bit_nr <= 79:
+        return 5
+
+def compile_index(index):
+    """
+    Übersetzt eine Map wie TransportOutputModule.INDEX einmalig in eine unveränderliche Tabelle,
+    die pro Gerät für jede Funktion den Offset des Words und die Bitmaske innerhalb des Words enthält.
+    :param index Map Gerät -> Liste der Bit Nummern
+    :returns Map Gerät -> Tuple von (Offset, Bitmaske)
+    :rtype MappingProxyType
+    """
+    table = {}
+    for device, bits in index.items():
+        address = []
+        for bit_nr in bits:
+            offset = word_offset(bit_nr)
+            if offset is None:
+                raise ValueError("Bit {} of device {!r} is outside of the module".format(bit_nr, device))
+            #Bit Nummer wird Modulo 16 gerechnet, da alle 16 Bit ein neues word anfängt
+            address.append((offset, 1 << (bit_nr % 16)))
+        table[device] = tuple(address)
+    return MappingProxyType(table)
+
+def compile_sensors(address, conveyors, switches, signals):
+    """
+    Erstellt aus der Tabelle ADDRESS die Liste aller Eingangssignale (Sensoren und Statusbits).
+    :param address Tabelle wie von compile_index() erzeugt
+    :param conveyors Indize der Laufbänder
+    :param switches Indize der Weichen (alle anderen Geräte sind Vereinzeler)
+    :param signals [Signalnamen Laufband, Signalnamen Weiche, Signalnamen Vereinzeler], None wenn die Funktion kein Eingang ist
+    :returns Tuple von (Gerät, Signalname, Offset, Bitmaske)
+    :rtype tuple
+    """
+    sensors = []
+    for device, entries in address.items():
+        if device in conveyors:
+            names = signals[0]
+        elif device in switches:
+            names = signals[1]
+        else:
+            names = signals[2]
+        for name, (offset, mask) in zip(names, entries):
+            if name is not None:
+                sensors.append((device, name, offset, mask))
+    return tuple(sensors)
+
+
+
+class ConditionTimeoutError(TimeoutError):
+    """
+    Wird von wait_until(), wait_any() und wait_all() geworfen, wenn die Bedingung innerhalb des Timeouts nicht erfüllt wurde.
+    """
+
+class StaleOutputImageError(Exception):
+    """
+    Wird von request_with_retry() geworfen, wenn die Verbindung seit dem Lesen des Ausgangsabbilds neu aufgebaut wurde
+    und die zu schreibenden Words deshalb veraltet sein können. Wird von write_output_image() behandelt.
+    """
+
+def calling_method():
+    """
+    Gibt den Namen der äußersten Methode dieses Moduls im Call Stack zurück, also die Methode, die von außen aufgerufen wurde
+    und letztendlich eine Modbus Anfrage auslöst (z.B. check_switch_workpiece und nicht get_input_register).
+    :rtype str
+    """
+    frame = sys._getframe(1)
+    method = None
+    while frame is not None and frame.f_code.co_filename == calling_method.__code__.co_filename:
+        method = frame.f_code.co_name
+        frame = frame.f_back
+    return method
+
+class OutputImage:
+    """
+    Ausgangsabbild eines Modbus Knotens, das sich alle TransportOutputModule teilen, die über denselben ModbusConnectionPool mit dem Knoten sprechen.
+    Hätte jedes Modul eine eigene Kopie, würde ein Modul beim Schreiben eines Words die Bits, die ein anderes Modul im selben Word gesetzt hat,
+    mit seinem veralteten Stand überschreiben.
+    """
+
+    def __init__(self, words):
+        """
+        Konstruktor des OutputImages.
 
+        :param words Anzahl der Words der Digitalen Ausgänge
+        """
+        #Lokale Kopie der Digitalen Ausgänge, wird immer an Ort und Stelle geändert, damit alle Module dieselbe Liste sehen
+        self.words = [0] * words
+        #Generation der Verbindung (siehe ModbusConnectionPool.get_generation()), mit der words gelesen wurde, None wenn neu gelesen werden muss
+        self.generation = None
+        #Ein Lock pro Word, damit Befehle an Geräte in verschiedenen Words parallel laufen (siehe TransportOutputModule.output_words())
+        self.locks = [RLock() for i in range(words)]
+
+        #Zuletzt erfolgreich geschriebene Speeds pro Gruppe (Steuer-Word -> Speeds), siehe TransportOutputModule.update_conveyor_speed()
+        self.written_speed = {}
+        #Generation der Verbindung, mit der written_speed geschrieben wurde
+        self.speed_generation = None
+        #Schützt die Speeds und written_speed, die Analogen Ausgänge sind unabhängig von den Digitalen
+        self.speed_lock = RLock()
+
+class BatchState(local):
+    """
+    Zustand von TransportOutputModule.batch(). Jeder Thread sieht seine eigene Instanz (threading.local),
+    damit ein Batch nur die Befehle des Threads sammelt, der ihn geöffnet hat.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.clear()
+
+    def clear(self):
+        #Kopie des Ausgangsabbilds, auf der die Befehle im Batch arbeiten, und der Stand beim Anlegen der Kopie
+        self.image = None
+        self.base = None
+        #Offsets der Words, die im Batch geändert wurden
+        self.offsets = set()
+        #Speeds, die im Batch gesetzt wurden, und ob update_conveyor_speed() aufgerufen wurde
+        self.speeds = {}
+        self.speed = False
 
 class TransportOutputModule:
     #Konstanten
     DIGITAL_INPUT_STARTING_ADDRESS = 8001
     DIGITAL_OUTPUT_STARTING_ADDRESS = 8018
+    #Anzahl der Words der Digitalen Eingänge (8001 - 8006), die für das Prozessabbild auf einmal gelesen werden
+    DIGITAL_INPUT_WORDS = 6
+    #Anzahl der Words der Digitalen Ausgänge (8018 - 8023), die lokal im Ausgangsabbild gehalten werden
+    DIGITAL_OUTPUT_WORDS = 6
 
 
     INDEX_CONVEYORS = ['A', 'B', 'D', 'E', 'G', 'H', 'I', 'K', 'L', 'N', 'O', 'P', 'T', 'U', 'V', 'W']
     INDEX_SWITCHES = ['C', 'F', 'J', 'M', 'Q', 'R', 'S', 'X']
+    #Gruppen der Analogen Ausgänge für die Laufbandspeed: [Steuer-Word, Laufbänder des ersten Kanalsatzes, Laufbänder des zweiten Kanalsatzes]
+    #Die Speeds eines Kanalsatzes liegen in den 4 Words direkt nach dem Steuer-Word
+    SPEED_GROUPS = [
+        [8024, ['A', 'B', 'D', 'E'], ['G', 'H', 'I', 'K']],
+        [8029, ['L', 'N', 'O', 'P'], ['T', 'U', 'V', 'W']]
+    ]
     #Mappt die Idize der Laufbänder, Weichen und Vereinzeler auf die Digitalen Ein- und Ausgänge mit denen diese verbunden sind
     #Abgeleitet aus den Tabellen 2.1, 2.2, 2.3 und 2.4 aus Kapitel 2.1.3 der Hardwaredokumentation
     INDEX = {
@@ -54,29 +214,71 @@ class TransportOutputModule:
         'V3' : [66, 70, 71, 72]
 
     }
+    #Einmalig vorberechnete (Offset, Bitmaske) Einträge pro Gerät und Funktion, siehe compile_index()
+    ADDRESS = compile_index(INDEX)
+
+    #Namen der Eingangssignale pro Funktion (Reihenfolge wie in der Map INDEX), passend zu den check_* Methoden
+    SIGNALS_CONVEYOR = ['begin', 'end']
+    SIGNALS_SWITCH = ['position_reached', 'in_movement', 'workpiece', 'reference_position']
+    SIGNALS_SEPERATOR = [None, 'set', 'workpiece_behind', 'workpiece_in_front']
+    #Alle Eingangssignale als (Gerät, Signalname, Offset, Bitmaske)
+    SENSORS = compile_sensors(ADDRESS, INDEX_CONVEYORS, INDEX_SWITCHES, [SIGNALS_CONVEYOR, SIGNALS_SWITCH, SIGNALS_SEPERATOR])
+    #(Gerät, Signalname) -> (Offset, Bitmaske) für die Bedingungen von wait_until()
+    SENSOR_ADDRESS = MappingProxyType({(device, name): (offset, mask) for device, name, offset, mask in SENSORS})
+    #Offsets, Bitmasken und Feldnamen (z.B. 'A_end', 'C_workpiece', 'V1_set') der SENSORS für decode_sensor_image()
+    if np is not None:
+        SENSOR_OFFSETS = np.array([offset for device, name, offset, mask in SENSORS], dtype=np.intp)
+        SENSOR_MASKS = np.array([mask for device, name, offset, mask in SENSORS], dtype=np.uint16)
+        SENSOR_DTYPE = np.dtype([(device + '_' + name, np.bool_) for device, name, offset, mask in SENSORS])
 
     
-    def __init__(self,ip_addr, read_write_sem = BoundedSemaphore(value=1)):
+    def __init__(self,ip_addr, read_write_sem = None, process_image = False, connection_pool = DEFAULT_CONNECTION_POOL, metrics = DEFAULT_METRICS, retry_policy = DEFAULT_RETRY_POLICY):
         """
         Konstruktor des TranporAusgangModuls.
 
         :param ip_addr Ip-Adresse des Modbus Knoten, welche für die Bearbeiten Station zuständig ist (String)
-        :param read_write_sem Semaphore die übergeben werden kann, wenn nicht erwünscht ist, dass 2 Module gleichzeitig read/write Befehle schicken
+        :param read_write_sem Semaphore die übergeben werden kann, wenn nicht erwünscht ist, dass 2 Module gleichzeitig read/write Befehle schicken.
+                              Standardmäßig wird nur pro Knoten serialisiert: jede Verbindung des connection_pool wird immer nur von einem Thread benutzt,
+                              Module verschiedener Knoten arbeiten parallel
+        :param process_image Wenn True, beantworten die check_* Methoden ihre Anfragen aus dem Prozessabbild (siehe read_process_image())
+        :param connection_pool ModbusConnectionPool, der die Verbindungen zum Modbus offen hält (Standardmäßig ein Pool für alle Module im Prozess)
+        :param metrics ModbusMetrics, in denen alle Modbus Anfragen gezählt werden (Standardmäßig die Metriken für alle Module im Prozess, None schaltet das Zählen ab)
+        :param retry_policy RetryPolicy, nach der fehlgeschlagene Lese- und Schreibzugriffe wiederholt werden
         """
+        self.host = ip_addr
+        self.connection_pool = connection_pool
         try:
-            #Erzeugt eine Verbindung zum Modbus mit der ip_addr
-            self.client = ModbusClient(host=ip_addr, auto_open=True, auto_close=True)
+            #Legt die langlebigen Verbindungen zum Modbus mit der ip_addr an
+            self.connection_pool.get_clients(ip_addr)
         except ValueError:
             print("Error with host param")
+
+        self.metrics = metrics
+        self.retry_policy = retry_policy
         
-        #Semaphore, die dafür sorgt, dass immer nur ein Thread gleichzeitig auf die In- und Outputs des Modbus zugreifen kann
-        self.sem = BoundedSemaphore(value=1)
+        self.read_write_sem = read_write_sem if read_write_sem is not None else nullcontext()
+
+        #Prozessabbild der Digitalen Eingänge, wird von read_process_image() gefüllt
+        self.process_image = process_image
+        self.input_image = None
 
-        self.read_write_sem = read_write_sem
+        #Lokale Kopie der Digitalen Ausgänge, auf der alle Befehle arbeiten, damit vor dem Schreiben nicht gelesen werden muss.
+        #Wird beim ersten Befehl und nach jedem Reconnect vom Modbus gelesen (siehe resync_output_image()).
+        #Alle Module, die über denselben connection_pool mit dem Knoten sprechen, teilen sich das Abbild und seine Locks (siehe OutputImage)
+        self.outputs = self.connection_pool.get_shared(ip_addr, 'outputs', lambda: OutputImage(self.DIGITAL_OUTPUT_WORDS))
+        self.output_image = self.outputs.words
+        self.word_locks = self.outputs.locks
+        self.speed_lock = self.outputs.speed_lock
+
+        #Zustand von batch() für jeden Thread (siehe BatchState)
+        self.batch_state = BatchState()
+        #Ausgangsabbild vor dem laufenden Befehl des Threads, damit write_output_image() nach einem Reconnect nur dessen Änderungen übernimmt
+        self.command_state = local()
 
         #Speed der Laufbänder 0 = 0V/0% | 30000 = 10V/100%
         #Standardmäßig alle Speeden auf 0%
-        self.conveyor_speed = {
+        #Wird wie das Ausgangsabbild von allen Modulen auf dem Knoten geteilt, da update_conveyor_speed() immer ganze Gruppen schreibt
+        self.conveyor_speed = self.connection_pool.get_shared(ip_addr, 'conveyor_speed', lambda: {
             'A' : 0,
             'B' : 0,
             'D' : 0, 
@@ -93,22 +295,88 @@ class TransportOutputModule:
             'U' : 0, 
             'V' : 0, 
             'W' : 0
-            }
+            })
+
+        #Zuletzt erfolgreich geschriebene Speeds pro Gruppe, damit update_conveyor_speed() nur Änderungen schreibt
+        self.written_speed = self.outputs.written_speed
+
+        #ProcessImageScanner, der die Eingänge dieses Moduls scannt (wird vom Scanner gesetzt), damit wait_until() nicht selbst pollen muss
+        self.scanner = None
 
-    def get_output_register(self, offset = 0, amount = 1):
+    def request(self, function_code, register, method, call, *args):
+        """
+        Führt eine einzelne Modbus Anfrage aus und zählt sie mit ihrer Dauer in self.metrics.
+        :param function_code Modbus Funktionscode der Anfrage
+        :param register erstes Register der Anfrage
+        :param method Name der aufrufenden Methode (siehe calling_method())
+        :param call Methode des ModbusClients, die aufgerufen wird
+        :param args Parameter für call
+        :returns Rückgabewert von call
+        """
+        if self.metrics is None:
+            return call(*args)
+        start = perf_counter()
+        result = call(*args)
+        #pyModbusTCP liefert bei Lesefehlern None und bei Schreibfehlern False
+        self.metrics.observe(self.host, function_code, register, method, perf_counter() - start, result is not None and result is not False)
+        return result
+
+    def count_retry(self, function_code, register, method):
+        """
+        Zählt eine Wiederholung einer fehlgeschlagenen Modbus Anfrage in self.metrics.
+        """
+        if self.metrics is not None:
+            self.metrics.retry(self.host, function_code, register, method)
+
+    def request_with_retry(self, function_code, register, name, *args, method = None, generation = None):
+        """
+        Führt eine Modbus Anfrage aus und wiederholt sie nach self.retry_policy, bis sie erfolgreich ist.
+        Zwischen zwei Versuchen wird ohne read_write_sem gewartet, damit andere Threads in der Zeit weiterarbeiten können.
+        :param function_code Modbus Funktionscode der Anfrage
+        :param register erstes Register der Anfrage
+        :param name Name der Methode des ModbusClients, z.B. 'read_holding_registers'
+        :param args Parameter der Anfrage
+        :param method Name der Methode, unter der die Anfrage gezählt wird (Standardmäßig calling_method())
+        :param generation Generation der Verbindung, mit der die Daten der Anfrage gelesen wurden (siehe ModbusConnectionPool.get_generation()).
+                          Wurde die Verbindung seitdem neu aufgebaut, wird die Anfrage nicht gesendet
+        :returns Ergebnis der Anfrage
+        :raises ModbusTimeoutError wenn die RetryPolicy keine weiteren Versuche erlaubt
+        :raises StaleOutputImageError wenn sich die Generation der Verbindung geändert hat
+        """
+        if method is None:
+            method = calling_method()
+        start = monotonic()
+        attempt = 0
+        while True:
+            with self.read_write_sem:
+                with self.connection_pool.connection(self.host) as client:
+                    #Erst nach dem Ausleihen prüfen, da das Ausleihen selbst die Verbindung neu aufbauen kann
+                    if generation is not None and self.connection_pool.get_generation(self.host) != generation:
+                        raise StaleOutputImageError("connection to {} was reestablished".format(self.host))
+                    result = self.request(function_code, register, method, getattr(client, name), *args)
+            #pyModbusTCP liefert bei Lesefehlern None und bei Schreibfehlern False
+            if result is not None and result is not False:
+                return result
+            attempt += 1
+            delay = self.retry_policy.get_delay(attempt, monotonic() - start)
+            if delay is None:
+                raise ModbusTimeoutError("{} of register {} on {} failed after {} attempts".format(name, register, self.host, attempt))
+            self.count_retry(function_code, register, method)
+            sleep(delay)
+
+    def get_output_register(self, offset = 0, amount = 1, method = None):
         """
         Gibt die Output Register des Modbus zurück.
 
         :param offset Offset zur DIGITAL_OUTPUT_STARTING_ADDRESS
         :param amount Amount der Register die ausgelesen werden
-        :returns Liste der gelesenen Register (oder garnichts wenn lesen fehlschlägt)
-        :rtype list of int or none
+        :param method Name der Methode, unter der die Anfrage in self.metrics gezählt wird (Standardmäßig calling_method())
+        :returns Liste der gelesenen Register
+        :rtype list of int
+        :raises ModbusTimeoutError wenn das Lesen auch nach allen Wiederholungen der RetryPolicy fehlschlägt
         """
-        with self.read_write_sem:
-            result = None
-            while result == None:
-                result = self.client.read_holding_registers(reg_addr=self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset,reg_nb = amount)
-            return result
+        address = self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset
+        return self.request_with_retry(3, address, 'read_holding_registers', address, amount, method=method)
 
     def get_input_register(self, offset = 0, amount = 1):
         """
@@ -116,26 +384,232 @@ class TransportOutputModule:
 
         :param offset Offset zur DIGITAL_INPUT_STARTING_ADDRESS
         :param amount Amount der Register die ausgelesen werden
-        :returns Liste der gelesenen Register (oder garnichts wenn lesen fehlschlägt)
-        :rtype list of int or none
+        :returns Liste der gelesenen Register
+        :rtype list of int
+        :raises ModbusTimeoutError wenn das Lesen auch nach allen Wiederholungen der RetryPolicy fehlschlägt
         """
-        with self.read_write_sem:
-            result = None
-            while result == None:
-                result = self.client.read_holding_registers(reg_addr=self.DIGITAL_INPUT_STARTING_ADDRESS + offset,reg_nb = amount)
-            return result
+        address = self.DIGITAL_INPUT_STARTING_ADDRESS + offset
+        return self.request_with_retry(3, address, 'read_holding_registers', address, amount)
+
+    def read_process_image(self):
+        """
+        Liest alle Words der Digitalen Eingänge ab DIGITAL_INPUT_STARTING_ADDRESS mit einer einzigen Modbus Anfrage und speichert sie als Prozessabbild.
+        Ist der Prozessabbild-Modus aktiv, werden alle check_* Methoden bis zum nächsten Aufruf aus diesem Abbild beantwortet.
+        :returns Liste der gelesenen Input Words
+        :rtype list of int
+        """
+        self.input_image = self.get_input_register(0, self.DIGITAL_INPUT_WORDS)
+        return self.input_image
+
+    def get_input_word(self, offset):
+        """
+        Gibt ein einzelnes Input Word zurück. Im Prozessabbild-Modus wird das Word aus dem letzten Scan genommen
+        (beim ersten Zugriff wird einmal gescannt), ansonsten wird es direkt vom Modbus gelesen.
+        :param offset Offset zur DIGITAL_INPUT_STARTING_ADDRESS
+        :returns Wert des Words
+        :rtype int
+        """
+        if self.process_image:
+            if self.input_image is None:
+                self.read_process_image()
+            return self.input_image[offset]
+        return self.get_input_register(offset)[0]
 
-    def set_output_register(self, register, offset = 0):
+    def decode_sensor_image(self, words = None):
+        """
+        Dekodiert alle Eingangssignale aus SENSORS (Sensoren der Laufbänder, Statusbits der Weichen und Vereinzeler) mit einer einzigen NumPy Operation.
+        Benötigt numpy.
+        :param words Input Words ab DIGITAL_INPUT_STARTING_ADDRESS, auch mehrere Scans als 2D Array (Standardmäßig wird das Prozessabbild neu gelesen)
+        :returns structured array mit einem Eintrag pro Scan und einem bool Feld pro Signal, z.B. image['A_end'][0].
+                 image.view(numpy.bool_) gibt die Signale als bool Vektor in der Reihenfolge von SENSORS zurück
+        :rtype numpy.ndarray
+        """
+        if np is None:
+            raise ImportError("decode_sensor_image() requires numpy")
+        if words is None:
+            words = self.read_process_image()
+        words = np.atleast_2d(np.asarray(words, dtype=np.uint16))
+        values = np.ascontiguousarray((words[:, self.SENSOR_OFFSETS] & self.SENSOR_MASKS) != 0)
+        return values.view(self.SENSOR_DTYPE)[:, 0]
+
+    def set_output_register(self, register, offset = 0, generation = None):
         """
         Überschreibt das Output Register des Modbus.
 
         :param register List of int die in das Register geschrieben werden soll
         :param offset Offset zur DIGITAL_OUTPUT_STARTING_ADDRESS
+        :param generation Generation der Verbindung, mit der register gelesen wurde (siehe request_with_retry())
+        :raises ModbusTimeoutError wenn das Schreiben auch nach allen Wiederholungen der RetryPolicy fehlschlägt
+        :raises StaleOutputImageError wenn die Verbindung seit generation neu aufgebaut wurde
+        """
+        address = self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset
+        self.request_with_retry(16, address, 'write_multiple_registers', address, register, generation=generation)
+
+    def resync_output_image(self, method = None):
+        """
+        Liest alle Words der Digitalen Ausgänge vom Modbus und überschreibt damit das lokale Ausgangsabbild.
+        Wird automatisch beim ersten Befehl und nach einem Reconnect aufgerufen, kann aber auch jederzeit manuell aufgerufen werden.
+        :param method Name des Befehls, unter dem das Lesen in self.metrics gezählt wird (Standardmäßig calling_method())
+        :returns das neue Ausgangsabbild
+        :rtype list of int
+        """
+        #Während des Lesens darf kein Befehl das Ausgangsabbild ändern, sonst ginge die Änderung verloren
+        with self.lock_output_words(range(self.DIGITAL_OUTPUT_WORDS)):
+            self.output_image[:] = self.get_output_register(0, self.DIGITAL_OUTPUT_WORDS, method or calling_method())
+            #Generation erst nach dem Lesen merken, da das Lesen selbst die Verbindung aufbauen kann
+            self.outputs.generation = self.connection_pool.get_generation(self.host)
+            return self.output_image
+
+    def get_output_image(self, method = None):
         """
+        Gibt das lokale Ausgangsabbild zurück. Ist es noch nicht vorhanden oder wurde die Verbindung zum Modbus
+        seit dem letzten Lesen neu aufgebaut, wird es vorher vom Modbus gelesen.
+        :param method Name des Befehls, unter dem das Lesen in self.metrics gezählt wird (Standardmäßig calling_method())
+        :returns Ausgangsabbild, Index entspricht dem Offset zur DIGITAL_OUTPUT_STARTING_ADDRESS
+        :rtype list of int
+        """
+        #Die Verbindung wird vorher geöffnet, damit ein Reconnect hier bemerkt wird und nicht erst beim Schreiben
         with self.read_write_sem:
-            result = None
-            while result == None:
-                result = self.client.write_multiple_registers(self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset, register)
+            generation = self.connection_pool.open_connection(self.host)
+        #generation ist None, wenn noch nie gelesen wurde oder das Abbild nach einem Schreibfehler als veraltet markiert ist
+        if self.outputs.generation != generation:
+            self.resync_output_image(method or calling_method())
+        return self.output_image
+
+    @contextmanager
+    def lock_output_words(self, offsets):
+        """
+        Sperrt die Words des Ausgangsabbilds mit den angegebenen Offsets für den aktuellen Thread und gibt das Ausgangsabbild zurück.
+        Die Locks werden immer in aufsteigender Reihenfolge genommen, damit sich zwei Threads nicht gegenseitig blockieren können.
+        :param offsets Offsets zur DIGITAL_OUTPUT_STARTING_ADDRESS
+        """
+        locks = [self.word_locks[offset] for offset in sorted(set(offsets))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield self.output_image
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def output_words(self, *offsets):
+        """
+        Gibt das Ausgangsabbild zurück, in dem ein Befehl die Words mit den angegebenen Offsets ändert, und sperrt diese Words solange.
+        Befehle an Geräte in verschiedenen Words laufen dadurch parallel, nur Befehle an dieselben Words warten aufeinander.
+        Das Ausgangsabbild wird vorher wie bei get_output_image() gelesen, falls nötig.
+        Innerhalb von batch() wird stattdessen die Kopie des Batches zurückgegeben, die nur der aktuelle Thread sieht.
+        :param offsets Offsets zur DIGITAL_OUTPUT_STARTING_ADDRESS, die geändert und geschrieben werden
+        """
+        #Der Befehl wird hier bestimmt und weitergegeben, da calling_method() an den Frames von contextlib aufhört
+        return self.command_words(offsets, calling_method())
+
+    @contextmanager
+    def command_words(self, offsets, method):
+        """
+        Implementierung von output_words().
+        :param method Name des Befehls, unter dem ein nötiges Lesen des Ausgangsabbilds in self.metrics gezählt wird
+        """
+        batch = self.batch_state
+        if batch.depth > 0:
+            if batch.image is None:
+                self.get_output_image(method)
+                with self.lock_output_words(range(self.DIGITAL_OUTPUT_WORDS)) as reg:
+                    batch.base = list(reg)
+                batch.image = list(batch.base)
+            yield batch.image
+            return
+
+        while True:
+            #Gelesen wird bevor die Locks genommen werden, da resync_output_image() selbst alle Locks braucht
+            self.get_output_image(method)
+            with self.lock_output_words(offsets) as reg:
+                if self.outputs.generation is not None:
+                    self.command_state.base = list(reg)
+                    yield reg
+                    return
+            #Ein anderer Thread hat das Ausgangsabbild nach einem Schreibfehler als veraltet markiert, also erneut lesen
+
+    def write_output_image(self, offset, amount = 1):
+        """
+        Schreibt Words aus dem lokalen Ausgangsabbild auf den Modbus, ohne sie vorher zu lesen.
+        :param offset Offset zur DIGITAL_OUTPUT_STARTING_ADDRESS ab dem geschrieben wird
+        :param amount Anzahl der Words die geschrieben werden
+        """
+        #Innerhalb von batch() werden die Words nur vorgemerkt und erst beim Schließen des Batches geschrieben
+        batch = self.batch_state
+        if batch.depth > 0:
+            batch.offsets.update(range(offset, offset + amount))
+            return
+        try:
+            try:
+                self.set_output_register(self.output_image[offset:offset + amount], offset, self.outputs.generation)
+            except StaleOutputImageError:
+                #Die Verbindung wurde seit dem Lesen des Ausgangsabbilds neu aufgebaut (z.B. Neustart des Knotens), die Words auf dem Modbus
+                #können sich also geändert haben. Deshalb neu lesen und nur die Bits übernehmen, die der laufende Befehl geändert hat
+                base = self.command_state.base
+                words = self.get_output_register(offset, amount)
+                for i, word in enumerate(words):
+                    set_bits = self.output_image[offset + i] & ~base[offset + i]
+                    reset_bits = base[offset + i] & ~self.output_image[offset + i]
+                    self.output_image[offset + i] = (word | set_bits) & ~reset_bits
+                #Die übrigen Words sind von anderen Threads gesperrt und werden beim nächsten Befehl neu gelesen
+                self.outputs.generation = None
+                self.set_output_register(self.output_image[offset:offset + amount], offset)
+        except ModbusTimeoutError:
+            #Der Zustand auf dem Modbus ist unbekannt, deshalb wird das Ausgangsabbild beim nächsten Befehl neu gelesen.
+            #Es wird nur als veraltet markiert, da andere Threads gerade andere Words des Abbilds ändern können.
+            self.outputs.generation = None
+            raise
+
+    @contextmanager
+    def batch(self):
+        """
+        Sammelt alle Befehle (conveyor_*, set_switch, *_seperator, set_conveyor_speed*) die innerhalb des with-Blocks ausgeführt werden
+        und schreibt sie beim Verlassen des Blocks mit so wenigen Modbus Anfragen wie möglich:
+        alle geänderten Digitalen Ausgänge in einer Anfrage und die Speeds einmal über update_conveyor_speed().
+        Der Batch gilt nur für Befehle aus dem Thread, der ihn geöffnet hat, Befehle anderer Threads werden sofort geschrieben.
+        Im Batch arbeiten die Befehle auf einer Kopie des Ausgangsabbilds, beim Schreiben werden nur die im Batch geänderten Bits übernommen.
+        Batches können verschachtelt werden.
+        Tritt im Block eine Exception auf, werden die Änderungen des Batches verworfen und nichts geschrieben.
+
+        Beispiel:
+            with tom.batch():
+                for conveyor_id in tom.INDEX_CONVEYORS:
+                    tom.conveyor_forward(conveyor_id)
+        """
+        batch = self.batch_state
+        batch.depth += 1
+        try:
+            yield self
+        except BaseException:
+            batch.depth -= 1
+            if batch.depth == 0:
+                batch.clear()
+            raise
+        batch.depth -= 1
+        if batch.depth == 0:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """
+        Schreibt alle in batch() gesammelten Änderungen des aktuellen Threads auf den Modbus.
+        Alle geänderten Words werden mit einer zusammenhängenden Anfrage vom kleinsten bis zum größten Offset geschrieben.
+        """
+        batch = self.batch_state
+        image, base, offsets, speeds, speed = batch.image, batch.base, sorted(batch.offsets), batch.speeds, batch.speed
+        batch.clear()
+        if offsets:
+            first = offsets[0]
+            last = offsets[-1]
+            with self.output_words(*range(first, last + 1)) as reg:
+                #Nur die im Batch gesetzten und gelöschten Bits übernehmen, damit Befehle anderer Threads seit Beginn des Batches erhalten bleiben
+                for offset in offsets:
+                    set_bits = image[offset] & ~base[offset]
+                    reset_bits = base[offset] & ~image[offset]
+                    reg[offset] = (reg[offset] | set_bits) & ~reset_bits
+                self.write_output_image(first, last - first + 1)
+        if speeds or speed:
+            self.set_conveyor_speeds(speeds)
 
     def get_offset(self, bit_nr):
         """
@@ -144,25 +618,7 @@ class TransportOutputModule:
         :returns offset des bits
         :rtype int
         """
-        #Offset 0 -> 16 - 31
-        #Offset 1 ->  0 - 15
-        #Offset 2 -> 48 - 63
-        #Offset 3 -> 32 - 47
-        #Offset 5 -> 64 - 79 
-        #(Theoretisch 79, aber 67 ist das höchste benötigte bit, deswegen wird Offset 4 eigentlich nicht benötigt)
-        #Offset Reihenfolge liegt an der Little Endian Reihenfolge
-        if bit_nr >= 16 and bit_nr <= 31:
-            return 0
-        if bit_nr >= 0 and bit_nr <= 15:
-            return 1
-        if bit_nr >= 48 and bit_nr <= 63:
-            return 2
-        if bit_nr >= 32 and bit_nr <= 47:
-            return 3
-        if bit_nr >= 80 and bit_nr <= 95:
-            return 4
-        if bit_nr >= 64 and bit_nr <= 79:
-            return 5
+        return word_offset(bit_nr)
 
     def get_bit(self, index, nr):
         """
@@ -175,6 +631,19 @@ class TransportOutputModule:
         #Nummer wird Modulo 16 gerechnet, da alle 16 Bit ein neues word anfängt, bei dem wieder mit 0 angefangen wird zu adressieren
         return self.INDEX.get(index)[nr] % 16
 
+    def get_address(self, index, nr):
+        """
+        Gibt den vorberechneten Offset und die Bitmaske für die Funktion nr des Gerätes index zurück.
+        :param index Index des Anzusprechenden Moduls/Gerätes (Siehe Hardwaredokumentation Kapitel 2.1.3)
+        :param nr Nummer der Funktion (Siehe Kommatare in der Map INDEX)
+        :returns (Offset zur Start Adresse, Bitmaske innerhalb des Words)
+        :rtype tuple of (int, int)
+        :raises ValueError wenn es kein Gerät mit dem Index oder keine Funktion nr gibt
+        """
+        try:
+            return self.ADDRESS[index][nr]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError("Unknown device index {!r} or function {!r}".format(index, nr)) from None
 
     def conveyor_stop(self, conveyor_id):
         """
@@ -182,19 +651,17 @@ class TransportOutputModule:
         Die analogen Ausgänge, die die Speed der Laufbänder steuern, werden nicht verändert.
         :param conveyor_id der Index des Laufbands als Character (Siehe Hardwaredokumentation Kapitel 2.1.3)
         """
-        with self.sem:
-            #Nötiger Offset wird berechnet um das korrekte word zu adressieren
-            #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden des Offset zu bestimmen
-            offset = self.get_offset(self.INDEX.get(conveyor_id)[0])
-            bit_forward = self.get_bit(conveyor_id, 0)
-            bit_backward = self.get_bit(conveyor_id, 1)
+        #Offset und Bitmasken werden aus der vorberechneten Tabelle ADDRESS genommen
+        #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden den Offset zu nehmen
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
 
-            reg = self.get_output_register(offset)
+        with self.output_words(offset) as reg:
             #Bits für Vor- und Rückwärts fahren löschen damit das Band anhält
-            reg[0] = reset_bit(reg[0], bit_forward)
-            reg[0] = reset_bit(reg[0], bit_backward)
+            reg[offset] &= ~mask_forward
+            reg[offset] &= ~mask_backward
 
-            self.set_output_register(reg, offset)                
+            self.write_output_image(offset)
 
     def all_conv_stop(self):
         pass
@@ -206,20 +673,17 @@ class TransportOutputModule:
         Die analogen Ausgänge, die die Speed der Laufbänder steuern, werden nicht verändert.
         :param conveyor_id der Index des Laufbands als Character (Siehe Hardwaredokumentation Kapitel 2.1.3)
         """
-        with self.sem:
-            #Nötiger Offset wird berechnet um das korrekte word zu adressieren
-            #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden des Offset zu bestimmen
-            offset = self.get_offset(self.INDEX.get(conveyor_id)[0])
-            bit_forward = self.get_bit(conveyor_id, 0)
-            bit_backward = self.get_bit(conveyor_id, 1)
-            
-            reg = self.get_output_register(offset)
-            
+        #Offset und Bitmasken werden aus der vorberechneten Tabelle ADDRESS genommen
+        #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden den Offset zu nehmen
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
+
+        with self.output_words(offset) as reg:
             #Bit für Vorwärts setzen und Bit für Rückwärts löschen
-            reg[0] = set_bit(reg[0], bit_forward)
-            reg[0] = reset_bit(reg[0], bit_backward)
+            reg[offset] |= mask_forward
+            reg[offset] &= ~mask_backward
 
-            self.set_output_register(reg, offset)
+            self.write_output_image(offset)
             
     def conveyor_backward(self, conveyor_id):
         """
@@ -227,87 +691,73 @@ class TransportOutputModule:
         Die analogen Ausgänge, die die Speed der Laufbänder steuern, werden nicht verändert.
         :param conveyor_id der Index des Laufbands als Character (Siehe Hardwaredokumentation Kapitel 2.1.3)
         """
-        with self.sem:
-            #Nötiger Offset wird berechnet um das korrekte word zu adressieren
-            #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden des Offset zu bestimmen
-            offset = self.get_offset(self.INDEX.get(conveyor_id)[0])
-            bit_forward = self.get_bit(conveyor_id, 0)
-            bit_backward = self.get_bit(conveyor_id, 1)
-            
-            reg = self.get_output_register(offset)
-            
+        #Offset und Bitmasken werden aus der vorberechneten Tabelle ADDRESS genommen
+        #Da bei den Laufbändern das Bit für Vor/Zurück immer im selben Offset liegen reicht es von einem der Beiden den Offset zu nehmen
+        offset, mask_forward = self.get_address(conveyor_id, 0)
+        offset, mask_backward = self.get_address(conveyor_id, 1)
+
+        with self.output_words(offset) as reg:
             #Bit für Vorwärts löschen und Bit für Rückwärts setzen
-            reg[0] = reset_bit(reg[0], bit_forward)
-            reg[0] = set_bit(reg[0], bit_backward)
+            reg[offset] &= ~mask_forward
+            reg[offset] |= mask_backward
 
-            self.set_output_register(reg, offset)
+            self.write_output_image(offset)
 
     def set_switch(self, switch_id , pos = 0):
         """
-        Stellt die Weiche, die über switch_id angegeben wurde, auf die Position pos, indem erst alle Bits für die Positionen gelöscht werden und
-        danach das Bit für die Position pos gesetzt wird.
+        Stellt die Weiche, die über switch_id angegeben wurde, auf die Position pos, indem alle Bits für die anderen Positionen gelöscht werden und
+        das Bit für die Position pos gesetzt wird. Der neue Zustand wird in einer einzigen Modbus Anfrage geschrieben.
         :param switch_id der Index der Weiche als Character (Siehe Hardwaredokumentation Kapitel 2.1.3)
         :param pos Position auf welche die Weiche gestellt wird (pos = 0 löst Referenzfahrt aus)
         """
-        with self.sem:
-            #Da bei einigene Weichen die Bits zur ansteuerung einer Weiche unterschiedliche Offsets haben muss hier zu jedem Bit der eigene Offset berechnet werden.
-            offset = [
-                self.get_offset(self.INDEX.get(switch_id)[0]), #Referenz Fahrt
-                self.get_offset(self.INDEX.get(switch_id)[1]), #Position 1
-                self.get_offset(self.INDEX.get(switch_id)[2]), #Position 2
-                self.get_offset(self.INDEX.get(switch_id)[3])  #Position 3
-            ]
-            bit = [
-                self.get_bit(switch_id, 0), #Referenz Fahrt
-                self.get_bit(switch_id, 1), #Position 1
-                self.get_bit(switch_id, 2), #Position 2
-                self.get_bit(switch_id, 3)  #Position 3
-            ]
-
+        #Da bei einigene Weichen die Bits zur ansteuerung einer Weiche unterschiedliche Offsets haben, hat jedes Bit seinen eigenen Offset.
+        #Reihenfolge: Referenz Fahrt, Position 1, Position 2, Position 3
+        if switch_id not in self.INDEX_SWITCHES or pos not in (0, 1, 2, 3):
+            raise ValueError("Unknown switch {!r} or position {!r}".format(switch_id, pos))
+        address = self.ADDRESS[switch_id]
+        first = min(offset for offset, mask in address)
+        last = max(offset for offset, mask in address)
+
+        #Alle Words von first bis last werden gesperrt, da sie auch alle geschrieben werden
+        with self.output_words(*range(first, last + 1)) as reg:
             #Löscht alle Bits zur Weichenstellung (wenn 2 oder mehr Bits gleichzeitig gesetzt wären, wäre nicht eindeutig welche Position die weiche einnehmen soll)
-            for i in range(4):
-                reg = self.get_output_register(offset=offset[i])
-                reg[0] = reset_bit(reg[0], bit[i])
-                self.set_output_register(reg, offset=offset[i])
+            #und setzt das Bit, dass die Weiche an die Position pos fährt. Beides passiert nur im Ausgangsabbild.
+            for i, (offset, mask) in enumerate(address):
+                if i == pos:
+                    reg[offset] |= mask
+                else:
+                    reg[offset] &= ~mask
 
-            #Setzt das Bit, dass die Weiche an die Position pos fährt
-            reg = self.get_output_register(offset=offset[pos])
-            reg[0] = set_bit(reg[0], bit[pos])
-            self.set_output_register(reg, offset=offset[pos])
+            #Alle betroffenen Words werden mit einer einzigen Anfrage geschrieben, damit die Weiche nie einen Zwischenzustand sieht
+            self.write_output_image(first, last - first + 1)
 
     def set_seperator(self, seperator_id):
         """
         Setzt den vereinzeler, welcher mit seperator_id angegeben wurde.
         :param seperator_id Index des Vereinzelers (Siehe Hardwaredokumentation Kapitel 2.1.3)
         """
-        with self.sem:
-            #Offset ist für alle Vereinzeler Bits 5 (da alle Bits zwischen 64-79 liegen)
-            offset = 5 #self.get_offset(INDEX.get(seperator_id)[0])
-            bit_setzen = self.get_bit(seperator_id, 0)
-            
-            reg = self.get_output_register(offset)
+        #Offset ist für alle Vereinzeler Bits 5 (da alle Bits zwischen 64-79 liegen)
+        offset, mask_setzen = self.get_address(seperator_id, 0)
 
+        with self.output_words(offset) as reg:
             #Setzt das Bit um den Vereinzeler zu setzen
-            reg[0] = set_bit(reg[0], bit_setzen)
+            reg[offset] |= mask_setzen
 
-            self.set_output_register(reg, offset)
+            self.write_output_image(offset)
 
     def reset_seperator(self, seperator_id):
         """
         Setzt den vereinzeler zurück, welcher mit seperator_id angegeben wurde.
         :param seperator_id Index des Vereinzelers (Siehe Hardwaredokumentation Kapitel 2.1.3)
         """
-        with self.sem:
-            #Offset ist für alle Vereinzeler Bits 5 (da alle Bits zwischen 64-79 liegen) 
-            offset = 5 #self.get_offset(INDEX.get(seperator_id)[0])
-            bit_setzen = self.get_bit(seperator_id, 0)
-
-            reg = self.get_output_register(offset)
+        #Offset ist für alle Vereinzeler Bits 5 (da alle Bits zwischen 64-79 liegen)
+        offset, mask_setzen = self.get_address(seperator_id, 0)
 
+        with self.output_words(offset) as reg:
             #Löscht das Bit um den Vereinzeler zu setzen
-            reg[0] = reset_bit(reg[0], bit_setzen)
+            reg[offset] &= ~mask_setzen
 
-            self.set_output_register(reg, offset)
+            self.write_output_image(offset)
 
     def check_conveyor_workpiece_begin(self, conveyor_id):
         """
@@ -316,10 +766,9 @@ class TransportOutputModule:
         :returns boolean ob der Sensor ein Werkstück erkennt
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(conveyor_id)[0])
-        bit_sensor_anfang = self.get_bit(conveyor_id, 0)
+        offset, mask = self.get_address(conveyor_id, 0)
 
-        return test_bit(self.get_input_register(offset)[0], bit_sensor_anfang)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_conveyor_workpiece_end(self, conveyor_id):
         """
@@ -328,10 +777,9 @@ class TransportOutputModule:
         :returns boolean ob der Sensor ein Werkstück erkennt
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(conveyor_id)[1])
-        bit_sensor_ende = self.get_bit(conveyor_id, 1)
+        offset, mask = self.get_address(conveyor_id, 1)
 
-        return test_bit(self.get_input_register(offset)[0], bit_sensor_ende)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_switch_position_reached(self, switch_id):
         """
@@ -340,10 +788,9 @@ class TransportOutputModule:
         :returns boolean ob die weiche die Position erreicht hat
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(switch_id)[0])
-        bit_pos_erreicht = self.get_bit(switch_id, 0)
+        offset, mask = self.get_address(switch_id, 0)
 
-        return test_bit(self.get_input_register(offset)[0], bit_pos_erreicht)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_switch_in_movement(self, switch_id):
         """
@@ -352,10 +799,9 @@ class TransportOutputModule:
         :returns boolean ob die Weiche in Bewegung ist
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(switch_id)[1])
-        bit_in_bewegung = self.get_bit(switch_id, 1)
+        offset, mask = self.get_address(switch_id, 1)
 
-        return test_bit(self.get_input_register(offset)[0], bit_in_bewegung)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_switch_workpiece(self, switch_id):
         """
@@ -364,19 +810,17 @@ class TransportOutputModule:
         :returns boolean ob sich in der Weiche ein Werkstueck befindet
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(switch_id)[2])
-        bit_werkstueck = self.get_bit(switch_id, 2)
+        offset, mask = self.get_address(switch_id, 2)
 
-        return test_bit(self.get_input_register(offset)[0], bit_werkstueck)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_switch_in_reference_position(self, switch_id):
         """
         e
         """
-        offset = self.get_offset(self.INDEX.get(switch_id)[3])
-        bit_referenzposition = self.get_bit(switch_id, 3)
+        offset, mask = self.get_address(switch_id, 3)
 
-        return test_bit(self.get_input_register(offset)[0], bit_referenzposition)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_seperator_set(self, seperator_id):
         """
@@ -385,10 +829,9 @@ class TransportOutputModule:
         :returns boolean ob der Vereinzeler gesetzt ist
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(seperator_id)[1])
-        bit_gesetzt = self.get_bit(seperator_id, 1)
+        offset, mask = self.get_address(seperator_id, 1)
 
-        return test_bit(self.get_input_register(offset)[0], bit_gesetzt)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_seperator_workpiece_behind(self, seperator_id):
         """
@@ -397,10 +840,9 @@ class TransportOutputModule:
         :returns boolean ob sich hinter dem Vereinzeler ein Werkstück befindet
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(seperator_id)[2])
-        bit_werkstueck_hinten = self.get_bit(seperator_id, 2)
+        offset, mask = self.get_address(seperator_id, 2)
 
-        return test_bit(self.get_input_register(offset)[0], bit_werkstueck_hinten)
+        return bool(self.get_input_word(offset) & mask)
 
     def check_seperator_workpiece_in_front(self, seperator_id):
         """
@@ -409,66 +851,153 @@ class TransportOutputModule:
         :returns boolean ob sich vor dem Vereinzeler ein Werkstück befindet
         :rtype bool
         """
-        offset = self.get_offset(self.INDEX.get(seperator_id)[3])
-        bit_werkstueck_vorne = self.get_bit(seperator_id, 3)
+        offset, mask = self.get_address(seperator_id, 3)
 
-        return test_bit(self.get_input_register(offset)[0], bit_werkstueck_vorne)
+        return bool(self.get_input_word(offset) & mask)
 
-    def update_conveyor_speed(self):
+    def compile_condition(self, condition):
         """
-        Setzt die Analogen Ausgänge zum regeln der Laufbandspeed auf die Werte, die in der Map self.conveyor_speed angegeben werden.
+        Übersetzt eine Bedingung für wait_until() in eine Funktion, die mit den Input Words aufgerufen wird.
+        :param condition (Gerät, Signalname) bzw. (Gerät, Signalname, Wert) mit den Signalnamen aus SIGNALS_*, z.B. ('A', 'end'),
+                         oder eine Funktion ohne Parameter, die einen bool zurückgibt
+        :rtype function
+        :raises ValueError wenn es das Signal nicht gibt
         """
-        with self.read_write_sem:
-            #Automatisches öffnen und schließen von TCP verbindungen aufheben, da hier viele TCP Pakete nacheinander gesendet werden
-            #und es somit besser ist einmal die Verbindung zu öffnen und danach wieder zu schließen.
-            self.client.auto_close = False
-            self.client.auto_open = False
-
-            #Öffnen der TCP Verbindung
-            self.client.open()
-
-            self.client.write_single_register(8024, int("0x6000",16))
-            self.client.write_single_register(8024, int("0x3000",16))
-
-            self.client.write_single_register(8025, self.conveyor_speed.get('A'))
-            self.client.write_single_register(8026, self.conveyor_speed.get('B'))
-            self.client.write_single_register(8027, self.conveyor_speed.get('D'))
-            self.client.write_single_register(8028, self.conveyor_speed.get('E'))
-
-            self.client.write_single_register(8024, int("0x0100",16))
-            self.client.write_single_register(8024, int("0x0b00",16))
-
-            self.client.write_single_register(8025, self.conveyor_speed.get('G'))
-            self.client.write_single_register(8026, self.conveyor_speed.get('H'))
-            self.client.write_single_register(8027, self.conveyor_speed.get('I'))
-            self.client.write_single_register(8028, self.conveyor_speed.get('K'))
-
-            self.client.write_single_register(8024, int("0x0900",16))
+        if callable(condition):
+            return lambda words: condition()
+        device, signal = condition[0], condition[1]
+        value = condition[2] if len(condition) > 2 else True
+        try:
+            offset, mask = self.SENSOR_ADDRESS[(device, signal)]
+        except KeyError:
+            raise ValueError("Unknown signal {!r} of device {!r}".format(signal, device)) from None
+        return lambda words: bool(words[offset] & mask) == value
 
+    def wait_for_scan(self, check, timeout, poll_interval):
+        """
+        Prüft check nach jedem neuen Scan, bis es True zurückgibt.
+        Läuft ein ProcessImageScanner, wird auf seine Scans gewartet, ansonsten wird das Prozessabbild alle poll_interval Sekunden gelesen.
+        :returns Rückgabewert von check
+        :raises ConditionTimeoutError wenn check innerhalb von timeout Sekunden nicht True zurückgibt
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        scan_count = None
+        while True:
+            scanner = self.scanner
+            if scanner is not None and scanner.is_scanning():
+                #Die Bedingung wird außerhalb des Locks geprüft, damit der Scanner nicht auf sie warten muss.
+                #Endet der Scanner, wird ab dem nächsten Durchlauf selbst gelesen
+                with scanner.condition:
+                    scanner.condition.wait_for(lambda: scanner.scan_count != scan_count or scanner.finished,
+                                               None if deadline is None else max(0.0, deadline - monotonic()))
+                    scan_count = scanner.scan_count
+                    words = scanner.image
+            else:
+                words = self.read_process_image()
+
+            result = words is not None and check(words)
+            if result:
+                return result
+            if deadline is not None and monotonic() >= deadline:
+                raise ConditionTimeoutError("Condition not met within {} seconds".format(timeout))
+            if scanner is None or not scanner.is_scanning():
+                sleep(poll_interval if deadline is None else min(poll_interval, max(0.0, deadline - monotonic())))
+
+    def wait_until(self, condition, timeout = None, poll_interval = 0.05):
+        """
+        Wartet bis eine Bedingung erfüllt ist und kehrt sofort zurück, wenn sie es schon ist.
 
-            self.client.write_single_register(8029, int("0x6000",16))
-            self.client.write_single_register(8029, int("0x3000",16))
+        Beispiel:
+            tom.wait_until(('X', 'workpiece'), timeout=10)
+            tom.wait_until(('A', 'end', False))
 
-            self.client.write_single_register(8030, self.conveyor_speed.get('L'))
-            self.client.write_single_register(8031, self.conveyor_speed.get('N'))
-            self.client.write_single_register(8032, self.conveyor_speed.get('O'))
-            self.client.write_single_register(8033, self.conveyor_speed.get('P'))
+        :param condition (Gerät, Signalname) bzw. (Gerät, Signalname, Wert) oder Funktion ohne Parameter (siehe compile_condition())
+        :param timeout maximale Wartezeit in Sekunden, None für unbegrenzt
+        :param poll_interval Abstand zwischen zwei Lesevorgängen in Sekunden, wenn kein ProcessImageScanner läuft
+        :raises ConditionTimeoutError wenn die Bedingung innerhalb von timeout nicht erfüllt wurde
+        """
+        check = self.compile_condition(condition)
+        self.wait_for_scan(check, timeout, poll_interval)
 
-            self.client.write_single_register(8029, int("0x0100",16))
-            self.client.write_single_register(8029, int("0x0b00",16))
+    def wait_any(self, conditions, timeout = None, poll_interval = 0.05):
+        """
+        Wartet bis mindestens eine der Bedingungen erfüllt ist.
+        :param conditions Liste von Bedingungen wie bei wait_until()
+        :returns Index der ersten erfüllten Bedingung in conditions
+        :rtype int
+        :raises ConditionTimeoutError wenn keine Bedingung innerhalb von timeout erfüllt wurde
+        """
+        checks = [self.compile_condition(condition) for condition in conditions]
 
-            self.client.write_single_register(8030, self.conveyor_speed.get('T'))
-            self.client.write_single_register(8031, self.conveyor_speed.get('U'))
-            self.client.write_single_register(8032, self.conveyor_speed.get('V'))
-            self.client.write_single_register(8033, self.conveyor_speed.get('W'))
+        def check(words):
+            for i, condition in enumerate(checks):
+                if condition(words):
+                    #Index + 1, damit auch die erste Bedingung als erfüllt gilt
+                    return i + 1
+            return 0
 
-            self.client.write_single_register(8029, int("0x0900",16))
+        return self.wait_for_scan(check, timeout, poll_interval) - 1
 
-            #Schließen der TCP Verbindung
-            self.client.close()
+    def wait_all(self, conditions, timeout = None, poll_interval = 0.05):
+        """
+        Wartet bis alle Bedingungen gleichzeitig (im selben Prozessabbild) erfüllt sind.
+        :param conditions Liste von Bedingungen wie bei wait_until()
+        :raises ConditionTimeoutError wenn nicht alle Bedingungen innerhalb von timeout erfüllt wurden
+        """
+        checks = [self.compile_condition(condition) for condition in conditions]
+        self.wait_for_scan(lambda words: all(check(words) for check in checks), timeout, poll_interval)
 
-            self.client.auto_close = True
-            self.client.auto_open = True
+    def update_conveyor_speed(self, force = False):
+        """
+        Setzt die Analogen Ausgänge zum regeln der Laufbandspeed auf die Werte, die in der Map self.conveyor_speed angegeben werden.
+        Es wird nur die Gruppe der Analogen Ausgänge (8024 - 8028 oder 8029 - 8033) geschrieben, deren Speeds sich seit dem letzten Schreiben geändert haben.
+        Nach einem Reconnect werden beide Gruppen geschrieben, da der Knoten oder das Analogmodul neu gestartet sein kann.
+        Innerhalb von batch() wird erst beim Schließen des Batches geschrieben.
+        :param force Wenn True, werden beide Gruppen geschrieben, auch wenn sich nichts geändert hat
+        :raises ModbusTimeoutError wenn das Schreiben auch nach allen Wiederholungen der RetryPolicy fehlschlägt
+        """
+        if self.batch_state.depth > 0:
+            self.batch_state.speed = True
+            return
+
+        method = calling_method()
+        with self.speed_lock:
+            while True:
+                #Die Verbindung wird vorher geöffnet, damit ein Reconnect hier bemerkt wird
+                with self.read_write_sem:
+                    generation = self.connection_pool.open_connection(self.host)
+                if self.outputs.speed_generation != generation:
+                    self.written_speed.clear()
+                    self.outputs.speed_generation = generation
+
+                for control, first, second in self.SPEED_GROUPS:
+                    speeds = tuple(self.conveyor_speed.get(i) for i in first + second)
+                    if not force and self.written_speed.get(control) == speeds:
+                        continue
+
+                    #Die Steuer-Words werden weiterhin einzeln geschrieben, da das Analogmodul sie nacheinander quittieren muss.
+                    #Die 4 Speeds eines Kanalsatzes liegen direkt hinter dem Steuer-Word und werden mit einer Anfrage geschrieben.
+                    requests = [
+                        (6, control, 'write_single_register', int("0x6000",16)),
+                        (6, control, 'write_single_register', int("0x3000",16)),
+                        (16, control + 1, 'write_multiple_registers', list(speeds[:4])),
+                        (6, control, 'write_single_register', int("0x0100",16)),
+                        (6, control, 'write_single_register', int("0x0b00",16)),
+                        (16, control + 1, 'write_multiple_registers', list(speeds[4:])),
+                        (6, control, 'write_single_register', int("0x0900",16))
+                    ]
+                    try:
+                        for function_code, register, name, value in requests:
+                            self.request_with_retry(function_code, register, name, register, value, method=method)
+                    except ModbusTimeoutError:
+                        #Der Zustand der Gruppe ist unbekannt, sie wird beim nächsten Aufruf erneut geschrieben
+                        self.written_speed.pop(control, None)
+                        raise
+                    self.written_speed[control] = speeds
+
+                #Wurde die Verbindung beim Schreiben neu aufgebaut, können vorher geschriebene Gruppen verloren sein, also alle erneut schreiben
+                if self.connection_pool.get_generation(self.host) == generation:
+                    return
 
     def set_conveyor_speed(self, conveyor_id, speed):
         """
@@ -476,9 +1005,7 @@ class TransportOutputModule:
         :param conveyor_id Index als Character des Laufbands, dessen Speed gesetzt werden soll (Siehe Hardwaredokumentation Kapitel 2.1.3)
         :param speed Speed des Laufbandes als Integer zwischen 0 (0%/0V) und 30000 (100%/10V)
         """
-        with self.sem:
-            self.conveyor_speed[conveyor_id] = speed
-            self.update_conveyor_speed()
+        self.set_conveyor_speeds({conveyor_id: speed})
 
     def set_conveyor_speed(self, conveyor_id, speed):
         """
@@ -486,16 +1013,27 @@ class TransportOutputModule:
         :param conveyor_id Index als Character des Laufbands, dessen Speed gesetzt werden soll (Siehe Hardwaredokumentation Kapitel 2.1.3)
         :param speed Speed des Laufbandes als Integer zwischen 0 (0%/0V) und 30000 (100%/10V)
         """
-        with self.sem:
-            self.conveyor_speed[conveyor_id] = speed
-            self.update_conveyor_speed()
+        self.set_conveyor_speeds({conveyor_id: speed})
 
     def set_conveyor_speed_all(self, speed):
         """
         Setzt die Speed aller Laufbänder auf den übergebenen Wert.
         :param speed Speed der Laufbänder als Integer zwischen 0 (0%/0V) und 30000 (100%/10V)
         """
-        with self.sem:
-            for i in self.INDEX_CONVEYORS:
-                self.conveyor_speed[i] = speed
+        self.set_conveyor_speeds(dict((i, speed) for i in self.INDEX_CONVEYORS))
+
+    def set_conveyor_speeds(self, speeds):
+        """
+        Setzt die Speeds mehrerer Laufbänder und schreibt sie mit update_conveyor_speed().
+        Innerhalb von batch() werden die Speeds erst beim Schließen des Batches übernommen.
+        :param speeds Map Index des Laufbands -> Speed als Integer zwischen 0 (0%/0V) und 30000 (100%/10V)
+
+        :raises ModbusTimeoutError wenn das Schreiben auch nach allen Wiederholungen der RetryPolicy fehlschlägt
+        """
+        batch = self.batch_state
+        if batch.depth > 0:
+            batch.speeds.update(speeds)
+            return
+        with self.speed_lock:
+            self.conveyor_speed.update(speeds)
             self.update_conveyor_speed()
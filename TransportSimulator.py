@@ -0,0 +1,343 @@
+from pyModbusTCP.server import ModbusServer, DataBank
+from threading import Thread, Event, Lock
+from time import monotonic
+import argparse
+
+from TransportOutputModule import TransportOutputModule
+
+
+class SimulatorDataBank(DataBank):
+    """
+    DataBank, die jeden Schreibzugriff eines Clients an den Simulator meldet (auch wenn sich der Wert nicht ändert),
+    damit das Handshake der Analogen Ausgänge nachgebildet werden kann.
+    """
+
+    def __init__(self, simulator):
+        super().__init__(coils_size=0, d_inputs_size=0, i_regs_size=0)
+        self.simulator = simulator
+
+    def set_holding_registers(self, address, word_list, srv_info=None):
+        result = super().set_holding_registers(address, word_list, srv_info)
+        #srv_info ist nur bei Zugriffen über Modbus gesetzt, nicht bei denen des Simulators selbst
+        if result and srv_info is not None:
+            self.simulator.on_write(address, word_list)
+        return result
+
+
+class TransportSimulator:
+    """
+    Lokaler Modbus TCP Server, der das Transport Ausgangs- und Eingangsmodul nachbildet, um das TransportOutputModule ohne Hardware
+    zu testen und zu benchmarken. Die Digitalen Eingänge liegen auf 8001 - 8006, die Digitalen Ausgänge auf 8018 - 8023
+    und die Analogen Ausgänge für die Laufbandspeed auf 8024 - 8033 (Holding Register, wie auf dem echten Knoten).
+
+    Ein einfaches Physikmodell bewegt Werkstücke mit der eingestellten Speed vom Anfangs- zum Endsensor der Laufbänder,
+    lässt Weichen eine Zeit lang fahren bis sie ihre Position erreichen und Vereinzeler verzögert setzen.
+    Mit time_scale > 1 läuft die Simulation beschleunigt.
+
+    Die Verbindung der Geräte wird über topology angegeben:
+        Laufband -> Gerät, an welches das Laufband am Ende übergibt (Laufband, Weiche oder Vereinzeler)
+        Weiche -> {Position: Laufband}, Position 1 - 3 verbindet die Weiche mit dem Laufband
+        Vereinzeler -> Laufband, an welches der Vereinzeler ein durchgelassenes Werkstück übergibt
+    Beispiel: {'A': 'X', 'X': {3: 'A', 1: 'B'}} - A übergibt an X, wenn X auf Position 3 steht, nimmt X das Werkstück auf
+    und gibt es auf Position 1 an B weiter.
+
+    Ein Vereinzeler in topology hält ein Werkstück vor sich fest ("Werkstück vor Vereinzeler"), solange er gesetzt ist.
+    Ist er zurückgesetzt, lässt er es durch: das Werkstück ist dann für transfer_time Sekunden hinter dem Vereinzeler
+    ("Werkstück hinter Vereinzeler") und wird danach übergeben. Vor dem Vereinzeler hat immer nur ein Werkstück Platz,
+    weitere bleiben am Ende des vorherigen Laufbands stehen.
+    Beispiel: {'A': 'V1', 'V1': 'B'} - A übergibt an V1, V1 gibt die Werkstücke einzeln an B weiter.
+    Die Sensoren von Vereinzelern, die nicht in topology vorkommen, werden nur über set_separator_workpiece() gesetzt.
+    """
+
+    INPUT_ADDRESS = TransportOutputModule.DIGITAL_INPUT_STARTING_ADDRESS
+    OUTPUT_ADDRESS = TransportOutputModule.DIGITAL_OUTPUT_STARTING_ADDRESS
+    INPUT_WORDS = TransportOutputModule.DIGITAL_INPUT_WORDS
+    OUTPUT_WORDS = TransportOutputModule.DIGITAL_OUTPUT_WORDS
+
+    #Speed 30000 entspricht 10V/100%
+    MAX_SPEED_VALUE = 30000
+
+    def __init__(self, host = '127.0.0.1', port = 5020, time_scale = 1.0, cycle_time = 0.01, topology = None,
+                 conveyor_length = 1.0, max_speed = 0.2, sensor_length = 0.05, switch_time = 2.0, transfer_time = 0.5,
+                 separator_time = 0.2):
+        """
+        Konstruktor des TransportSimulators.
+
+        :param host Adresse, auf welcher der Modbus Server lauscht
+        :param port TCP Port des Modbus Servers
+        :param time_scale Faktor, um den die simulierte Zeit schneller läuft als die echte Zeit
+        :param cycle_time Zykluszeit des Physikmodells in Sekunden (echte Zeit)
+        :param topology Verbindung der Laufbänder und Weichen (siehe Klassenbeschreibung)
+        :param conveyor_length Länge eines Laufbands in Metern
+        :param max_speed Geschwindigkeit eines Laufbands bei Speed 30000 in Metern pro Sekunde
+        :param sensor_length Erfassungsbereich der Sensoren am Anfang und Ende eines Laufbands in Metern
+        :param switch_time Fahrzeit einer Weiche zur neuen Position in Sekunden
+        :param transfer_time Zeit, die ein Werkstück braucht, um eine Weiche zu verlassen, in Sekunden
+        :param separator_time Zeit bis ein Vereinzeler gesetzt bzw. zurückgesetzt ist in Sekunden
+        """
+        self.time_scale = time_scale
+        self.cycle_time = cycle_time
+        self.topology = topology or {}
+        self.conveyor_length = conveyor_length
+        self.max_speed = max_speed
+        self.sensor_length = sensor_length
+        self.switch_time = switch_time
+        self.transfer_time = transfer_time
+        self.separator_time = separator_time
+
+        self.address = TransportOutputModule.ADDRESS
+        self.lock = Lock()
+        #Simulierte Zeit in Sekunden
+        self.time = 0.0
+
+        #Positionen der Werkstücke pro Laufband in Metern (0 = Anfang)
+        self.workpieces = dict((i, []) for i in TransportOutputModule.INDEX_CONVEYORS)
+        self.speed = dict((i, 0) for i in TransportOutputModule.INDEX_CONVEYORS)
+        #Zustand der Weichen: aktuelle Position, Zielposition, Ende der Fahrt, Werkstück in der Weiche, Herkunft und Zeit seit Ankunft
+        self.switches = dict((i, {'position': None, 'target': None, 'until': None, 'workpiece': False, 'source': None, 'since': 0.0})
+                             for i in TransportOutputModule.INDEX_SWITCHES)
+        #Zustand der Vereinzeler: gesetzt, Zielzustand, Ende des Schaltens, Werkstück hinter/vor dem Vereinzeler und Zeit seit dem Durchlassen
+        self.separators = dict((i, {'set': False, 'target': False, 'until': None, 'workpiece_behind': False, 'workpiece_in_front': False,
+                                    'since': 0.0})
+                               for i in ['V1', 'V2', 'V3'])
+
+        #Aktiver Kanalsatz pro Steuer-Word der Analogen Ausgänge (0 = erster, 1 = zweiter, None = keiner)
+        self.speed_groups = dict((control, (first, second)) for control, first, second in TransportOutputModule.SPEED_GROUPS)
+        self.channel_set = dict((control, None) for control in self.speed_groups)
+
+        self.host = host
+        self.port = port
+        self.data_bank = SimulatorDataBank(self)
+        self.server = ModbusServer(host=host, port=port, no_block=True, data_bank=self.data_bank)
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Startet den Modbus Server und das Physikmodell.
+        """
+        self.update_inputs()
+        self.server.start()
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stoppt das Physikmodell und den Modbus Server.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.server.stop()
+
+    def restart(self):
+        """
+        Bildet einen Neustart des Knotens nach: alle Modbus Verbindungen brechen ab, die Digitalen Ausgänge und die Speeds werden zurückgesetzt.
+        Die Werkstücke und der Zustand der Weichen und Vereinzeler bleiben erhalten.
+        """
+        self.server.stop()
+        with self.lock:
+            self.data_bank.set_holding_registers(self.OUTPUT_ADDRESS, [0] * self.OUTPUT_WORDS)
+            for conveyor_id in self.speed:
+                self.speed[conveyor_id] = 0
+            for control in self.channel_set:
+                self.channel_set[control] = None
+        #Ein neuer Server, da ein gestoppter Server nach dem Start die alten Verbindungen weiter bedienen würde
+        self.server = ModbusServer(host=self.host, port=self.port, no_block=True, data_bank=self.data_bank)
+        self.server.start()
+
+    def run(self):
+        last = monotonic()
+        while not self.stopped.wait(self.cycle_time):
+            now = monotonic()
+            self.step((now - last) * self.time_scale)
+            last = now
+
+    def on_write(self, address, words):
+        """
+        Wird bei jedem Schreibzugriff eines Clients aufgerufen und bildet das Handshake der Analogen Ausgänge nach:
+        Steuer-Word 0x3000 wählt den ersten, 0x0b00 den zweiten Kanalsatz, die folgenden 4 Words sind die Speeds.
+        """
+        with self.lock:
+            for i, word in enumerate(words):
+                register = address + i
+                if register in self.speed_groups:
+                    self.channel_set[register] = {0x3000: 0, 0x0b00: 1}.get(word)
+                    continue
+                for control, channels in self.speed_groups.items():
+                    if control < register <= control + 4 and self.channel_set[control] is not None:
+                        self.speed[channels[self.channel_set[control]][register - control - 1]] = word
+
+    def add_workpiece(self, conveyor_id, position = 0.0):
+        """
+        Legt ein Werkstück auf ein Laufband.
+        :param conveyor_id Index des Laufbands
+        :param position Position auf dem Laufband in Metern (0 = Anfang)
+        """
+        with self.lock:
+            self.workpieces[conveyor_id].append(position)
+            self.update_inputs()
+
+    def remove_workpiece(self, conveyor_id):
+        """
+        Nimmt das vorderste Werkstück von einem Laufband.
+        :param conveyor_id Index des Laufbands
+        """
+        with self.lock:
+            if self.workpieces[conveyor_id]:
+                self.workpieces[conveyor_id].remove(max(self.workpieces[conveyor_id]))
+            self.update_inputs()
+
+    def set_separator_workpiece(self, seperator_id, behind = None, in_front = None):
+        """
+        Setzt die Werkstück-Sensoren eines Vereinzelers.
+        :param seperator_id Index des Vereinzelers
+        :param behind Werkstück hinter dem Vereinzeler (None = unverändert)
+        :param in_front Werkstück vor dem Vereinzeler (None = unverändert)
+        """
+        with self.lock:
+            if behind is not None:
+                self.separators[seperator_id]['workpiece_behind'] = behind
+            if in_front is not None:
+                self.separators[seperator_id]['workpiece_in_front'] = in_front
+            self.update_inputs()
+
+    def get_output(self, outputs, device, nr):
+        offset, mask = self.address[device][nr]
+        return bool(outputs[offset] & mask)
+
+    def step(self, dt):
+        """
+        Rechnet das Physikmodell um dt Sekunden simulierte Zeit weiter und aktualisiert die Digitalen Eingänge.
+        :param dt simulierte Zeit in Sekunden
+        """
+        outputs = self.data_bank.get_holding_registers(self.OUTPUT_ADDRESS, self.OUTPUT_WORDS)
+        with self.lock:
+            self.time += dt
+            self.step_switches(outputs, dt)
+            self.step_separators(outputs, dt)
+            self.step_conveyors(outputs, dt)
+            self.update_inputs()
+
+    def step_switches(self, outputs, dt):
+        for switch_id, switch in self.switches.items():
+            #Nur ein eindeutig gesetztes Positionsbit ist ein gültiger Fahrbefehl
+            commanded = [pos for pos in range(4) if self.get_output(outputs, switch_id, pos)]
+            if len(commanded) == 1 and commanded[0] != switch['target']:
+                switch['target'] = commanded[0]
+                switch['until'] = self.time + self.switch_time
+            if switch['until'] is not None and self.time >= switch['until']:
+                switch['position'] = switch['target']
+                switch['until'] = None
+
+            #Ein Werkstück verlässt die Weiche, sobald sie an einem anderen Laufband als dem Herkunftslaufband steht
+            if switch['workpiece'] and switch['until'] is None:
+                outlet = self.topology.get(switch_id, {}).get(switch['position'])
+                if outlet is not None and outlet != switch['source']:
+                    switch['since'] += dt
+                    if switch['since'] >= self.transfer_time:
+                        self.workpieces[outlet].append(0.0)
+                        switch['workpiece'] = False
+                        switch['source'] = None
+
+    def step_separators(self, outputs, dt):
+        for seperator_id, separator in self.separators.items():
+            target = self.get_output(outputs, seperator_id, 0)
+            if target != separator['target']:
+                separator['target'] = target
+                separator['until'] = self.time + self.separator_time
+            if separator['until'] is not None and self.time >= separator['until']:
+                separator['set'] = separator['target']
+                separator['until'] = None
+
+            if seperator_id not in self.topology:
+                continue
+            #Während des Schaltens ist der Vereinzeler noch bzw. schon geschlossen
+            if separator['workpiece_in_front'] and not separator['workpiece_behind'] and not separator['set'] and separator['until'] is None:
+                separator['workpiece_in_front'] = False
+                separator['workpiece_behind'] = True
+                separator['since'] = 0.0
+            if separator['workpiece_behind']:
+                separator['since'] += dt
+                if separator['since'] >= self.transfer_time and self.hand_over(seperator_id):
+                    separator['workpiece_behind'] = False
+
+    def step_conveyors(self, outputs, dt):
+        for conveyor_id, positions in self.workpieces.items():
+            forward = self.get_output(outputs, conveyor_id, 0)
+            backward = self.get_output(outputs, conveyor_id, 1)
+            if forward == backward or not positions:
+                continue
+            distance = self.max_speed * self.speed[conveyor_id] / self.MAX_SPEED_VALUE * dt
+            if backward:
+                distance = -distance
+
+            moved = []
+            for position in positions:
+                position += distance
+                if position >= self.conveyor_length and self.hand_over(conveyor_id):
+                    continue
+                moved.append(min(max(position, 0.0), self.conveyor_length))
+            positions[:] = moved
+
+    def hand_over(self, conveyor_id):
+        """
+        Übergibt ein Werkstück vom Ende des Laufbands bzw. aus dem Vereinzeler an das nachfolgende Gerät, falls dieses es aufnehmen kann.
+        :returns True wenn das Werkstück übergeben wurde
+        """
+        target = self.topology.get(conveyor_id)
+        if target in self.workpieces:
+            self.workpieces[target].append(0.0)
+            return True
+        if target in self.separators:
+            separator = self.separators[target]
+            if not separator['workpiece_in_front']:
+                separator['workpiece_in_front'] = True
+                return True
+            return False
+        if target in self.switches:
+            switch = self.switches[target]
+            if not switch['workpiece'] and switch['until'] is None and self.topology[target].get(switch['position']) == conveyor_id:
+                switch['workpiece'] = True
+                switch['source'] = conveyor_id
+                switch['since'] = 0.0
+                return True
+        return False
+
+    def update_inputs(self):
+        """
+        Berechnet die Digitalen Eingänge aus dem Zustand des Modells und schreibt sie in die DataBank.
+        """
+        signals = {}
+        for conveyor_id, positions in self.workpieces.items():
+            signals[(conveyor_id, 'begin')] = any(p <= self.sensor_length for p in positions)
+            signals[(conveyor_id, 'end')] = any(p >= self.conveyor_length - self.sensor_length for p in positions)
+        for switch_id, switch in self.switches.items():
+            moving = switch['until'] is not None
+            signals[(switch_id, 'position_reached')] = not moving and switch['position'] is not None
+            signals[(switch_id, 'in_movement')] = moving
+            signals[(switch_id, 'workpiece')] = switch['workpiece']
+            signals[(switch_id, 'reference_position')] = not moving and switch['position'] == 0
+        for seperator_id, separator in self.separators.items():
+            for signal in ('set', 'workpiece_behind', 'workpiece_in_front'):
+                signals[(seperator_id, signal)] = separator[signal]
+
+        words = [0] * self.INPUT_WORDS
+        for device, signal, offset, mask in TransportOutputModule.SENSORS:
+            if signals[(device, signal)]:
+                words[offset] |= mask
+        self.data_bank.set_holding_registers(self.INPUT_ADDRESS, words)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates the transport module as a local Modbus TCP server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    simulator = TransportSimulator(host=args.host, port=args.port, time_scale=args.time_scale)
+    simulator.start()
+    print("Simulating transport module on {}:{} (time scale {})".format(args.host, args.port, args.time_scale))
+    try:
+        simulator.thread.join()
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,233 @@
+from threading import Condition
+from collections import deque
+from itertools import count
+
+
+class WorkpieceTracker:
+    """
+    Belegungsmodell der Transportstrecke: weiß zu jedem Werkstück, auf welchem Segment (Laufband, Weiche oder Vereinzeler) es sich befindet.
+    Das Modell wird über Ankunfts-Flanken aktualisiert (Sensor Anfang eines Laufbands, Werkstück in Weiche, Werkstück hinter Vereinzeler),
+    entweder automatisch über einen ProcessImageScanner oder durch Aufrufe von arrive().
+    Verlässt ein Werkstück ein Segment (Sensor Ende eines Laufbands, Werkstück in Weiche bzw. Werkstück hinter Vereinzeler fällt ab),
+    ohne dass es laut Plan oder topology an einem anderen Segment ankommen kann (z.B. am Ende der Strecke), wird es aus dem Modell genommen
+    (siehe depart()).
+    Alle Abfragen (get_location(), is_occupied(), get_count()) sind O(1).
+
+    Welches Werkstück an einem Segment ankommt, wird so bestimmt:
+        1. das älteste Werkstück, dessen Plan (siehe plan()) als nächstes dieses Segment vorsieht
+        2. sonst das älteste Werkstück auf einem Vorgänger-Segment laut topology
+        3. sonst ist es ein neues Werkstück (z.B. von Hand aufgelegt)
+    topology hat dasselbe Format wie beim TransportSimulator: Laufband -> nachfolgendes Gerät, Weiche -> {Position: Laufband}.
+    """
+
+    #Flanken, die die Ankunft eines Werkstücks an einem Segment melden (Signalname -> Wert der Flanke)
+    ARRIVAL_SIGNALS = {
+        'begin': True,
+        'workpiece': True,
+        'workpiece_behind': True
+    }
+    #Flanken, die melden, dass ein Werkstück ein Segment verlassen hat (Signalname -> Wert der Flanke)
+    DEPARTURE_SIGNALS = {
+        'end': False,
+        'workpiece': False,
+        'workpiece_behind': False
+    }
+
+    def __init__(self, scanner = None, topology = None):
+        """
+        Konstruktor des WorkpieceTrackers.
+
+        :param scanner ProcessImageScanner, dessen Flanken das Modell aktualisieren (None, wenn arrive() selbst aufgerufen wird)
+        :param topology Verbindung der Laufbänder und Weichen (siehe Klassenbeschreibung)
+        """
+        #Schützt alle Maps, wartende Threads werden bei jeder Änderung benachrichtigt
+        self.condition = Condition()
+        self.ids = count()
+
+        #Werkstück -> Segment
+        self.location = {}
+        #Segment -> deque der Werkstücke auf dem Segment (ältestes zuerst)
+        self.occupants = {}
+        #Werkstück -> deque der noch folgenden Segmente
+        self.plans = {}
+        #Segment -> deque der Werkstücke, die als nächstes auf diesem Segment erwartet werden
+        self.expected = {}
+
+        #Segment -> Liste der Segmente, von denen ein Werkstück auf dieses Segment kommen kann, und umgekehrt
+        self.predecessors = {}
+        self.successors = {}
+        for device, target in (topology or {}).items():
+            targets = target.values() if isinstance(target, dict) else [target]
+            for segment in targets:
+                if segment != device:
+                    self.predecessors.setdefault(segment, []).append(device)
+                    self.successors.setdefault(device, []).append(segment)
+
+        self.scanner = scanner
+        self.subscriber = None
+        if scanner is not None:
+            self.subscriber = scanner.subscribe(self.on_edge)
+
+    def close(self):
+        """
+        Meldet den Tracker vom ProcessImageScanner ab.
+        """
+        if self.subscriber is not None:
+            self.scanner.unsubscribe(self.subscriber)
+            self.subscriber = None
+
+    def on_edge(self, edge):
+        if self.ARRIVAL_SIGNALS.get(edge.signal) == edge.value:
+            self.arrive(edge.device)
+        elif self.DEPARTURE_SIGNALS.get(edge.signal) == edge.value:
+            self.depart(edge.device)
+
+    def add(self, segment, plan = None):
+        """
+        Legt ein neues Werkstück auf ein Segment.
+        :param segment Index des Segments
+        :param plan Liste der Segmente, die das Werkstück danach durchläuft (siehe plan())
+        :returns Id des Werkstücks
+        :rtype int
+        """
+        with self.condition:
+            workpiece = next(self.ids)
+            self.move(workpiece, segment)
+            if plan is not None:
+                self.set_plan(workpiece, plan)
+            self.condition.notify_all()
+            return workpiece
+
+    def plan(self, workpiece, segments):
+        """
+        Legt fest, welche Segmente das Werkstück als nächstes durchläuft, z.B. aus den Steps einer Route der RouteEngine.
+        :param workpiece Id des Werkstücks
+        :param segments Liste der folgenden Segmente (ohne das aktuelle Segment)
+        """
+        with self.condition:
+            self.set_plan(workpiece, segments)
+
+    def set_plan(self, workpiece, segments):
+        self.forget_expected(workpiece)
+        self.plans[workpiece] = deque(segments)
+        self.expect_next(workpiece)
+
+    def arrive(self, segment):
+        """
+        Meldet, dass ein Werkstück an einem Segment angekommen ist und verschiebt es im Modell.
+        :param segment Index des Segments
+        :returns Id des angekommenen Werkstücks
+        :rtype int
+        """
+        with self.condition:
+            workpiece = None
+            expected = self.expected.get(segment)
+            if expected:
+                workpiece = expected.popleft()
+            else:
+                #Ohne Plan kommt das älteste Werkstück eines Vorgängers an
+                for predecessor in self.predecessors.get(segment, ()):
+                    occupants = self.occupants.get(predecessor)
+                    if occupants:
+                        workpiece = occupants[0]
+                        break
+            if workpiece is None:
+                workpiece = next(self.ids)
+
+            self.forget_expected(workpiece)
+            plan = self.plans.get(workpiece)
+            if plan and plan[0] == segment:
+                plan.popleft()
+            self.move(workpiece, segment)
+            self.expect_next(workpiece)
+            self.condition.notify_all()
+            return workpiece
+
+    def depart(self, segment):
+        """
+        Meldet, dass ein Werkstück ein Segment verlassen hat.
+        Kann das älteste Werkstück des Segments laut seinem Plan oder laut topology an einem anderen Segment ankommen,
+        wird es erst dort durch arrive() verschoben. Ansonsten wird es aus dem Modell genommen, damit das Segment frei wird.
+        :param segment Index des Segments
+        :returns Id des entfernten Werkstücks oder None, wenn kein Werkstück entfernt wurde
+        """
+        with self.condition:
+            occupants = self.occupants.get(segment)
+            if not occupants:
+                return None
+            workpiece = occupants[0]
+            if self.plans.get(workpiece) or self.successors.get(segment):
+                return None
+            self.remove(workpiece)
+            return workpiece
+
+    def remove(self, workpiece):
+        """
+        Nimmt ein Werkstück aus dem Modell, z.B. wenn es von der Strecke genommen wurde.
+        :param workpiece Id des Werkstücks
+        """
+        with self.condition:
+            self.move(workpiece, None)
+            self.forget_expected(workpiece)
+            self.plans.pop(workpiece, None)
+            self.condition.notify_all()
+
+    def move(self, workpiece, segment):
+        previous = self.location.pop(workpiece, None)
+        if previous is not None:
+            self.occupants[previous].remove(workpiece)
+        if segment is not None:
+            self.location[workpiece] = segment
+            self.occupants.setdefault(segment, deque()).append(workpiece)
+
+    def expect_next(self, workpiece):
+        plan = self.plans.get(workpiece)
+        if plan:
+            self.expected.setdefault(plan[0], deque()).append(workpiece)
+        elif plan is not None:
+            del self.plans[workpiece]
+
+    def forget_expected(self, workpiece):
+        plan = self.plans.get(workpiece)
+        if plan and workpiece in self.expected.get(plan[0], ()):
+            self.expected[plan[0]].remove(workpiece)
+
+    def get_location(self, workpiece):
+        """
+        Gibt das Segment zurück, auf dem sich das Werkstück befindet.
+        :returns Index des Segments oder None, wenn das Werkstück nicht (mehr) bekannt ist
+        """
+        return self.location.get(workpiece)
+
+    def get_occupants(self, segment):
+        """
+        Gibt die Werkstücke auf einem Segment zurück, ältestes zuerst.
+        :rtype tuple of int
+        """
+        with self.condition:
+            return tuple(self.occupants.get(segment, ()))
+
+    def get_count(self, segment):
+        """
+        Gibt die Anzahl der Werkstücke auf einem Segment zurück.
+        :rtype int
+        """
+        return len(self.occupants.get(segment, ()))
+
+    def is_occupied(self, segment):
+        """
+        Gibt zurück, ob sich mindestens ein Werkstück auf dem Segment befindet.
+        :rtype bool
+        """
+        return bool(self.occupants.get(segment))
+
+    def wait_free(self, segment, timeout = None):
+        """
+        Wartet bis kein Werkstück mehr auf dem Segment ist, z.B. um das nächste Werkstück freizugeben.
+        :param segment Index des Segments
+        :param timeout maximale Wartezeit in Sekunden, None für unbegrenzt
+        :returns True wenn das Segment frei ist, False bei Timeout
+        :rtype bool
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.occupants.get(segment), timeout)
@@ -3,20 +3,23 @@ from pyModbusTCP.utils import get_bits_from_int
 from pyModbusTCP.utils import set_bit
 from pyModbusTCP.utils import reset_bit
 from pyModbusTCP.utils import test_bit
-import paho.mqtt.client as mqtt
-from time import sleep
-import math
+from time import sleep, monotonic
+from collections import namedtuple
 
 from multiprocessing import BoundedSemaphore
 from types import FunctionType
 
+from MqttTelemetry import TelemetryPublisher
+from ModbusConnection import DEFAULT_RETRY_POLICY, ModbusTimeoutError
+
 def methods(cls):
     return [x for x, y in cls.__dict__.items() if type(y) == FunctionType]
 
 def power_minus(num):
     """This function will be used to return a find a power of a 2. Example if 2 ** 8 is 256. so if we input
     256 in this function, we will get value 8"""
-    return round(math.log(num,2))
+    # Exact integer arithmetic instead of a floating point logarithm
+    return num.bit_length() - 1
 
 """
 How to access elements
@@ -50,6 +53,60 @@ conveyor_dict = {8002:{0:["A","Piece_at_Front",1],1:["A","Piece_at_End",0],2:["B
                        10:["W","Piece_at_Front",1],11:["W","Piece_at_End",0]}}
 
 
+# One decoded signal: device and signal name and value as in actuator_dict/conveyor_dict, state is True if the bit is set
+Signal = namedtuple('Signal', ['device', 'signal', 'value', 'state'])
+
+
+def compile_lookup(*signal_dicts):
+    """Builds per register lookup tables from dictionaries like actuator_dict and conveyor_dict.
+    Every register gets two tables of 256 entries, one for the low and one for the high byte of the register value.
+    Each entry holds the (mask, device, signal, value) tuples of all bits that are set in that byte, so a whole
+    register is decoded with two table lookups instead of testing every bit."""
+    lookup = {}
+    for signal_dict in signal_dicts:
+        for register, bits in signal_dict.items():
+            tables = []
+            for shift in (0, 8):
+                table = []
+                for byte in range(256):
+                    table.append(tuple((1 << bit, device, signal, value) for bit, (device, signal, value) in sorted(bits.items())
+                                       if shift <= bit < shift + 8 and byte & (1 << (bit - shift))))
+                tables.append(tuple(table))
+            lookup[register] = tuple(tables)
+    return lookup
+
+
+# register -> (low byte table, high byte table), see compile_lookup()
+register_lookup = compile_lookup(actuator_dict, conveyor_dict)
+
+
+def decode_register(addr, value, previous=None):
+    """Decodes a raw register value read from the module into a list of Signal.
+    Without previous, returns every signal whose bit is set. With the previous value of the same register,
+    returns every signal whose bit changed; state tells whether it is now set. Registers without known signals decode to an empty list."""
+    tables = register_lookup.get(addr)
+    if tables is None:
+        return []
+    low, high = tables
+    if previous is None:
+        return [Signal(device, signal, signal_value, True) for mask, device, signal, signal_value in low[value & 0xFF] + high[value >> 8 & 0xFF]]
+    changed = value ^ previous
+    return [Signal(device, signal, signal_value, bool(value & mask))
+            for mask, device, signal, signal_value in low[changed & 0xFF] + high[changed >> 8 & 0xFF]]
+
+
+def decode_image(words, start_address, previous=None):
+    """Decodes consecutive registers in one pass, e.g. a whole process image read from start_address.
+    :param words register values starting at start_address
+    :param start_address address of the first register in words (8001 for the inputs, 8018 for the outputs)
+    :param previous register values of the previous scan, to return only the signals that changed
+    :returns list of the decoded signals of all registers, see decode_register()"""
+    signals = []
+    for i, value in enumerate(words):
+        signals.extend(decode_register(start_address + i, value, None if previous is None else previous[i]))
+    return signals
+
+
 
 class TransportOutputModule:
     # Konstanten
@@ -96,12 +153,17 @@ class TransportOutputModule:
 
     }
 
-    def __init__(self, ip_addr, read_write_sem=BoundedSemaphore(value=1), mqtt_broker=None, mqtt_topic=None):
+    def __init__(self, ip_addr, read_write_sem=BoundedSemaphore(value=1), mqtt_broker=None, mqtt_topic=None,
+                 report_by_exception=False, min_interval=0.0, keyframe_interval=None, retry_policy=DEFAULT_RETRY_POLICY):
         """
                 Constructor of the TranporOutputModule.
 
                 :param ip_addr IP address of the Modbus node responsible for the processing station (string)
                 :param read_write_sem Semaphore that can be passed if you don't want 2 modules to send read/write commands at the same time
+                :param report_by_exception If True, register values and check results are only published when they change
+                :param min_interval Minimum time in seconds between two messages of the same signal (report by exception only)
+                :param keyframe_interval Time in seconds after which unchanged signals are published again (report by exception only)
+                :param retry_policy RetryPolicy that decides how often and after which delay a failed write is repeated
                 """
         try:
             # Creates a connection to the Modbus with the ip_addr
@@ -113,11 +175,12 @@ class TransportOutputModule:
         self.sem = BoundedSemaphore(value=1)
 
         self.read_write_sem = read_write_sem
+        self.retry_policy = retry_policy
         self.mqtt_broker = "192.168.200.161"
         self.mqtt_topic = "Transport_out"
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.connect(self.mqtt_broker)
-        self.mqtt_client.loop_start()
+        # Telemetry is queued and published by a separate thread, so Modbus access never waits for the broker
+        self.report_by_exception = report_by_exception
+        self.telemetry = TelemetryPublisher(self.mqtt_broker, min_interval=min_interval, keyframe_interval=keyframe_interval)
 
         # Speed of the treadmills 0 = 0V/0% | 30000 = 10V/100%
         # All speeds to 0% by default
@@ -156,10 +219,14 @@ class TransportOutputModule:
             while result == None:
                 result = self.client.read_holding_registers(reg_addr=self.DIGITAL_INPUT_STARTING_ADDRESS + offset,
                                                             reg_nb=amount)
-                if self.mqtt_broker and self.mqtt_topic:
-                    payload = ",".join(str(x) for x in result)
-                    self.mqtt_client.publish("Transport_out/Input_register", payload)
-            return result
+
+        # Published after the bus lock is released; the payload is serialized in the publisher thread
+        if self.mqtt_broker and self.mqtt_topic:
+            if self.report_by_exception:
+                self.telemetry.publish_on_change("Transport_out/Input_register", tuple(result), key=("Input_register", offset, amount))
+            else:
+                self.telemetry.publish("Transport_out/Input_register", tuple(result))
+        return result
 
     def get_output_register(self, offset=0, amount=1):
         """
@@ -175,10 +242,14 @@ class TransportOutputModule:
             while result == None:
                 result = self.client.read_holding_registers(reg_addr=self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset,
                                                             reg_nb=amount)
-                if self.mqtt_broker and self.mqtt_topic:
-                    payload = ",".join(str(x) for x in result)
-                    self.mqtt_client.publish("Transport_out/Output_register", payload)
-            return result
+
+        # Published after the bus lock is released; the payload is serialized in the publisher thread
+        if self.mqtt_broker and self.mqtt_topic:
+            if self.report_by_exception:
+                self.telemetry.publish_on_change("Transport_out/Output_register", tuple(result), key=("Output_register", offset, amount))
+            else:
+                self.telemetry.publish("Transport_out/Output_register", tuple(result))
+        return result
 
     def set_output_register(self, register, offset=0):
         """
@@ -186,14 +257,38 @@ class TransportOutputModule:
 
         :param register List of int to write to register
         :param offset Offset to DIGITAL_OUTPUT_STARTING_ADDRESS
+        :raises ModbusTimeoutError if the write still fails after all attempts of the retry policy
         """
-        with self.read_write_sem:
-            result = None
-            while result == None:
+        start = monotonic()
+        attempt = 0
+        while True:
+            with self.read_write_sem:
+                # pyModbusTCP returns False (not None) when a write fails
                 result = self.client.write_multiple_registers(self.DIGITAL_OUTPUT_STARTING_ADDRESS + offset, register)
-                topic = "Transport_out/output_register_set"
-                message = f"Offset: {offset}, Register: {register}"
-                self.mqtt_client.publish(topic, message)
+            if result:
+                break
+            attempt += 1
+            delay = self.retry_policy.get_delay(attempt, monotonic() - start)
+            if delay is None:
+                raise ModbusTimeoutError("write_multiple_registers of offset {} failed after {} attempts".format(offset, attempt))
+            # Back off without holding the bus lock, so other threads can keep working in the meantime
+            sleep(delay)
+
+        # Published once per successful write and after the bus lock is released
+        topic = "Transport_out/output_register_set"
+        message = f"Offset: {offset}, Register: {register}"
+        self.telemetry.publish(topic, message)
+
+    def publish_signal(self, device_id, signal, value):
+        """
+        Publishes a decoded input signal in report by exception mode to Transport_out/<device_id>/<signal>,
+        but only if it changed since the last time it was published.
+        :param device_id the index of the device (see hardware documentation chapter 2.1.3)
+        :param signal name of the signal, e.g. "end" or "position_reached"
+        :param value decoded value of the signal
+        """
+        topic = "{}/{}/{}".format(self.mqtt_topic, device_id, signal)
+        self.telemetry.publish_on_change(topic, value, "true" if value else "false")
 
     def get_offset(self, bit_nr):
         """
@@ -256,7 +351,7 @@ class TransportOutputModule:
             # Publish MQTT message with the conveyor_id and state change
             topic = "Transport_out/conveyor/{}".format(conveyor_id)
             message = "stopped"
-            self.mqtt_client.publish(topic, message)
+            self.telemetry.publish(topic, message)
 
             self.set_output_register(reg, offset)
 
@@ -282,7 +377,7 @@ class TransportOutputModule:
             # Publish MQTT message
             topic = "Transport_out/conveyor/{}/direction".format(conveyor_id)
             message = "forward"
-            self.mqtt_client.publish(topic, message)
+            self.telemetry.publish(topic, message)
 
             self.set_output_register(reg, offset)
 
@@ -308,7 +403,7 @@ class TransportOutputModule:
             # Publish MQTT message
             topic = "Transport_out/conveyor/{}/direction".format(conveyor_id)
             message = "forward"
-            self.mqtt_client.publish(topic, message)
+            self.telemetry.publish(topic, message)
 
             self.set_output_register(reg, offset)
 
@@ -346,7 +441,7 @@ class TransportOutputModule:
             self.set_output_register(reg, offset=offset[pos])
 
             # Publish MQTT message
-            self.mqtt_client.publish("Transport_out", "Switch {} set to position {}".format(switch_id, pos))
+            self.telemetry.publish("Transport_out", "Switch {} set to position {}".format(switch_id, pos))
 
     def set_seperator(self, seperator_id):
         """
@@ -364,7 +459,7 @@ class TransportOutputModule:
             reg[0] = set_bit(reg[0], bit_set)
 
             # Publish message to MQTT
-            self.mqtt_client.publish("Transport_out", "seperator/set", str(seperator_id))
+            self.telemetry.publish("Transport_out/seperator/set", str(seperator_id))
 
             self.set_output_register(reg, offset)
 
@@ -396,11 +491,13 @@ class TransportOutputModule:
         bit_sensor_beginning = self.get_bit(conveyor_id, 0)
         detected = test_bit(self.get_input_register(offset)[0], bit_sensor_beginning)
 
-        if detected:
+        if self.report_by_exception:
+            self.publish_signal(conveyor_id, "begin", detected)
+        elif detected:
             # Publish message to MQTT
             topic = "Transport_out/conveyor/{}/workpiece_detected".format(conveyor_id)
             message = "true"
-            self.mqtt_client.publish(topic, message)
+            self.telemetry.publish(topic, message)
 
         return detected
 
@@ -414,9 +511,11 @@ class TransportOutputModule:
         offset = self.get_offset(self.INDEX.get(conveyor_id)[1])
         bit_sensor_end = self.get_bit(conveyor_id, 1)
         workpiece_end = test_bit(self.get_input_register(offset)[0], bit_sensor_end)
-        if workpiece_end:
-            self.mqtt_client.publish("Transport_out", "conveyor/{}/workpiece_end".format(conveyor_id),
-                                     "Workpiece detected at end of conveyor")
+        if self.report_by_exception:
+            self.publish_signal(conveyor_id, "end", workpiece_end)
+        elif workpiece_end:
+            self.telemetry.publish("Transport_out/conveyor/{}/workpiece_end".format(conveyor_id),
+                                   "Workpiece detected at end of conveyor")
 
         return workpiece_end
 
@@ -432,8 +531,10 @@ class TransportOutputModule:
         pos_reached = test_bit(self.get_input_register(offset)[0], bit_pos_reached)
 
         # Publish message to MQTT
-        if pos_reached:
-            self.mqtt_client.publish("Transport_out", "Switch {} has reached the desired position".format(switch_id))
+        if self.report_by_exception:
+            self.publish_signal(switch_id, "position_reached", pos_reached)
+        elif pos_reached:
+            self.telemetry.publish("Transport_out", "Switch {} has reached the desired position".format(switch_id))
 
         return pos_reached
 
@@ -448,9 +549,11 @@ class TransportOutputModule:
         bit_in_movement = self.get_bit(switch_id, 1)
         in_movement = test_bit(self.get_input_register(offset)[0], bit_in_movement)
 
-        if in_movement:
+        if self.report_by_exception:
+            self.publish_signal(switch_id, "in_movement", in_movement)
+        elif in_movement:
             message = "Switch {} is in motion.".format(switch_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return in_movement
 
@@ -465,9 +568,11 @@ class TransportOutputModule:
         bit_workpiece = self.get_bit(switch_id, 2)
         workpiece_present = test_bit(self.get_input_register(offset)[0], bit_workpiece)
 
-        if workpiece_present:
+        if self.report_by_exception:
+            self.publish_signal(switch_id, "workpiece", workpiece_present)
+        elif workpiece_present:
             message = "Workpiece present at".format(switch_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return workpiece_present
 
@@ -483,9 +588,11 @@ class TransportOutputModule:
         bit_refposition = self.get_bit(switch_id, 3)
         workpiece_refposition = test_bit(self.get_input_register(offset)[0], bit_refposition)
 
-        if workpiece_refposition:
+        if self.report_by_exception:
+            self.publish_signal(switch_id, "reference_position", workpiece_refposition)
+        elif workpiece_refposition:
             message = "Workpiece at reference".format(switch_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return workpiece_refposition
 
@@ -500,9 +607,11 @@ class TransportOutputModule:
         bit_getset = self.get_bit(seperator_id, 1)
         seperator_set = test_bit(self.get_input_register(offset)[0], bit_getset)
 
-        if seperator_set:
+        if self.report_by_exception:
+            self.publish_signal(seperator_id, "set", seperator_set)
+        elif seperator_set:
             message = "Separator id is set".format(seperator_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return seperator_set
 
@@ -517,9 +626,11 @@ class TransportOutputModule:
         bit_workpiece_behind = self.get_bit(seperator_id, 2)
         workpiece_behind = test_bit(self.get_input_register(offset)[0], bit_workpiece_behind)
 
-        if workpiece_behind:
+        if self.report_by_exception:
+            self.publish_signal(seperator_id, "workpiece_behind", workpiece_behind)
+        elif workpiece_behind:
             message = "Checking whether workpiece behind the separator specified".format(seperator_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return workpiece_behind
 
@@ -534,9 +645,11 @@ class TransportOutputModule:
         bit_workpiece_infront = self.get_bit(seperator_id, 3)
         workpiece_infront = test_bit(self.get_input_register(offset)[0], bit_workpiece_infront)
 
-        if workpiece_infront:
+        if self.report_by_exception:
+            self.publish_signal(seperator_id, "workpiece_in_front", workpiece_infront)
+        elif workpiece_infront:
             message = "Checking whether workpiece is in-front of the separator specified".format(seperator_id)
-            self.mqtt_client.publish(self.mqtt_topic, message)
+            self.telemetry.publish(self.mqtt_topic, message)
 
         return workpiece_infront
 
@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+
+from TransportSimulator import TransportSimulator
+from ModbusConnection import ModbusTimeoutError, RetryPolicy
+from TransportOutputModule import TransportOutputModule
+from AsyncTransportOutputModule import AsyncTransportOutputModule
+from test_TransportOutputModule import free_port
+
+
+class AsyncTransportOutputModuleTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Prüft das AsyncTransportOutputModule gegen den TransportSimulator, ohne Hardware.
+    """
+
+    def setUp(self):
+        self.port = free_port()
+        self.simulator = TransportSimulator(port=self.port, time_scale=20.0)
+        self.simulator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+
+    def module(self, **kwargs):
+        return AsyncTransportOutputModule('127.0.0.1', port=self.port, cycle_time=0.01, **kwargs)
+
+    def device_outputs(self):
+        return self.simulator.data_bank.get_holding_registers(TransportSimulator.OUTPUT_ADDRESS, TransportSimulator.OUTPUT_WORDS)
+
+    def is_forward(self, conveyor_id):
+        offset, mask = TransportOutputModule.ADDRESS[conveyor_id][0]
+        return bool(self.device_outputs()[offset] & mask)
+
+    async def test_commands_and_wait_for(self):
+        self.simulator.add_workpiece('A')
+        async with self.module() as tom:
+            await tom.conveyor_forward('A')
+            await tom.set_conveyor_speed('A', 30000)
+            self.assertTrue(self.is_forward('A'))
+            self.assertEqual(self.simulator.speed['A'], 30000)
+
+            await tom.wait_for('A', 'end', True, timeout=5)
+            await tom.conveyor_stop('A')
+            self.assertFalse(self.is_forward('A'))
+
+            with self.assertRaises(asyncio.TimeoutError):
+                await tom.wait_for('A', 'begin', True, timeout=0.1)
+
+    async def test_reconnect_resyncs_output_image(self):
+        async with self.module() as tom:
+            await tom.conveyor_forward('A')
+            await tom.set_conveyor_speed('A', 10000)
+
+            #Neustart des Knotens: Ausgänge und Speeds sind zurückgesetzt und die Verbindung bricht ab
+            self.simulator.restart()
+
+            #D liegt im selben Word wie A
+            await tom.conveyor_forward('D')
+            self.assertEqual(tom.output_image, self.device_outputs())
+            self.assertTrue(self.is_forward('D'))
+            self.assertFalse(self.is_forward('A'))
+
+            #Unveränderte Speeds werden nach dem Reconnect erneut geschrieben
+            await tom.update_conveyor_speed()
+            self.assertEqual(self.simulator.speed['A'], 10000)
+
+    async def test_failed_write_rolls_back_output_image(self):
+        tom = self.module(retry_policy=RetryPolicy(deadline=0.2))
+        await tom.conveyor_forward('A')
+        image = list(tom.output_image)
+        self.simulator.stop()
+        await tom.client.close()
+
+        with self.assertRaises(ModbusTimeoutError):
+            await tom.conveyor_forward('B')
+        self.assertEqual(tom.output_image, image)
+        self.assertIsNone(tom.output_generation)
+        await tom.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
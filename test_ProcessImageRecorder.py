@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from time import monotonic, time
+
+from ProcessImageRecorder import ProcessImageRecorder
+
+
+class ProcessImageRecorderTest(unittest.TestCase):
+    """
+    Prüft das Weiterschreiben vorhandener Aufzeichnungen des ProcessImageRecorders.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'scans.rec')
+
+    def test_reopen_continues_recording(self):
+        with ProcessImageRecorder(self.path, capacity=10) as recorder:
+            recorder.record([1] * 6)
+        with ProcessImageRecorder(self.path) as recorder:
+            recorder.record([2] * 6)
+            self.assertEqual([record.inputs[0] for record in recorder.records()], [1, 2])
+            self.assertAlmostEqual(recorder.to_wall_time(monotonic()), time(), delta=1.0)
+
+    def test_reopen_after_restart_is_refused(self):
+        #Der letzte Record liegt nach der aktuellen monotonen Zeit, wie nach einem Neustart des Rechners
+        with ProcessImageRecorder(self.path, capacity=10) as recorder:
+            recorder.record([1] * 6, timestamp=monotonic() + 1000)
+        with self.assertRaises(ValueError):
+            ProcessImageRecorder(self.path)
+
+    def test_reopen_with_other_monotonic_clock_is_refused(self):
+        #Wanduhr und monotone Uhr im Header passen nicht zur aktuellen monotonen Uhr
+        with ProcessImageRecorder(self.path, capacity=10):
+            pass
+        header = list(ProcessImageRecorder.read_header(self.path))
+        header[5] -= 3600
+        with open(self.path, 'r+b') as f:
+            f.write(ProcessImageRecorder.HEADER.pack(*header))
+        with self.assertRaises(ValueError):
+            ProcessImageRecorder(self.path)
+        #Lesen bleibt möglich
+        self.assertEqual(ProcessImageRecorder.load(self.path), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from threading import Thread
+
+from TransportSimulator import TransportSimulator
+from ModbusConnection import ModbusConnectionPool
+from TransportOutputModule import TransportOutputModule
+from ProcessImageScanner import ProcessImageScanner, ScannerStoppedError
+from test_TransportOutputModule import free_port
+
+
+class ProcessImageScannerTest(unittest.TestCase):
+    """
+    Prüft den ProcessImageScanner gegen den TransportSimulator, ohne Hardware.
+    """
+
+    def setUp(self):
+        port = free_port()
+        self.simulator = TransportSimulator(port=port)
+        self.simulator.start()
+        self.pool = ModbusConnectionPool(port=port)
+        self.module = TransportOutputModule('127.0.0.1', connection_pool=self.pool, metrics=None)
+        self.scanner = ProcessImageScanner(self.module, cycle_time=0.01)
+
+    def tearDown(self):
+        self.scanner.stop()
+        self.scanner.join()
+        self.pool.close()
+        self.simulator.stop()
+
+    def test_failed_scan_keeps_scanning(self):
+        read_process_image = self.module.read_process_image
+        failures = []
+
+        def fail_once():
+            if not failures:
+                failures.append(True)
+                raise TypeError("unsupported operand type(s)")
+            return read_process_image()
+
+        self.module.read_process_image = fail_once
+        self.scanner.start()
+        self.simulator.add_workpiece('A')
+        self.assertTrue(self.scanner.wait_for('A', 'begin', True, timeout=5))
+        self.assertTrue(failures)
+        self.assertTrue(self.scanner.is_scanning())
+
+    def test_waiters_fail_when_scanner_stops(self):
+        self.scanner.start()
+        errors = []
+
+        def wait():
+            try:
+                self.scanner.wait_for('A', 'end', True)
+            except ScannerStoppedError as e:
+                errors.append(e)
+
+        thread = Thread(target=wait)
+        thread.start()
+        self.scanner.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        with self.assertRaises(ScannerStoppedError):
+            self.scanner.wait_for_edge('A', 'end', True)
+
+        #wait_until() liest ohne laufenden Scanner selbst
+        self.simulator.add_workpiece('A')
+        self.module.wait_until(('A', 'begin'), timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import socket
+import unittest
+from threading import Thread, Event
+
+from TransportSimulator import TransportSimulator
+from ModbusConnection import ModbusConnectionPool, ModbusTimeoutError, RetryPolicy
+from TransportOutputModule import TransportOutputModule
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TransportOutputModuleTest(unittest.TestCase):
+    """
+    Prüft das TransportOutputModule gegen den TransportSimulator, ohne Hardware.
+    """
+
+    def setUp(self):
+        port = free_port()
+        self.simulator = TransportSimulator(port=port)
+        self.simulator.start()
+        self.pool = ModbusConnectionPool(port=port)
+
+    def tearDown(self):
+        self.pool.close()
+        self.simulator.stop()
+
+    def module(self):
+        return TransportOutputModule('127.0.0.1', connection_pool=self.pool, metrics=None)
+
+    def device_outputs(self):
+        #Liest die Ausgänge direkt aus dem Simulator, nicht aus dem Ausgangsabbild der Module
+        return self.simulator.data_bank.get_holding_registers(TransportSimulator.OUTPUT_ADDRESS, TransportSimulator.OUTPUT_WORDS)
+
+    def is_forward(self, conveyor_id):
+        offset, mask = TransportOutputModule.ADDRESS[conveyor_id][0]
+        return bool(self.device_outputs()[offset] & mask)
+
+    def test_batch_abort_keeps_commands_of_other_threads(self):
+        tom = self.module()
+        tom.conveyor_forward('A')
+        opened = Event()
+        release = Event()
+        #Auch bei einem fehlgeschlagenen assert darf der Thread nicht ewig warten
+        self.addCleanup(release.set)
+
+        def aborted_batch():
+            try:
+                with tom.batch():
+                    tom.conveyor_forward('B')
+                    tom.set_conveyor_speed('B', 10000)
+                    opened.set()
+                    release.wait()
+                    raise RuntimeError("abort")
+            except RuntimeError:
+                pass
+
+        thread = Thread(target=aborted_batch)
+        thread.start()
+        opened.wait()
+        #Der Befehl eines anderen Threads wird sofort geschrieben und nicht vom Batch zurückgehalten
+        tom.conveyor_stop('A')
+        self.assertFalse(self.is_forward('A'))
+        release.set()
+        thread.join()
+
+        self.assertFalse(self.is_forward('A'))
+        self.assertFalse(self.is_forward('B'))
+        self.assertEqual(self.simulator.speed['B'], 0)
+
+    def test_batch_merges_with_commands_of_other_threads(self):
+        tom = self.module()
+        opened = Event()
+        release = Event()
+        self.addCleanup(release.set)
+
+        def batch():
+            with tom.batch():
+                tom.conveyor_forward('G')
+                opened.set()
+                release.wait()
+
+        thread = Thread(target=batch)
+        thread.start()
+        opened.wait()
+        #H liegt im selben Word wie G
+        tom.conveyor_forward('H')
+        release.set()
+        thread.join()
+
+        self.assertTrue(self.is_forward('G'))
+        self.assertTrue(self.is_forward('H'))
+
+    def test_two_modules_on_one_node(self):
+        first = self.module()
+        second = self.module()
+        #G, H und K liegen im selben Word
+        first.conveyor_forward('G')
+        second.conveyor_forward('K')
+        first.conveyor_forward('H')
+
+        for conveyor_id in ('G', 'H', 'K'):
+            self.assertTrue(self.is_forward(conveyor_id), conveyor_id)
+
+        first.set_conveyor_speed('A', 10000)
+        second.set_conveyor_speed('B', 20000)
+        self.assertEqual(self.simulator.speed['A'], 10000)
+        self.assertEqual(self.simulator.speed['B'], 20000)
+
+    def test_reconnect_resyncs_output_image(self):
+        tom = self.module()
+        tom.conveyor_forward('A')
+        tom.set_conveyor_speed('A', 10000)
+
+        #Neustart des Knotens nachbilden: Ausgänge und Speeds sind zurückgesetzt und die Verbindung bricht ab
+        self.simulator.data_bank.set_holding_registers(TransportSimulator.OUTPUT_ADDRESS, [0] * TransportSimulator.OUTPUT_WORDS)
+        self.simulator.speed['A'] = 0
+        self.pool.close()
+
+        #Schon der erste Befehl nach dem Reconnect arbeitet auf dem neu gelesenen Ausgangsabbild, D liegt im selben Word wie A
+        tom.conveyor_forward('D')
+        self.assertEqual(tom.output_image, self.device_outputs())
+        self.assertTrue(self.is_forward('D'))
+        self.assertFalse(self.is_forward('A'))
+
+        #Unveränderte Speeds werden nach dem Reconnect erneut geschrieben
+        tom.update_conveyor_speed()
+        self.assertEqual(self.simulator.speed['A'], 10000)
+
+    def test_reconnect_while_writing_keeps_device_outputs(self):
+        tom = self.module()
+        tom.conveyor_forward('A')
+
+        #Der Knoten startet neu, ohne dass die Verbindung im Pool geschlossen wird: erst das Schreiben bemerkt den Reconnect
+        self.simulator.restart()
+
+        tom.conveyor_forward('D')
+        self.assertTrue(self.is_forward('D'))
+        self.assertFalse(self.is_forward('A'))
+
+    def test_failed_speed_write_raises(self):
+        tom = TransportOutputModule('127.0.0.1', connection_pool=self.pool, metrics=None, retry_policy=RetryPolicy(deadline=0.2))
+        tom.set_conveyor_speed('A', 10000)
+        self.simulator.stop()
+        self.pool.close()
+
+        with self.assertRaises(ModbusTimeoutError):
+            tom.set_conveyor_speed('A', 20000)
+        #Die Gruppe gilt nicht mehr als geschrieben und wird beim nächsten Aufruf erneut geschrieben
+        self.assertNotIn(TransportOutputModule.SPEED_GROUPS[0][0], tom.written_speed)
+
+    def test_parallel_commands_on_different_words(self):
+        tom = self.module()
+
+        def toggle(conveyor_id):
+            for i in range(20):
+                tom.conveyor_forward(conveyor_id)
+                tom.conveyor_stop(conveyor_id)
+            tom.conveyor_forward(conveyor_id)
+
+        threads = [Thread(target=toggle, args=(conveyor_id,)) for conveyor_id in TransportOutputModule.INDEX_CONVEYORS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(tom.output_image, self.device_outputs())
+        for conveyor_id in TransportOutputModule.INDEX_CONVEYORS:
+            self.assertTrue(self.is_forward(conveyor_id), conveyor_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from TransportSimulator import TransportSimulator
+from ModbusConnection import ModbusConnectionPool
+from TransportOutputModule import TransportOutputModule
+from ProcessImageScanner import ProcessImageScanner, Edge
+from WorkpieceTracker import WorkpieceTracker
+from test_TransportOutputModule import free_port
+
+
+class WorkpieceTrackerTest(unittest.TestCase):
+    """
+    Prüft das Belegungsmodell des WorkpieceTrackers mit Flanken, wie sie der ProcessImageScanner meldet.
+    """
+
+    def edge(self, tracker, device, signal, value):
+        tracker.on_edge(Edge(device, signal, value, 0.0))
+
+    def test_workpiece_passes_separator(self):
+        tracker = WorkpieceTracker()
+        self.edge(tracker, 'V1', 'workpiece_behind', True)
+        self.assertTrue(tracker.is_occupied('V1'))
+
+        #Am Ende der Strecke wird das Werkstück beim Verlassen des Vereinzelers aus dem Modell genommen
+        self.edge(tracker, 'V1', 'workpiece_behind', False)
+        self.assertFalse(tracker.is_occupied('V1'))
+        self.assertTrue(tracker.wait_free('V1', timeout=0))
+
+    def test_planned_workpiece_moves_on_after_separator(self):
+        tracker = WorkpieceTracker()
+        workpiece = tracker.add('A', plan=['V1', 'B'])
+        self.edge(tracker, 'V1', 'workpiece_behind', True)
+        self.assertEqual(tracker.get_location(workpiece), 'V1')
+
+        #Laut Plan kommt das Werkstück noch an B an, es bleibt bis dahin auf dem Vereinzeler
+        self.edge(tracker, 'V1', 'workpiece_behind', False)
+        self.assertEqual(tracker.get_location(workpiece), 'V1')
+        self.edge(tracker, 'B', 'begin', True)
+        self.assertEqual(tracker.get_location(workpiece), 'B')
+        self.assertFalse(tracker.is_occupied('V1'))
+
+
+    def test_separator_holds_and_releases_workpiece(self):
+        topology = {'A': 'V1', 'V1': 'B'}
+        port = free_port()
+        simulator = TransportSimulator(port=port, time_scale=10.0, topology=topology)
+        simulator.start()
+        self.addCleanup(simulator.stop)
+        pool = ModbusConnectionPool(port=port)
+        self.addCleanup(pool.close)
+        tom = TransportOutputModule('127.0.0.1', connection_pool=pool, metrics=None)
+        scanner = ProcessImageScanner(tom, cycle_time=0.01)
+        tracker = WorkpieceTracker(scanner, topology)
+        scanner.start()
+        self.addCleanup(scanner.stop)
+
+        tom.set_seperator('V1')
+        tom.wait_until(('V1', 'set'), timeout=5)
+        #Erst nach dem ersten Scan auflegen, damit der Sensor Anfang eine Flanke liefert
+        scanner.wait_for('A', 'begin', False, timeout=5)
+        simulator.add_workpiece('A')
+        with tom.batch():
+            tom.set_conveyor_speeds({'A': 30000, 'B': 30000})
+            tom.conveyor_forward('A')
+            tom.conveyor_forward('B')
+
+        #Der gesetzte Vereinzeler hält das Werkstück fest
+        tom.wait_until(('V1', 'workpiece_in_front'), timeout=5)
+        workpiece, = tracker.get_occupants('A')
+        self.assertFalse(scanner.wait_for('B', 'begin', True, timeout=0.2))
+        self.assertEqual(tracker.get_location(workpiece), 'A')
+
+        tom.reset_seperator('V1')
+        tom.wait_until(('B', 'begin'), timeout=5)
+        #Die Flanken werden erst nach dem Wecken der wartenden Threads an den Tracker geschickt
+        self.assertTrue(tracker.wait_free('V1', timeout=5))
+        self.assertEqual(tracker.get_location(workpiece), 'B')
+
+
+if __name__ == "__main__":
+    unittest.main()